@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2019 Alvaro Bartolome
+# See LICENSE for details.
+
+import bisect
+import itertools
+import json
+import random
+import time
+
+from twipper.utils import TWITTER_EPOCH, timestamp_to_snowflake
+
+
+VARIANTS = ['plain', 'extended', 'retweet', 'quote', 'geo']
+
+DEFAULT_MIX = {
+    'plain': 0.35,
+    'extended': 0.2,
+    'retweet': 0.3,
+    'quote': 0.1,
+    'geo': 0.05,
+}
+
+_WORDS = ['cats', 'dogs', 'python', 'data', 'twitter', 'stream', 'madrid', 'football', 'music', 'coffee', 'election',
+          'weather', 'science', 'space', 'movie', 'game', 'news', 'today', 'amazing', 'love', 'new', 'the', 'a', 'of',
+          'and', 'to', 'in', 'is', 'for', 'on', 'with', 'this', 'that', 'gato', 'perro', 'hoy', 'noticias']
+
+_LANGUAGES = ['en', 'en', 'en', 'es', 'es', 'fr', 'pt', 'ja', 'und']
+
+_DOMAINS = ['example.com', 'news.example.org', 'blog.example.net', 'youtu.be', 'instagram.com']
+
+_PLACES = [
+    ('Madrid, Spain', 'ES', [-3.8890, 40.3120, -3.5179, 40.6437]),
+    ('Paris, France', 'FR', [2.2241, 48.8156, 2.4699, 48.9022]),
+    ('Lisboa, Portugal', 'PT', [-9.2298, 38.6914, -9.0905, 38.7958]),
+]
+
+_CREATED_AT = '%a %b %d %H:%M:%S +0000 %Y'
+
+
+class CorpusGenerator(object):
+    """
+    CorpusGenerator generates synthetic tweets shaped as the ones retrieved from the Twitter API (with users, entities
+    and the usual nesting of retweets, quotes, extended tweets and places), so that the hot paths of twipper can be
+    benchmarked without credentials nor network. Generated corpora are deterministic for the same seed.
+    """
+
+    def __init__(self, seed=0, mix=None, start=1577836800000, rate=50):
+        """
+        This function is the constructor of :obj:`CorpusGenerator` class.
+
+        Args:
+            seed (:obj:`int`, optional): seed of the random generator, default is 0.
+            mix (:obj:`dict`, optional): weight of every variant on the corpus, default is `DEFAULT_MIX`.
+            start (:obj:`int`, optional): creation time of the first tweet as milliseconds since epoch.
+            rate (:obj:`int`, optional): average number of tweets generated per second, default is 50.
+        """
+
+        mix = mix or DEFAULT_MIX
+
+        for variant in mix:
+            if variant not in VARIANTS:
+                raise ValueError('variant `' + variant + '` is not valid!')
+
+        self.random = random.Random(seed)
+        self.variants = list(mix.keys())
+        self.weights = [mix[variant] for variant in self.variants]
+
+        # random.choices is not available on Python 3.5, so variants are drawn the way it does it
+        self._cumulative = list(itertools.accumulate(self.weights))
+
+        self.timestamp = start
+        self.step = 1000. / rate
+        self.sequence = 0
+
+        self.users = [self._user(index) for index in range(1000)]
+
+    def _next_id(self):
+        self.timestamp += self.random.expovariate(1. / self.step)
+        self.sequence = (self.sequence + 1) % 4096
+
+        return timestamp_to_snowflake(int(self.timestamp)) + (self.random.randrange(32) << 17) + self.sequence
+
+    def _text(self, words):
+        return ' '.join(self.random.choice(_WORDS) for _ in range(words))
+
+    def _user(self, index):
+        return {
+            'id': 10000 + index,
+            'id_str': str(10000 + index),
+            'name': 'User ' + str(index),
+            'screen_name': 'user_' + str(index),
+            'location': self.random.choice(['Madrid', 'Paris', 'London', '', 'Earth']),
+            'description': self._text(12),
+            'url': None,
+            'entities': {'description': {'urls': []}},
+            'protected': False,
+            'followers_count': int(self.random.paretovariate(1.2) * 50),
+            'friends_count': self.random.randrange(2000),
+            'listed_count': self.random.randrange(50),
+            'created_at': 'Wed Aug 14 18:02:28 +0000 2013',
+            'favourites_count': self.random.randrange(10000),
+            'verified': self.random.random() < 0.02,
+            'statuses_count': self.random.randrange(50000),
+            'lang': None,
+            'profile_image_url_https': 'https://pbs.twimg.com/profile_images/' + str(index) + '/normal.jpg',
+            'default_profile': True,
+        }
+
+    def _entities(self, text):
+        hashtags = [word for word in text.split() if word.startswith('#')]
+        mentions = [word for word in text.split() if word.startswith('@')]
+
+        urls = list()
+
+        if self.random.random() < 0.3:
+            domain = self.random.choice(_DOMAINS)
+            urls.append({'url': 'https://t.co/abc' + str(self.random.randrange(10000)),
+                         'expanded_url': 'https://' + domain + '/' + str(self.random.randrange(10 ** 6)),
+                         'display_url': domain + '/...', 'indices': [0, 23]})
+
+        return {
+            'hashtags': [{'text': hashtag[1:], 'indices': [0, len(hashtag)]} for hashtag in hashtags],
+            'symbols': [],
+            'user_mentions': [{'screen_name': mention[1:], 'name': mention[1:], 'id': 1, 'indices': [0, len(mention)]}
+                              for mention in mentions],
+            'urls': urls,
+        }
+
+    def _status(self, words=12):
+        tweet_id = self._next_id()
+        user = self.random.choice(self.users)
+
+        text = self._text(words)
+
+        if self.random.random() < 0.4:
+            text += ' #' + self.random.choice(_WORDS)
+
+        if self.random.random() < 0.3:
+            text = '@' + self.random.choice(self.users)['screen_name'] + ' ' + text
+
+        return {
+            'created_at': _created_at(tweet_id),
+            'id': tweet_id,
+            'id_str': str(tweet_id),
+            'text': text,
+            'source': '<a href="http://twitter.com/download/android" rel="nofollow">Twitter for Android</a>',
+            'truncated': False,
+            'in_reply_to_status_id': None,
+            'in_reply_to_user_id': None,
+            'in_reply_to_screen_name': None,
+            'user': user,
+            'geo': None,
+            'coordinates': None,
+            'place': None,
+            'is_quote_status': False,
+            'quote_count': 0,
+            'reply_count': self.random.randrange(5),
+            'retweet_count': self.random.randrange(100),
+            'favorite_count': self.random.randrange(500),
+            'entities': self._entities(text),
+            'favorited': False,
+            'retweeted': False,
+            'filter_level': 'low',
+            'lang': self.random.choice(_LANGUAGES),
+            'timestamp_ms': str((tweet_id >> 22) + TWITTER_EPOCH),
+        }
+
+    def tweet(self, variant=None):
+        """
+        This function generates a tweet of the introduced variant, or of a random one based on the mix if `None`.
+        """
+
+        if variant is None:
+            point = self.random.random() * self._cumulative[-1]
+            variant = self.variants[bisect.bisect(self._cumulative, point, 0, len(self.variants) - 1)]
+
+        if variant == 'extended':
+            tweet = self._status(words=45)
+            full_text = tweet['text']
+
+            tweet['extended_tweet'] = {'full_text': full_text, 'display_text_range': [0, len(full_text)],
+                                       'entities': tweet['entities']}
+            tweet['text'] = full_text[:137] + '...'
+            tweet['truncated'] = True
+        elif variant == 'retweet':
+            original = self.tweet(self.random.choice(['plain', 'extended', 'quote']))
+
+            tweet = self._status()
+            tweet['text'] = ('RT @' + original['user']['screen_name'] + ': ' + original['text'])[:140]
+            tweet['retweeted_status'] = original
+            tweet['entities'] = original['entities']
+        elif variant == 'quote':
+            quoted = self.tweet(self.random.choice(['plain', 'extended']))
+
+            tweet = self._status()
+            tweet['is_quote_status'] = True
+            tweet['quoted_status_id'] = quoted['id']
+            tweet['quoted_status_id_str'] = quoted['id_str']
+            tweet['quoted_status'] = quoted
+        elif variant == 'geo':
+            tweet = self._status()
+            name, country, box = self.random.choice(_PLACES)
+
+            longitude = self.random.uniform(box[0], box[2])
+            latitude = self.random.uniform(box[1], box[3])
+
+            tweet['coordinates'] = {'type': 'Point', 'coordinates': [longitude, latitude]}
+            tweet['geo'] = {'type': 'Point', 'coordinates': [latitude, longitude]}
+            tweet['place'] = {
+                'id': 'place' + country, 'place_type': 'city', 'name': name.split(',')[0], 'full_name': name,
+                'country_code': country, 'country': name.split(', ')[1],
+                'bounding_box': {'type': 'Polygon', 'coordinates': [[[box[0], box[1]], [box[0], box[3]],
+                                                                     [box[2], box[3]], [box[2], box[1]]]]},
+            }
+        else:
+            tweet = self._status()
+
+        return tweet
+
+    def tweets(self, count):
+        """
+        This function generates a :obj:`list` of `count` tweets.
+        """
+
+        return [self.tweet() for _ in range(count)]
+
+    def stream(self, count, keep_alive=0.01):
+        """
+        This function generates `count` tweets encoded as retrieved from the Twitter Streaming API, this is, as
+        `\\r\\n` delimited JSON messages with some blank keep-alive lines in between.
+        """
+
+        lines = list()
+
+        for tweet in self.tweets(count):
+            lines.append(json.dumps(tweet).encode('utf-8'))
+
+            if self.random.random() < keep_alive:
+                lines.append(b'')
+
+        return b'\r\n'.join(lines) + b'\r\n'
+
+
+def _created_at(tweet_id):
+    return time.strftime(_CREATED_AT, time.gmtime(((tweet_id >> 22) + TWITTER_EPOCH) // 1000))
+
+
+def generate_tweets(count, seed=0, mix=None):
+    """
+    This function generates a deterministic corpus of `count` synthetic tweets.
+    """
+
+    return CorpusGenerator(seed=seed, mix=mix).tweets(count)
+
+
+def generate_stream(count, seed=0, mix=None):
+    """
+    This function generates a deterministic stream of `count` synthetic tweets as raw bytes.
+    """
+
+    return CorpusGenerator(seed=seed, mix=mix).stream(count)
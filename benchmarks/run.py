@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2019 Alvaro Bartolome
+# See LICENSE for details.
+
+import argparse
+import datetime
+import gc
+import glob
+import json
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import twipper
+import twipper.batch as batch
+import twipper.premium as premium
+import twipper.query as query
+import twipper.streaming as streaming
+from twipper.framing import iter_messages
+from twipper.normalize import pd, tweets_to_dataframe
+from twipper.sampling import ReservoirSampler, StratifiedSampler
+
+from benchmarks.corpus import CorpusGenerator
+from benchmarks.server import StandInServer, redirect_requests
+
+
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+QUERIES = [
+    'cats',
+    'cats dogs',
+    'cats OR dogs',
+    '"big cats" OR (dogs -puppies)',
+    '(python OR #python) (data OR science) lang:en -is:retweet',
+    'from:user_1 OR from:user_2 OR from:user_3 OR from:user_4 OR from:user_5',
+    '(madrid OR paris OR lisboa) (football OR music OR coffee) (today OR news) -spam',
+]
+
+
+def _chunks(data, size=64 * 1024):
+    return [data[index:index + size] for index in range(0, len(data), size)]
+
+
+def bench_stream_parse(context):
+    chunks = context['chunks']
+
+    def run():
+        count = 0
+
+        for line in iter_messages(chunks):
+            if streaming._parse_line(line, False, None) is not None:
+                count += 1
+
+        return count
+
+    return run
+
+
+def bench_stream_filter_retweets(context):
+    chunks = context['chunks']
+
+    def run():
+        for line in iter_messages(chunks):
+            streaming._parse_line(line, True, None)
+
+        return context['size']
+
+    return run
+
+
+def bench_stream_projection(context):
+    chunks = context['chunks']
+    fields = ['id', 'user.screen_name', 'lang', 'entities.hashtags']
+
+    def run():
+        for line in iter_messages(chunks):
+            streaming._parse_line(line, False, fields)
+
+        return context['size']
+
+    return run
+
+
+def bench_stream_sample(context, sampler=ReservoirSampler):
+    chunks = context['chunks']
+
+    def run():
+        instance = sampler(100, seed=0)
+
+        for line in iter_messages(chunks):
+            instance.offer(line)
+
+        instance.sample()
+
+        return context['size']
+
+    return run
+
+
+def bench_stream_sample_stratified(context):
+    return bench_stream_sample(context, sampler=StratifiedSampler)
+
+
+def bench_query_compile(context):
+    def run():
+        count = 0
+
+        for _ in range(max(1, context['size'] // 1000)):
+            query._parse.cache_clear()
+            query._compile.cache_clear()
+
+            for item in QUERIES:
+                for syntax in query.SYNTAXES[:2]:
+                    query.compile_query(item, syntax=syntax)
+                    count += 1
+
+        return count
+
+    return run
+
+
+def bench_query_compile_cached(context):
+    def run():
+        count = 0
+
+        for _ in range(max(1, context['size'] // 10)):
+            for item in QUERIES:
+                query.compile_query(item, syntax='standard')
+                count += 1
+
+        return count
+
+    return run
+
+
+def bench_batch_pages(context, prefetch=1):
+    server, access = context['server'], context['access']
+    pages = max(1, context['size'] // 100)
+
+    def run():
+        with redirect_requests(server.url):
+            return len(batch.search_tweets(access, 'benchmark', page_count=pages, count=100, prefetch=prefetch))
+
+    return run
+
+
+def bench_batch_pages_sequential(context):
+    return bench_batch_pages(context, prefetch=0)
+
+
+def bench_premium_pages(context, prefetch=1):
+    server, access = context['server'], context['access']
+    pages = max(1, context['size'] // 100)
+
+    def run():
+        with redirect_requests(server.url):
+            return len(premium.search_tweets(access, 'benchmark', pages, '202001010000', '202001020000',
+                                             prefetch=prefetch))
+
+    return run
+
+
+def bench_premium_pages_sequential(context):
+    return bench_premium_pages(context, prefetch=0)
+
+
+def bench_normalize(context):
+    tweets = context['tweets']
+
+    def run():
+        return len(tweets_to_dataframe(tweets))
+
+    return run if pd is not None else None
+
+
+def bench_normalize_pandas(context):
+    tweets = context['tweets']
+
+    def run():
+        return len(pd.json_normalize(tweets))
+
+    return run if pd is not None else None
+
+
+BENCHMARKS = [
+    ('stream_parse', bench_stream_parse),
+    ('stream_filter_retweets', bench_stream_filter_retweets),
+    ('stream_projection', bench_stream_projection),
+    ('stream_sample', bench_stream_sample),
+    ('stream_sample_stratified', bench_stream_sample_stratified),
+    ('query_compile', bench_query_compile),
+    ('query_compile_cached', bench_query_compile_cached),
+    ('batch_pages', bench_batch_pages),
+    ('batch_pages_sequential', bench_batch_pages_sequential),
+    ('premium_pages', bench_premium_pages),
+    ('premium_pages_sequential', bench_premium_pages_sequential),
+    ('normalize', bench_normalize),
+    ('normalize_pandas', bench_normalize_pandas),
+]
+
+
+def measure(function, repeat):
+    """
+    This function runs the introduced benchmark `repeat` times (after a warm-up run) with the garbage collector
+    disabled, returning the timings along with the number of items processed per run.
+    """
+
+    items = function()
+
+    timings = list()
+
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+
+        try:
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+
+    best = min(timings)
+
+    return {
+        'items': items,
+        'best': best,
+        'mean': sum(timings) / len(timings),
+        'rate': items / best if best > 0 else None,
+    }
+
+
+def previous_results(directory, version):
+    """
+    This function retrieves the latest stored results of a version other than the introduced one, if any.
+    """
+
+    candidates = list()
+
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        with open(path) as file:
+            results = json.load(file)
+
+        if results.get('version') != version:
+            candidates.append(results)
+
+    if not candidates:
+        return None
+
+    return max(candidates, key=lambda results: results['timestamp'])
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='twipper benchmark suite')
+    parser.add_argument('--size', type=int, default=10000, help='number of tweets of the synthetic corpus')
+    parser.add_argument('--repeat', type=int, default=5, help='number of measured runs per benchmark')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic corpus')
+    parser.add_argument('--latency', type=float, default=5., help='milliseconds the stand-in server takes per page')
+    parser.add_argument('--only', nargs='*', default=None, help='names of the benchmarks to run')
+    parser.add_argument('--output', default=RESULTS, help='directory where results are stored')
+    parser.add_argument('--label', default=twipper.__version__, help='label of the results, default is the version')
+    parser.add_argument('--no-save', action='store_true', help='do not store the results')
+
+    arguments = parser.parse_args(arguments)
+
+    generator = CorpusGenerator(seed=arguments.seed)
+
+    stream = generator.stream(arguments.size)
+    tweets = generator.tweets(arguments.size)
+
+    server = StandInServer(tweets, latency=arguments.latency / 1000.).start()
+
+    try:
+        with redirect_requests(server.url):
+            access = twipper.Twipper('consumer_key', 'consumer_secret', 'access_token', 'access_token_secret')
+
+        access.plan = 'fullarchive'
+        access.label = 'benchmark'
+
+        context = {
+            'size': arguments.size,
+            'chunks': _chunks(stream),
+            'tweets': tweets,
+            'server': server,
+            'access': access,
+        }
+
+        results = dict()
+
+        for name, benchmark in BENCHMARKS:
+            if arguments.only and name not in arguments.only:
+                continue
+
+            function = benchmark(context)
+
+            # benchmarks return no function when their optional dependencies are not installed
+            if function is None:
+                continue
+
+            results[name] = measure(function, arguments.repeat)
+    finally:
+        server.stop()
+
+    report = {
+        'version': arguments.label,
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'size': arguments.size,
+        'repeat': arguments.repeat,
+        'results': results,
+    }
+
+    previous = previous_results(arguments.output, arguments.label)
+
+    print('%-26s %12s %14s %10s' % ('benchmark', 'best (s)', 'items/s', 'change'))
+
+    for name, result in results.items():
+        change = ''
+
+        if previous and name in previous['results'] and previous['results'][name]['rate']:
+            change = '%+.1f%%' % (100. * (result['rate'] / previous['results'][name]['rate'] - 1))
+
+        print('%-26s %12.4f %14.0f %10s' % (name, result['best'], result['rate'] or 0, change))
+
+    if previous:
+        print('\ncompared against ' + previous['version'] + ' (' + previous['timestamp'] + ')')
+
+    if not arguments.no_save:
+        os.makedirs(arguments.output, exist_ok=True)
+
+        with open(os.path.join(arguments.output, arguments.label + '.json'), 'w') as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2019 Alvaro Bartolome
+# See LICENSE for details.
+
+import json
+import socketserver
+import threading
+import time
+
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+
+TWITTER_API = 'https://api.twitter.com'
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, payload, status=200):
+        body = payload if isinstance(payload, bytes) else json.dumps(payload).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+
+        self.server.wait()
+
+        path = urlsplit(self.path).path
+
+        if path == '/oauth2/token':
+            return self._send({'token_type': 'bearer', 'access_token': 'benchmark'})
+
+        if path.startswith('/1.1/tweets/search/'):
+            request = json.loads(body.decode('utf-8'))
+            page = int(request.get('next', 0))
+
+            return self._send(self.server.premium_page(page))
+
+        self._send({'errors': [{'message': 'not found'}]}, status=404)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+
+        self.server.wait()
+
+        if url.path == '/1.1/search/tweets.json':
+            page = int(parse_qs(url.query).get('page', ['0'])[0])
+
+            return self._send(self.server.standard_page(page))
+
+        self._send({'errors': [{'message': 'not found'}]}, status=404)
+
+
+class StandInServer(socketserver.ThreadingMixIn, HTTPServer):
+    """
+    StandInServer is a local HTTP server which answers the Twitter API endpoints used by twipper (the bearer token,
+    the premium search and the standard search) with pages of a synthetic corpus, so that the pagination of the search
+    functions can be benchmarked end to end without credentials nor network. Pages are encoded once, when the server
+    is created, so serving them has no cost other than the one of the connection, plus the introduced `latency` (in
+    seconds) which simulates the round trip to the Twitter API.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, tweets, page_size=100, latency=0.):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+
+        self.latency = latency
+
+        pages = [tweets[index:index + page_size] for index in range(0, len(tweets), page_size)] or [[]]
+
+        self._premium = list()
+        self._standard = list()
+
+        for index, page in enumerate(pages):
+            last = index == len(pages) - 1
+
+            premium = {'results': page, 'requestParameters': {'maxResults': page_size}}
+            standard = {'statuses': page, 'search_metadata': {'count': page_size}}
+
+            if not last:
+                premium['next'] = str(index + 1)
+                standard['search_metadata']['next_results'] = '?page=' + str(index + 1) + '&q=benchmark'
+
+            self._premium.append(json.dumps(premium).encode('utf-8'))
+            self._standard.append(json.dumps(standard).encode('utf-8'))
+
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def wait(self):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def premium_page(self, page):
+        return self._premium[min(page, len(self._premium) - 1)]
+
+    def standard_page(self, page):
+        return self._standard[min(page, len(self._standard) - 1)]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+@contextmanager
+def redirect_requests(url):
+    """
+    This context manager rewrites every request sent through :mod:`requests` to https://api.twitter.com so that it is
+    sent to the introduced url instead, by patching :meth:`requests.Session.request` (which both the functions of
+    :mod:`requests.api` and the :obj:`twipper.transport.Transport` sessions rely on).
+    """
+
+    original = requests.Session.request
+
+    def request(self, method, target, *args, **kwargs):
+        if target.startswith(TWITTER_API):
+            target = url + target[len(TWITTER_API):]
+
+        return original(self, method, target, *args, **kwargs)
+
+    requests.Session.request = request
+
+    try:
+        yield
+    finally:
+        requests.Session.request = original
@@ -13,6 +13,7 @@ setup(
     name='twipper',
     version='0.1.6',
     packages=find_packages(),
+    package_data={'twipper': ['resources/*.json']},
     url='https://github.com/alvarob96/twipper',
     download_url='https://github.com/alvarob96/twipper/archive/0.1.6.tar.gz',
     license='GNU General Public License v3 (GPLv3)',
@@ -27,6 +28,13 @@ setup(
         'oauth2>=1.9.0.post1',
         'setuptools>=41.2.0'
     ],
+    extras_require={
+        'yaml': ['PyYAML'],
+        'toml': ['tomli; python_version < "3.11"'],
+    },
+    entry_points={
+        'console_scripts': ['twipper=twipper.cli:main'],
+    },
     data_files=[],
     include_package_data=True,
     classifiers=[
@@ -5,12 +5,44 @@
 # See LICENSE for details.
 
 import pytest
+import requests
+import urllib3
 
+import json
 import os
+import socketserver
+import tempfile
+import threading
+import time
+import zlib
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from requests_oauthlib import OAuth1
+from urllib.parse import parse_qs, urlsplit
 
 from twipper.credentials import Twipper
 import twipper.batch as batch
+import twipper.premium as premium
+import twipper.sinks as sinks
 import twipper.streaming as stream
+from twipper.analytics import TrendTracker
+from twipper.archive import ArchiveReader, ArchiveWriter
+from twipper.budget import Budget
+from twipper.cli import Collector, Metrics, load_config, main
+from twipper.framing import decompress, iter_messages
+from twipper.geo import BoundingBoxIndex, PolygonIndex
+from twipper.normalize import SCHEMA, tweets_to_dataframe
+from twipper.pagination import paginate, peek_json_string
+from twipper.pool import CredentialPool
+from twipper.query import compile_query, shard_streaming_query, shard_user_query
+from twipper.retry import CircuitBreaker, RetryPolicy
+from twipper.routing import StreamRouter
+from twipper.sampling import DecayedSampler, ReservoirSampler, StratifiedSampler
+from twipper.search import LocalIndex, search_tweets
+from twipper.sinks import PartitionedReader, PartitionedSink, SQLiteSink
+from twipper.transport import Transport, authorization, get_transport, set_transport
+from twipper.utils import date_to_timestamp, snowflake_to_timestamp, snowflakes_to_timestamps, \
+    time_window_to_ids, timestamp_to_snowflake
 
 
 def test_twipper():
@@ -71,5 +103,1323 @@ def test_twipper():
         credentials.close()
 
 
+class _StreamResponse(object):
+
+    def __init__(self, status_code, chunks=()):
+        self.status_code = status_code
+        self.headers = dict()
+        self.raw = self
+        self.chunks = list(chunks)
+
+    def stream(self, size, decode_content=False):
+        return iter(self.chunks)
+
+    def close(self):
+        pass
+
+
+class _StreamTransport(object):
+
+    def __init__(self, *payloads):
+        self.payloads = list(payloads)
+        self.requests = list()
+
+    def request(self, method, url, **kwargs):
+        self.requests.append(kwargs.get('params'))
+
+        if not self.payloads:
+            return _StreamResponse(401)
+
+        return _StreamResponse(200, [self.payloads.pop(0)])
+
+
+class _JSONResponse(object):
+
+    def __init__(self, status_code, payload, headers=None):
+        self.status_code = status_code
+        self.headers = headers or dict()
+        self.content = json.dumps(payload).encode('utf-8')
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+
+class _APITransport(object):
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.requests = list()
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs))
+
+        return self.handler(method, url, kwargs)
+
+
+def _offline_access(transport):
+    access = Twipper.__new__(Twipper)
+    access.rate_limits = dict()
+    access.oauth = OAuth1('consumer_key', 'consumer_secret', 'access_token', 'access_token_secret')
+    access.oauth_token = 'oauth_token'
+    access.plan = 'fullarchive'
+    access.label = 'test'
+    access.transport = transport
+
+    return access
+
+
+def _stream_access(*payloads):
+    return _offline_access(_StreamTransport(*payloads))
+
+
+def test_routing():
+    router = StreamRouter()
+
+    router.subscribe('pets', 'cat,big dog')
+    router.subscribe('food', ['dog food', 'cat'])
+
+    assert router.track == 'cat,big dog,dog food'
+
+    assert router.route({'text': 'My big DOG eats dog-food with the #cat'}) == {'pets', 'food'}
+    assert router.route({'text': 'cats and dogs'}) == set()
+    assert router.route({'text': 'a dog, but a big one', 'quoted_status': {'text': 'cat'}}) == {'pets', 'food'}
+
+    router.unsubscribe('food')
+
+    assert router.track == 'cat,big dog'
+
+    access = _stream_access(b'{"text": "a cat"}\r\n{"text": "a frog"}\r\n{"text": "a big dog"}\r\n')
+
+    assert [tweet['text'] for _, tweet in router.stream(access, tweet_limit=3)] == ['a cat', 'a big dog']
+    assert 'language' not in access.transport.requests[0]
+
+
+def test_query():
+    assert compile_query('dog OR cat AND NOT frog') == 'dog OR (cat -frog)'
+    assert compile_query('ANDROID OR NOTEBOOK', syntax='streaming') == 'ANDROID,NOTEBOOK'
+    assert compile_query('(big OR small) dog', syntax='streaming') == 'big dog,small dog'
+    assert compile_query('"big dog" is:retweet', syntax='premium') == '"big dog" is:retweet'
+
+    with pytest.raises(ValueError):
+        compile_query('dog AND NOT frog', syntax='streaming')
+
+    with pytest.raises(ValueError):
+        compile_query('(dog OR cat')
+
+    shards = shard_streaming_query(['dog OR cat', '(big OR small) AND (dog OR cat)'], max_keywords=4)
+
+    assert shards == ['dog,cat,big dog,big cat', 'small dog,small cat']
+
+
+def test_geo():
+    index = BoundingBoxIndex({
+        'spain': '-18.39,27.43,4.59,43.99',
+        'portugal': '-31.56,29.83,-6.18,42.15',
+        'fiji': '177.0,-21.0,-178.0,-12.0',
+    })
+
+    assert len(index.boxes) == 4
+
+    assert index.locate(-3.70, 40.41) == 'spain'
+    assert index.locate(-9.13, 38.72) == 'portugal'
+    assert index.locate(179.5, -17.0) == 'fiji'
+    assert index.locate(-179.5, -17.0) == 'fiji'
+    assert index.locate(2.35, 48.85) is None
+
+    place = {'bounding_box': {'coordinates': [[[-3.9, 40.3], [-3.5, 40.3], [-3.5, 40.6], [-3.9, 40.6]]]}}
+
+    assert index.locate_tweet({'coordinates': None, 'place': place}) == 'spain'
+    assert index.locate_tweet({'coordinates': {'coordinates': [-8.61, 41.15]}}) == 'portugal'
+    assert index.locate_tweet({'coordinates': None, 'place': None}) is None
+
+    access = _stream_access(b'{"coordinates": {"coordinates": [-3.70, 40.41]}}\r\n'
+                            b'{"coordinates": {"coordinates": [2.35, 48.85]}}\r\n'
+                            b'{"coordinates": {"coordinates": [-9.13, 38.72]}}\r\n')
+
+    countries = {'spain': '-18.39,27.43,4.59,43.99', 'portugal': '-31.56,29.83,-6.18,42.15'}
+
+    tweets = stream.stream_multi_country_tweets(access, countries, tweet_limit=2)
+
+    assert [country for country, _ in tweets] == ['spain', 'portugal']
+    assert 'language' not in access.transport.requests[0]
+
+
+def test_polygons():
+    index = PolygonIndex.from_geojson(names=['spain', 'portugal'])
+
+    assert index.locate(-3.70, 40.41) == 'spain'
+    assert index.locate(-8.61, 41.15) == 'portugal'
+    assert index.locate(-16.25, 28.46) == 'spain'
+    assert index.locate(-5.80, 35.76) is None
+    assert index.locate(-0.58, 44.84) is None
+
+    index = PolygonIndex.from_geojson()
+
+    assert len(set(name for name, _ in index.polygons)) == 177
+
+    assert index.locate(13.40, 52.52) == 'germany'
+    assert index.locate(139.69, 35.69) == 'japan'
+    assert index.locate(-74.01, 40.71) == 'united states of america'
+    assert index.locate(-58.38, -34.60) == 'argentina'
+    assert index.locate(-30.00, 0.00) is None
+
+    with pytest.raises(ValueError):
+        PolygonIndex.from_geojson(names=['atlantis'])
+
+
+def test_analytics():
+    tracker = TrendTracker(window=60, buckets=6, k=10)
+
+    for second in range(100):
+        tracker.update({
+            'timestamp_ms': str(second * 1000),
+            'entities': {
+                'hashtags': [{'text': 'Cats' if second < 50 else 'dogs'}],
+                'user_mentions': [{'screen_name': 'Twitter'}],
+                'urls': [{'expanded_url': 'https://www.example.com/cats'}],
+            },
+        })
+
+    assert tracker.top('hashtags') == [('dogs', 50), ('cats', 10)]
+    assert tracker.top('mentions', n=1) == [('twitter', 60)]
+    assert tracker.top('domains', n=1) == [('example.com', 60)]
+
+    assert tracker.top('hashtags', now=200) == []
+
+
+def test_framing():
+    data = b'{"id": 1}\r\n\r\n{"id": 2}\r\n{"id": 3}\r\n'
+    chunks = [data[index:index + 5] for index in range(0, len(data), 5)]
+
+    assert [bytes(message) for message in iter_messages(chunks)] == [b'{"id": 1}', b'{"id": 2}', b'{"id": 3}']
+
+    data = b'11\r\n{"id": 1}\r\n\r\n11\r\n{"id": 2}\r\n'
+    chunks = [data[index:index + 3] for index in range(0, len(data), 3)]
+
+    assert [bytes(message) for message in iter_messages(chunks, delimited='length')] == \
+        [b'{"id": 1}\r\n', b'{"id": 2}\r\n']
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    chunks = [compressor.compress(b'{"id": 1}\r\n') + compressor.flush(zlib.Z_SYNC_FLUSH),
+              compressor.compress(b'{"id": 2}\r\n') + compressor.flush()]
+
+    assert list(decompress(chunks[:1], encoding='gzip')) == [b'{"id": 1}\r\n']
+    assert [bytes(message) for message in iter_messages(decompress(chunks, encoding='gzip'))] == \
+        [b'{"id": 1}', b'{"id": 2}']
+
+
+def test_sinks():
+    assert snowflake_to_timestamp(1212161514954293248) == 1577836800694
+    assert snowflake_to_timestamp(timestamp_to_snowflake(1577836800694)) == 1577836800694
+
+    user = {'id': 1, 'screen_name': 'alvarobartt'}
+    original = {'id': 1212161514954293248, 'text': 'big cats are cute', 'user': user}
+    retweet = {'id': 1212161514954293249, 'text': 'RT @alvarobartt: big cats are cute', 'retweeted_status': original,
+               'user': {'id': 2, 'screen_name': 'twipper'}}
+
+    path = os.path.join(tempfile.mkdtemp(), 'tweets.db')
+
+    with SQLiteSink(path, batch_size=2) as sink:
+        sink.write_many([original, retweet, retweet])
+
+        assert sink.count() == 2
+        assert sink.get(original['id'])['text'] == original['text']
+        assert len(sink.search('"big cats"')) == 2
+
+    with SQLiteSink(path) as sink:
+        assert list(sink.tee([original])) == [original]
+        assert sink.count() == 2
+        assert sink.search('dogs') == []
+
+        sink.write({'id': original['id'] + 2, 'text': 'cats', 'user': {'id': 1, 'screen_name': 'alvarobartt_'}})
+
+        assert sink.count() == 3
+        assert sink.connection.execute('SELECT screen_name FROM users WHERE id = 1').fetchall() == [('alvarobartt_',)]
+
+    schema = sinks._FTS_SCHEMA
+
+    try:
+        sinks._FTS_SCHEMA = ['CREATE VIRTUAL TABLE IF NOT EXISTS tweets_fts USING missing (text)']
+
+        with pytest.raises(ValueError):
+            SQLiteSink(os.path.join(tempfile.mkdtemp(), 'tweets.db'))
+    finally:
+        sinks._FTS_SCHEMA = schema
+
+
+def test_search():
+    base = 1212161514954293248
+
+    tweets = [
+        {'id': base, 'text': 'Big cats are cute #cats', 'lang': 'en', 'user': {'screen_name': 'alvarobartt'}},
+        {'id': base + (60000 << 22), 'text': 'cats and dogs', 'lang': 'en', 'user': {'screen_name': 'twipper'}},
+        {'id': base + (120000 << 22), 'text': 'los gatos grandes', 'lang': 'es', 'user': {'screen_name': 'twipper'},
+         'retweeted_status': {'id': base - 1, 'text': 'los gatos grandes'}},
+    ]
+
+    index = LocalIndex(reversed(tweets))
+
+    def ids(query, **kwargs):
+        return [tweet['id'] for tweet in index.search(query, **kwargs)]
+
+    assert ids('cats') == [tweets[1]['id'], tweets[0]['id']]
+    assert ids('#cats') == [tweets[0]['id']]
+    assert ids('"big cats"') == [tweets[0]['id']]
+    assert ids('"cats big"') == []
+    assert ids('cats -dogs') == [tweets[0]['id']]
+    assert ids('dogs OR gatos', filter_retweets=True) == [tweets[1]['id']]
+    assert ids('from:twipper lang:es') == [tweets[2]['id']]
+    assert ids('NOT from:twipper') == [tweets[0]['id']]
+    assert ids('cats', start=1577836800694 + 1) == [tweets[1]['id']]
+
+    with pytest.raises(ValueError):
+        index.search('cats near:madrid')
+
+    index.cover(1577836800000, 1577836860000)
+    index.cover(1577836860000, 1577836920000)
+
+    assert index.intervals == [(1577836800000, 1577836920000)]
+    assert index.gaps(1577836700000, 1577837000000) == [(1577836700000, 1577836800000), (1577836920000, 1577837000000)]
+
+    assert len(search_tweets(index, None, 'cats OR gatos', 1, '202001010000', '202001010010')) == 3
+
+    base = timestamp_to_snowflake(1577923200000)
+
+    def premium_page(method, url, kwargs):
+        if 'dogs' in json.loads(kwargs['data'])['query']:
+            return _JSONResponse(200, {'results': [{'id': base + ((1000 + index) << 22), 'text': 'dogs'}
+                                                    for index in range(100)], 'next': 'dogs'})
+
+        return _JSONResponse(200, {'results': [{'id': base, 'text': 'cats'}]})
+
+    access = _offline_access(_APITransport(premium_page))
+    index = LocalIndex()
+
+    for _ in range(3):
+        assert len(search_tweets(index, access, 'cats', 1, '202001020000', '202001020100')) == 1
+
+    assert len(access.transport.requests) == 1
+    assert index.intervals == []
+    assert index.gaps(1577923200000, 1577926800000, search=('cats', None, False, False)) == []
+
+    assert len(search_tweets(index, access, 'dogs', 1, '202001020000', '202001020100')) == 100
+    assert index.gaps(1577923200000, 1577926800000, search=('dogs', None, False, False)) == \
+        [(1577923200000, 1577923201000)]
+
+
+def test_archive():
+    base = 1212161514954293248
+
+    tweets = [{'id': base + (index << 22), 'text': 'tweet ' + str(index)} for index in range(100)]
+
+    path = os.path.join(tempfile.mkdtemp(), 'tweets.ndjson')
+
+    with ArchiveWriter(path) as writer:
+        assert list(writer.tee(tweets[50:])) == tweets[50:]
+
+    with ArchiveWriter(path, append=True) as writer:
+        writer.write_many(tweets[:50] + tweets[:1])
+
+    with ArchiveReader(path) as reader:
+        assert len(reader) == 100
+        assert list(reader.ids()) == [tweet['id'] for tweet in tweets]
+        assert reader.get(tweets[42]['id']) == tweets[42]
+        assert reader.get(base - 1) is None
+        assert list(reader.scan(tweets[10]['id'], tweets[13]['id'])) == tweets[10:13]
+        assert list(reader.between(1577836800694 + 10, 1577836800694 + 12)) == tweets[10:12]
+
+    with ArchiveWriter(path) as writer:
+        pass
+
+    with ArchiveReader(path) as reader:
+        assert len(reader) == 0 and list(reader.scan()) == []
+
+    writer = ArchiveWriter(path, append=True)
+    writer.write_many(tweets[:3])
+    writer._file.flush()
+
+    with open(path, 'ab') as file:
+        file.write(b'{"id": ' + str(base).encode('utf-8'))
+
+    with ArchiveWriter(path, append=True) as writer:
+        writer.write(tweets[3])
+
+    with ArchiveReader(path) as reader:
+        assert list(reader.scan()) == tweets[:4]
+
+    with ArchiveReader(path) as reader:
+        scan, raw = reader.scan(), reader.scan(raw=True)
+
+        assert next(scan) == tweets[0]
+
+        view = next(raw)
+
+    assert view.tobytes() == json.dumps(tweets[0], separators=(',', ':')).encode('utf-8')
+
+
+def test_partitions():
+    base = 1212161514954293248
+
+    tweets = [{'id': base + ((index * 1800000) << 22), 'text': 'tweet ' + str(index)} for index in range(6)]
+
+    path = tempfile.mkdtemp()
+
+    with PartitionedSink(path, partition='hour', max_open=1) as sink:
+        sink.write_many(tweets[::2])
+        assert list(sink.tee(tweets[1::2])) == tweets[1::2]
+
+    reader = PartitionedReader(path)
+
+    assert [manifest['partition'] for manifest in reader.manifests] == ['2020010100', '2020010101', '2020010102']
+    assert [manifest['count'] for manifest in reader.manifests] == [2, 2, 2]
+    assert reader.count == 6
+
+    start = 1577836800694 + 3600000
+
+    assert len(reader.partitions(start=start, end=start + 1)) == 1
+    assert list(reader.scan(start=start, end=start + 3600000)) == tweets[2:4]
+    assert list(reader.scan(start_id=tweets[3]['id'])) == tweets[3:]
+    assert reader.get(tweets[4]['id']) == tweets[4]
+    assert reader.get(base - 1) is None
+
+
+def test_snowflakes():
+    ids = [1212161514954293248, str(1212161514954293248 + (1000 << 22))]
+
+    assert list(snowflakes_to_timestamps(ids)) == [1577836800694, 1577836801694]
+    assert date_to_timestamp('202001010000') == 1577836800000
+    assert date_to_timestamp('2020-01-01', '%Y-%m-%d') == 1577836800000
+
+    with pytest.raises(ValueError):
+        date_to_timestamp('202013010000')
+
+    since_id, max_id = time_window_to_ids(1577836800000, 1577836801000)
+
+    assert since_id < timestamp_to_snowflake(1577836800000) <= since_id + 1
+    assert snowflake_to_timestamp(max_id) == 1577836800999
+    assert time_window_to_ids() == (None, None)
+
+
+def test_normalize():
+    base = 1212161514954293248
+
+    original = {'id': base, 'text': 'big cats are...', 'extended_tweet': {'full_text': 'big cats are cute'},
+                'retweet_count': 3, 'user': {'id': 1, 'screen_name': 'alvarobartt', 'verified': True}}
+    retweet = {'id': base + (1000 << 22), 'full_text': 'RT @alvarobartt: big cats are...', 'retweet_count': 3,
+               'retweeted_status': original, 'user': {'id': 2, 'screen_name': 'twipper'}, 'lang': 'en'}
+    quote = {'id': base + (2000 << 22), 'full_text': 'so true', 'is_quote_status': True, 'quoted_status': original,
+             'user': {'id': 2, 'screen_name': 'twipper'}, 'in_reply_to_status_id': base}
+
+    data = tweets_to_dataframe([original, retweet, quote])
+
+    assert list(data.columns) == [name for name, _ in SCHEMA]
+    assert list(data['text']) == ['big cats are cute', 'big cats are cute', 'so true']
+    assert list(data['timestamp_ms']) == [1577836800694, 1577836801694, 1577836802694]
+    assert list(data['is_retweet']) == [False, True, False]
+    assert list(data['retweeted_screen_name'])[1] == 'alvarobartt'
+    assert list(data['quoted_id']) == [0, 0, base]
+    assert list(data['quoted_text'])[2] == 'big cats are cute'
+    assert list(data['in_reply_to_id']) == [0, 0, base]
+    assert list(data['retweet_count']) == [3, 3, 0]
+
+    assert len(tweets_to_dataframe([])) == 0
+
+
+def test_pool():
+    reset = int(time.time()) + 900
+
+    def rate_limit(remaining):
+        return {'x-rate-limit-limit': '180', 'x-rate-limit-remaining': str(remaining), 'x-rate-limit-reset': str(reset)}
+
+    def exhausted(method, url, kwargs):
+        return _JSONResponse(429, {'errors': [{'code': 88}]})
+
+    def page(method, url, kwargs):
+        return _JSONResponse(200, {'statuses': [{'id': 1, 'text': 'cats'}], 'search_metadata': {}}, rate_limit(170))
+
+    first, second = _offline_access(_APITransport(exhausted)), _offline_access(_APITransport(page))
+
+    first.record_rate_limit('search/tweets', rate_limit(5))
+    second.record_rate_limit('search/tweets', rate_limit(1))
+
+    pool = CredentialPool([first, second])
+
+    with pool.use('search/tweets') as access:
+        assert access is first
+
+    assert pool.acquire('search/tweets', cost=4) is first
+
+    with pytest.raises(ConnectionError):
+        pool.acquire('search/tweets', block=False, cost=2)
+
+    assert pool.acquire('search/tweets', block=False) is first
+
+    pool.release(first, 'search/tweets')
+    pool.release(first, 'search/tweets', cost=4)
+
+    streams = [pool.acquire('statuses/filter') for _ in range(2)]
+
+    assert set(map(id, streams)) == set(map(id, [first, second]))
+
+    with pytest.raises(ConnectionError):
+        pool.acquire('statuses/filter', timeout=0.05)
+
+    assert pool.search_tweets('cats', 1) == [{'id': 1, 'text': 'cats'}]
+    assert len(first.transport.requests) == len(second.transport.requests) == 1
+    assert first.rate_limits['search/tweets']['remaining'] == 0
+
+    assert pool.search_tweets('cats', page_count=3) == [{'id': 1, 'text': 'cats'}]
+    assert len(first.transport.requests) == 1
+
+    recording = threading.Event()
+
+    def record():
+        for index in range(2000):
+            first.record_rate_limit('endpoint/' + str(index), rate_limit(index))
+
+        recording.set()
+
+    threading.Thread(target=record).start()
+
+    while not recording.is_set():
+        utilization = pool.utilization()
+
+    utilization = pool.utilization()
+
+    assert utilization[0]['requests'] == {'search/tweets': 4, 'statuses/filter': 1}
+    assert utilization[1]['requests'] == {'search/tweets': 2, 'statuses/filter': 1}
+    assert utilization[1]['used']['search/tweets'] == 1. - 170. / 180
+    assert utilization[0]['inflight'] == {'statuses/filter': 1}
+    assert len(utilization[0]['rate_limits']) == 2001
+
+
+class _Server(socketserver.ThreadingMixIn, HTTPServer):
+    pass
+
+
+class _TransportHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections.append(self.client_address)
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.authorizations.append(self.headers.get('Authorization'))
+
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+
+def _transport_server():
+    server = _Server(('127.0.0.1', 0), _TransportHandler)
+    server.daemon_threads = True
+    server.connections, server.authorizations = list(), list()
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, 'http://127.0.0.1:%d/1.1/search/tweets.json?q=cats&count=100' % server.server_address[1]
+
+
+def test_transport():
+    server, url = _transport_server()
+
+    try:
+        with Transport(pool_maxsize=2) as transport:
+            for _ in range(5):
+                response = transport.request('GET', url, auth=('user', 'password'))
+
+                assert response.status_code == 200
+                assert response.json() == dict()
+
+        assert len(server.connections) == 1
+        assert server.authorizations == [authorization(('user', 'password'), 'GET', url)] * 5
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    oauth = OAuth1('consumer_key', 'consumer_secret', 'access_token', 'access_token_secret',
+                   nonce='nonce', timestamp='1577836800')
+
+    signed = oauth(requests.Request('GET', url).prepare()).headers['Authorization']
+
+    assert authorization(oauth, 'GET', url) == signed.decode('utf-8')
+
+    signed = oauth(requests.Request('POST', url, data={'query': 'cats dogs'}).prepare()).headers['Authorization']
+
+    assert authorization(oauth, 'POST', url, body='query=cats+dogs',
+                         headers={'Content-Type': 'application/x-www-form-urlencoded'}) == signed.decode('utf-8')
+
+    with pytest.raises(ValueError):
+        Transport(pool_maxsize=0)
+
+    with pytest.raises(ValueError):
+        set_transport(None)
+
+    default = get_transport()
+
+    assert get_transport() is default
+
+    transport = Transport()
+    set_transport(transport)
+
+    assert get_transport() is transport
+
+    set_transport(default)
+    transport.close()
+
+
+def test_transport_http2():
+    pytest.importorskip('httpx')
+    pytest.importorskip('h2')
+
+    server, url = _transport_server()
+
+    oauth = OAuth1('consumer_key', 'consumer_secret', 'access_token', 'access_token_secret')
+
+    try:
+        with Transport(http2=True) as transport:
+            for _ in range(3):
+                response = transport.request('GET', url, auth=oauth)
+
+                assert response.status_code == 200
+                assert response.json() == dict()
+
+        assert len(server.connections) == 1
+        assert all(value.startswith('OAuth ') and 'oauth_signature=' in value for value in server.authorizations)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_parallel_parsing():
+    lines = list()
+
+    for index in range(40):
+        tweet = {'id': index, 'text': 'cats', 'user': {'screen_name': 'user', 'followers_count': index}}
+
+        if index % 4 == 3:
+            tweet['retweeted_status'] = {'id': 1000 + index}
+
+        lines.append(json.dumps(tweet).encode('utf-8'))
+
+    payload = b'\r\n'.join(lines) + b'\r\n'
+
+    chunk = [lines[0], b'{', lines[3], b'\xff', lines[1]]
+
+    tweets, errors = stream._parse_chunk(chunk, True, ['id', 'user.screen_name'])
+
+    assert tweets == [{'id': 0, 'user': {'screen_name': 'user'}}, {'id': 1, 'user': {'screen_name': 'user'}}]
+    assert errors == [1, 1]
+
+    serial = list(stream.stream_tweets(_stream_access(payload), 'cats', tweet_limit=40))
+
+    assert [tweet['id'] for tweet in serial] == list(range(40))
+
+    ordered = stream.stream_tweets(_stream_access(payload), 'cats', filter_retweets=True, tweet_limit=30,
+                                   fields=['id', 'user.screen_name'], workers=2, chunk_size=4)
+
+    assert list(ordered) == [{'id': index, 'user': {'screen_name': 'user'}} for index in range(40) if index % 4 != 3]
+
+    unordered = stream.stream_tweets(_stream_access(payload), 'cats', tweet_limit=40, workers=2, chunk_size=3,
+                                     ordered=False)
+
+    assert sorted(tweet['id'] for tweet in unordered) == list(range(40))
+
+    broken = b'\r\n'.join(lines[:3] + [b'{', b'{', b'{'] + lines[3:]) + b'\r\n'
+
+    serial = stream.stream_tweets(_stream_access(broken), 'cats', retry=2)
+    parallel = stream.stream_tweets(_stream_access(broken), 'cats', retry=2, workers=2, chunk_size=100)
+
+    assert [tweet['id'] for tweet in serial] == [tweet['id'] for tweet in parallel] == [0, 1, 2]
+
+    parallel = stream.stream_tweets(_stream_access(broken), 'cats', retry='no_limit', tweet_limit=40, workers=2)
+
+    assert [tweet['id'] for tweet in parallel] == list(range(40))
+
+    read = list()
+
+    def slow_chunks():
+        for line in lines[:2]:
+            read.append(line)
+
+            yield line + b'\r\n'
+            yield b'\r\n'
+
+    class _SlowResponse(_StreamResponse):
+
+        def stream(self, size, decode_content=False):
+            return slow_chunks()
+
+    class _SlowTransport(_StreamTransport):
+
+        def request(self, method, url, **kwargs):
+            return _SlowResponse(200)
+
+    idle = stream.stream_tweets(_offline_access(_SlowTransport()), 'cats', tweet_limit=2, workers=2, chunk_size=100)
+
+    assert next(idle)['id'] == 0
+    assert read == lines[:1]
+
+
+def test_pagination():
+    def batch_page(method, url, kwargs):
+        page = int(url.split('page=')[1].split('&')[0]) if 'page=' in url else 0
+
+        if page == 3:
+            return _JSONResponse(503, {})
+
+        payload = {'statuses': [{'id': page * 10 + index, 'full_text': '\\"next_results\\": "?page=9"'}
+                                for index in range(10)], 'search_metadata': {'next_results': '?page=' + str(page + 1)}}
+
+        return _JSONResponse(200, payload)
+
+    sequential = batch.search_tweets(_offline_access(_APITransport(batch_page)), 'cats', page_count=5, prefetch=0,
+                                     retry_policy=RetryPolicy(retries=0))
+    prefetched = batch.search_tweets(_offline_access(_APITransport(batch_page)), 'cats', page_count=5, prefetch=2,
+                                     retry_policy=RetryPolicy(retries=0))
+
+    assert [tweet['id'] for tweet in sequential] == [tweet['id'] for tweet in prefetched] == list(range(30))
+
+    def premium_page(method, url, kwargs):
+        page = int(json.loads(kwargs['data']).get('next', '0'))
+        payload = {'results': [{'id': page * 10 + index} for index in range(10)]}
+
+        if page < 3:
+            payload['next'] = str(page + 1)
+
+        return _JSONResponse(200, payload)
+
+    transport = _APITransport(premium_page)
+
+    tweets = premium.search_tweets(_offline_access(transport), 'cats', 10, '202001010000', '202001020000', prefetch=3)
+
+    assert [tweet['id'] for tweet in tweets] == list(range(40))
+    assert len(transport.requests) == 4
+
+    with pytest.raises(ValueError):
+        batch.search_tweets(_offline_access(transport), 'cats', prefetch=-1)
+
+    fetched = list()
+
+    def fetch(cursor):
+        fetched.append(cursor)
+
+        return _JSONResponse(200, {'cursor': cursor or 0})
+
+    def parse(response, page):
+        cursor = response.json()['cursor']
+
+        return [cursor], (cursor + 1 if cursor < 5 else None)
+
+    def wrong_peek(content):
+        return 7
+
+    assert list(paginate(fetch, parse, wrong_peek, 10, prefetch=2)) == [[0], [1], [2], [3], [4], [5]]
+    assert fetched[-5:] == [1, 2, 3, 4, 5]
+
+    assert peek_json_string(b'{"text": "\\"next\\": \\"1\\"", "next": "2"}', 'next') == '2'
+    assert peek_json_string(b'{"text": "\\"next\\": \\"1\\""}', 'next') is None
+    assert peek_json_string(b'{"next": null}', 'next') is None
+
+
+def test_retry():
+    breaker = CircuitBreaker(threshold=2, cooldown=0.05)
+
+    breaker.failure('search/tweets')
+
+    assert breaker.allow('search/tweets') and breaker.state('search/tweets') == 'closed'
+
+    breaker.failure('search/tweets')
+
+    assert not breaker.allow('search/tweets') and breaker.allow('tweets/search/fullarchive')
+
+    time.sleep(0.06)
+
+    assert breaker.allow('search/tweets') and not breaker.allow('search/tweets')
+
+    breaker.success('search/tweets')
+
+    assert breaker.allow('search/tweets') and breaker.state('search/tweets') == 'closed'
+
+    assert 0 <= RetryPolicy(backoff=1., max_backoff=3.).delay(10) <= 3
+
+    def responses(*items):
+        items = list(items)
+
+        def request():
+            item = items.pop(0)
+
+            if isinstance(item, Exception):
+                raise item
+
+            return item
+
+        return request
+
+    policy = RetryPolicy(retries=2, backoff=0.)
+    reset = {'x-rate-limit-reset': str(int(time.time()))}
+
+    assert policy.send(responses(_JSONResponse(503, {}), _JSONResponse(200, {})), 'a').status_code == 200
+    assert policy.send(responses(_JSONResponse(429, {}, reset), _JSONResponse(200, {})), 'a').status_code == 200
+    assert policy.send(responses(ConnectionResetError(), _JSONResponse(200, {})), 'a').status_code == 200
+    assert policy.send(responses(_JSONResponse(429, {}), _JSONResponse(200, {})), 'a').status_code == 429
+
+    later = {'x-rate-limit-reset': str(int(time.time()) + 900)}
+
+    assert policy.send(responses(_JSONResponse(429, {}, later), _JSONResponse(200, {})), 'a').status_code == 429
+    assert policy.send(responses(*[_JSONResponse(502, {})] * 3), 'a').status_code == 502
+
+    with pytest.raises(ConnectionError):
+        policy.send(responses(*[requests.exceptions.ConnectionError()] * 3), 'b')
+
+    policy = RetryPolicy(retries=5, backoff=0., breaker=CircuitBreaker(threshold=2, cooldown=60.))
+
+    with pytest.raises(ConnectionError):
+        policy.send(responses(*[_JSONResponse(503, {})] * 6), 'c')
+
+    with pytest.raises(ConnectionError):
+        policy.send(responses(_JSONResponse(200, {})), 'c')
+
+    def batch_page(method, url, kwargs):
+        if 'page=1' in url:
+            return _JSONResponse(503, {})
+
+        return _JSONResponse(200, {'statuses': [{'id': 1}], 'search_metadata': {'next_results': '?page=1'}})
+
+    transport = _APITransport(batch_page)
+
+    tweets = batch.search_tweets(_offline_access(transport), 'cats', page_count=3,
+                                 retry_policy=RetryPolicy(retries=1, backoff=0.))
+
+    assert tweets == [{'id': 1}] and len(transport.requests) == 3
+    assert tweets.metadata == {'pages': 1, 'next': '?page=1', 'truncated': True,
+                               'error': 'connection errored with code 503.'}
+
+    tweets = batch.search_tweets(_offline_access(transport), 'cats', retry_policy=RetryPolicy(retries=0))
+
+    assert tweets.metadata == {'pages': 1, 'next': '?page=1', 'truncated': False, 'error': None}
+
+    def premium_page(method, url, kwargs):
+        if 'next' in json.loads(kwargs['data']):
+            raise ConnectionResetError()
+
+        return _JSONResponse(200, {'results': [{'id': 1}], 'next': 'page'})
+
+    tweets = premium.search_tweets(_offline_access(_APITransport(premium_page)), 'cats', 2, '202001010000',
+                                   '202001020000', retry_policy=RetryPolicy(retries=1, backoff=0.))
+
+    assert tweets == [{'id': 1}] and tweets.metadata['truncated']
+    assert tweets.metadata['error'] == 'connection to tweets/search/fullarchive could not be established.'
+
+
+def test_budget():
+    def premium_page(method, url, kwargs):
+        data = json.loads(kwargs['data'])
+        page = int(data.get('next', '0'))
+
+        return _JSONResponse(200, {'results': [{'id': page * 1000 + index} for index in range(data['maxResults'])],
+                                   'next': str(page + 1)})
+
+    path = os.path.join(tempfile.mkdtemp(), 'budget.json')
+
+    access = _offline_access(_APITransport(premium_page))
+    budget = Budget(tier='premium', requests=3, path=path)
+
+    tweets = premium.search_tweets(access, 'cats', 2, '202001010000', '202001020000', budget=budget)
+
+    assert len(tweets) == 1000 and tweets.metadata['cost'] == {'requests': 2, 'tweets': 1000}
+    assert all(json.loads(kwargs['data'])['maxResults'] == 500 for _, _, kwargs in access.transport.requests)
+
+    budget = Budget(tier='premium', requests=3, path=path)
+
+    assert budget.usage(access)['requests'] == 2 and budget.reserved == dict()
+
+    with pytest.raises(ConnectionError):
+        premium.search_tweets(access, 'cats', 2, '202001010000', '202001020000', budget=budget)
+
+    budget = Budget(tier='premium', requests=3, path=path, mode='throttle')
+
+    assert len(premium.search_tweets(access, 'cats', 2, '202001010000', '202001020000', budget=budget)) == 500
+    assert budget.cost(access, 'cats') == {'searches': 2, 'requests': 3, 'tweets': 1500}
+    assert budget.usage(access) == Budget(path=path).usage(access)
+
+    with pytest.raises(ConnectionError):
+        budget.reserve(access, 1)
+
+    shared = os.path.join(tempfile.mkdtemp(), 'budget.json')
+    budgets = [Budget(tier='premium', requests=3, path=shared) for _ in range(2)]
+
+    for budget in budgets:
+        budget.settle(access, budget.reserve(access, 1), 'cats', 1, 500)
+
+    assert all(budget.cost(access, 'cats') == {'searches': 2, 'requests': 2, 'tweets': 1000} for budget in budgets)
+    budgets[0].settle(access, budgets[0].reserve(access, 1), 'dogs', 1, 10)
+
+    with pytest.raises(ConnectionError):
+        budgets[1].reserve(access, 1)
+
+    assert Budget().caps(access) == (50, 5000) and Budget().page_size() == 100
+    assert Budget(tier='premium', tweets=600, mode='throttle').reserve(access, 5) == 1
+
+    tweets = premium.search_tweets(access, 'cats', 2, '202001010000', '202001020000')
+
+    assert len(tweets) == 200 and tweets.metadata['cost'] == {'requests': 2, 'tweets': 200}
+
+    with pytest.raises(ValueError):
+        Budget(tier='enterprise')
+
+
+def test_user_shards():
+    shards = shard_user_query(['alvarobartt', '@twipper', 'Twipper', 'cats'], query='lang:en', max_length=42)
+
+    assert shards == [('(from:alvarobartt OR from:twipper) lang:en', ['alvarobartt', 'twipper']),
+                      ('from:cats lang:en', ['cats'])]
+
+    with pytest.raises(ValueError):
+        shard_user_query(['alvarobartt'], query='lang:en', max_length=10)
+
+    users = ['user' + str(index).zfill(2) for index in range(30)]
+
+    def premium_page(method, url, kwargs):
+        rule = json.loads(kwargs['data'])['query']
+
+        assert len(rule) <= 256 and rule.endswith(' lang:en')
+
+        return _JSONResponse(200, {'results': [{'id': index, 'user': {'screen_name': user.upper()}}
+                                               for index, user in enumerate(users) if 'from:' + user in rule]})
+
+    access = _offline_access(_APITransport(premium_page))
+
+    tweets = premium.search_users_tweets(access, users, 1, '202001010000', '202001020000', language='en')
+
+    assert len(access.transport.requests) == 2
+    assert list(tweets) == users
+    assert all([tweet['user']['screen_name'] for tweet in tweets[user]] == [user.upper()] for user in users)
+    assert tweets['user00'].metadata['rule'].startswith('(from:user00 OR from:user01')
+
+    accounts = ['account' + str(index).zfill(2) for index in range(60)]
+
+    def batch_page(method, url, kwargs):
+        query = url.split('?q=')[1].split('&')[0]
+
+        assert len(query) <= 500 and query.endswith(' -filter:retweets')
+
+        statuses = [{'id': index, 'user': {'screen_name': account}}
+                    for index, account in enumerate(accounts) if 'from:' + account in query]
+
+        return _JSONResponse(200, {'statuses': statuses})
+
+    pool = CredentialPool([_offline_access(_APITransport(batch_page)), _offline_access(_APITransport(batch_page))])
+
+    tweets = list(batch.search_users_tweets(pool, accounts, filter_retweets=True, workers=2))
+
+    assert sorted(account for account, _ in tweets) == accounts
+    assert all([tweet['user']['screen_name'] for tweet in results] == [account] for account, results in tweets)
+    assert sum(len(access.transport.requests) for access in pool.credentials) == 3
+
+    with pytest.raises(ValueError):
+        batch.search_users_tweets(pool, 'account00')
+
+
+def test_backfill():
+    base = timestamp_to_snowflake(int(time.time() * 1000) - 30000)
+
+    def tweet(offset):
+        return {'created_at': 'Wed Jan 01 00:00:00 +0000 2020', 'id': base + (offset << 22), 'text': 'big dogs'}
+
+    def line(offset):
+        return json.dumps(tweet(offset)).encode('utf-8') + b'\r\n'
+
+    class _BackfillTransport(_StreamTransport):
+
+        def request(self, method, url, **kwargs):
+            if kwargs.get('stream'):
+                return _StreamTransport.request(self, method, url, **kwargs)
+
+            self.requests.append(url)
+
+            return _JSONResponse(200, {'statuses': [tweet(3000), tweet(2000), tweet(1000)], 'search_metadata': {}})
+
+    transport = _BackfillTransport(line(0) + line(1000), line(1000) + line(3000) + line(4000))
+
+    tweets = stream.stream_tweets(_offline_access(transport), 'cats,big dogs', tweet_limit=5, backfill='batch')
+
+    assert [(tweet['id'] - base) >> 22 for tweet in tweets] == [0, 1000, 2000, 3000, 4000]
+    assert transport.requests[2].startswith('https://api.twitter.com/1.1/search/tweets.json?q=cats OR (big dogs)&')
+
+    transport = _StreamTransport(line(0), line(1000))
+
+    tweets = stream.stream_tweets(_offline_access(transport), 'cats', tweet_limit=2, workers=2, backfill='premium')
+
+    assert [(tweet['id'] - base) >> 22 for tweet in tweets] == [0, 1000]
+
+    with pytest.raises(ValueError):
+        stream.stream_tweets(_offline_access(transport), 'cats', backfill='archive')
+
+    class _DroppedResponse(_StreamResponse):
+
+        def stream(self, size, decode_content=False):
+            for chunk in self.chunks:
+                yield chunk
+
+            raise urllib3.exceptions.ProtocolError('connection reset by peer')
+
+    class _FlakyTransport(_BackfillTransport):
+
+        def request(self, method, url, **kwargs):
+            if kwargs.get('stream') and self.payloads and isinstance(self.payloads[0], int):
+                self.requests.append(kwargs.get('params'))
+
+                return _StreamResponse(self.payloads.pop(0))
+
+            if kwargs.get('stream') and self.payloads and isinstance(self.payloads[0], tuple):
+                self.requests.append(kwargs.get('params'))
+
+                return _DroppedResponse(200, self.payloads.pop(0))
+
+            return _BackfillTransport.request(self, method, url, **kwargs)
+
+    backoff = stream.BACKOFF
+    stream.BACKOFF = dict((kind, (0., 0.)) for kind in backoff)
+
+    try:
+        # gaps left by network errors and failed reconnections are backfilled too
+        transport = _FlakyTransport((line(0) + line(1000),), 503, 420, line(1000) + line(3000) + line(4000))
+
+        tweets = stream.stream_tweets(_offline_access(transport), 'cats', tweet_limit=5, backfill='batch')
+
+        assert [(tweet['id'] - base) >> 22 for tweet in tweets] == [0, 1000, 2000, 3000, 4000]
+        assert len([request for request in transport.requests if isinstance(request, str)]) == 1
+
+        # every failed connection spends a retry, and the error is raised once they are exhausted
+        transport = _FlakyTransport(503, 503, 503)
+
+        with pytest.raises(ConnectionError):
+            list(stream.stream_tweets(_offline_access(transport), 'cats', retry=2))
+
+        assert len(transport.requests) == 3
+    finally:
+        stream.BACKOFF = backoff
+
+    # the rest of the HTTP errors, such as invalid credentials, are not retried
+    transport = _StreamTransport()
+
+    with pytest.raises(ConnectionError):
+        list(stream.stream_tweets(_offline_access(transport), 'cats', retry='no_limit'))
+
+    assert len(transport.requests) == 1
+
+
+def test_cli():
+    directory = tempfile.mkdtemp()
+    config_path = os.path.join(directory, 'collector.json')
+
+    def line(tweet_id):
+        return json.dumps({'created_at': 'Wed Jan 01 00:00:00 +0000 2020', 'id': tweet_id, 'text': 'cats'}).encode() + \
+            b'\r\n'
+
+    searches, posted = list(), list()
+
+    def search(method, url, kwargs):
+        params = dict((key, int(value[0])) for key, value in parse_qs(urlsplit(url).query).items()
+                      if key in ('since_id', 'max_id'))
+
+        searches.append(params)
+
+        # 150 tweets are posted between every poll, more than the 100 tweets of a page
+        if 'max_id' not in params:
+            base = timestamp_to_snowflake(int(time.time() * 1000))
+            posted.append([base + index for index in range(150)])
+
+        ids = sorted((tweet_id for batch in posted for tweet_id in batch
+                      if params['since_id'] < tweet_id <= params.get('max_id', tweet_id)), reverse=True)
+
+        metadata = {'next_results': '?max_id=' + str(ids[99] - 1) + '&q=dogs'} if len(ids) > 100 else {}
+
+        return _JSONResponse(200, {'statuses': [{'id': tweet_id} for tweet_id in ids[:100]],
+                                   'search_metadata': metadata})
+
+    transports = {'streaming': _StreamTransport(line(1), line(2) + line(3)), 'polling': _APITransport(search)}
+
+    credentials = {'consumer_key': 'k', 'consumer_secret': 's', 'access_token': 't', 'access_token_secret': 'ts'}
+
+    config = {
+        'credentials': {'streaming': credentials, 'polling': dict(credentials, access_token='${TWIPPER_TOKEN}')},
+        'metrics': {'port': 0},
+        'reload_interval': 0.05,
+        'streams': [{'name': 'cats', 'credentials': 'streaming', 'query': 'cats',
+                     'sink': {'type': 'sqlite', 'path': os.path.join(directory, 'cats.db')}}],
+        'searches': [{'name': 'dogs', 'credentials': 'polling', 'query': 'dogs', 'interval': 0.05,
+                      'sink': {'type': 'archive', 'path': os.path.join(directory, 'dogs.ndjson')}}],
+    }
+
+    def write(config):
+        with open(config_path, 'w') as f:
+            json.dump(config, f)
+
+    write(config)
+
+    with pytest.raises(ValueError):
+        load_config(config_path)
+
+    os.environ['TWIPPER_TOKEN'] = 'token'
+
+    assert load_config(config_path)['credentials']['polling']['access_token'] == 'token'
+
+    for invalid in ({'searches': [dict(config['searches'][0], api='standard')]},
+                    {'streams': config['streams'] * 2},
+                    {'streams': [dict(config['streams'][0], credentials='missing')]},
+                    {'monitoring': True}):
+        write(dict(config, **invalid))
+
+        with pytest.raises(ValueError):
+            load_config(config_path)
+
+        assert main(['check', config_path]) == 1
+
+    write(config)
+
+    assert main(['check', config_path]) == 0
+
+    collector = Collector(config_path, connect=lambda name, values: _offline_access(transports[name]))
+    collector.start()
+
+    try:
+        deadline = time.time() + 10
+
+        def counter(name):
+            return collector.metrics.counters.get((name, (('job', 'cats'),)))
+
+        while len(posted) < 3 or counter('tweets_total') != 3 or not counter('errors_total'):
+            assert time.time() < deadline
+            time.sleep(0.01)
+
+        host, port = collector.server.server_address[:2]
+
+        metrics = requests.get('http://' + host + ':' + str(port) + '/metrics').text
+
+        assert 'twipper_tweets_total{job="cats"} 3' in metrics
+        assert 'twipper_errors_total{job="cats"}' in metrics
+        assert 'twipper_job_running{job="dogs"} 1' in metrics
+
+        class _SlowJob(object):
+            spec = {'name': 'slow'}
+
+            def stop(self):
+                pass
+
+            def join(self, timeout=None):
+                time.sleep(0.5)
+
+            def is_alive(self):
+                return False
+
+        # stopped jobs are awaited without blocking the metrics endpoint
+        collector.jobs['slow'] = _SlowJob()
+
+        reload = threading.Thread(target=collector.reload)
+        reload.start()
+
+        time.sleep(0.1)
+
+        started = time.time()
+        requests.get('http://' + host + ':' + str(port) + '/metrics')
+
+        assert time.time() - started < 0.3 and reload.is_alive()
+
+        reload.join()
+
+        assert 'slow' not in collector.jobs
+
+        running = collector.jobs['cats']
+
+        write(dict(config, metrics={'port': 0}, reload_interval=-1))
+
+        assert not collector.reload()
+        assert collector.jobs['cats'] is running
+
+        write(dict(config, streams=[dict(config['streams'][0], query='kittens')]))
+
+        deadline = time.time() + 10
+
+        while collector.jobs.get('cats') in (None, running):
+            assert time.time() < deadline
+            time.sleep(0.01)
+
+        assert not running.is_alive()
+        assert collector.jobs['cats'].spec['query'] == 'kittens'
+        assert collector.metrics.counters[('reloads_total', ())] >= 1
+    finally:
+        collector.stop()
+
+    del os.environ['TWIPPER_TOKEN']
+
+    assert SQLiteSink(os.path.join(directory, 'cats.db')).count() == 3
+
+    tweets = list(ArchiveReader(os.path.join(directory, 'dogs.ndjson')).scan())
+
+    assert len(tweets) == len(set(tweet['id'] for tweet in tweets))
+    assert set(posted[0] + posted[1]) <= set(tweet['id'] for tweet in tweets)
+
+    # the first poll looks back one interval, the next ones start on the last tweet, and pages left are searched below
+    assert [sorted(params) for params in searches[:3]] == [['since_id'], ['max_id', 'since_id'], ['since_id']]
+    assert searches[2]['since_id'] == max(posted[0])
+
+    metrics = Metrics()
+    metrics.inc('tweets_total', 2, job='a "b"')
+    metrics.set('job_running', 1, job='a "b"')
+
+    assert metrics.render() == '# TYPE twipper_tweets_total counter\ntwipper_tweets_total{job="a \\"b\\""} 2\n' \
+                               '# TYPE twipper_job_running gauge\ntwipper_job_running{job="a \\"b\\""} 1\n'
+
+    toml_path = os.path.join(directory, 'collector.toml')
+
+    with open(toml_path, 'w') as f:
+        f.write('[credentials.main]\nconsumer_key = "k"\nconsumer_secret = "s"\naccess_token = "t"\n'
+                'access_token_secret = "ts"\n\n[[searches]]\nname = "users"\nusers = ["alvarobartt"]\n'
+                'api = "premium"\nsink = { type = "partitioned", path = "users" }\n')
+
+    config = load_config(toml_path)
+
+    assert config['searches'][0]['interval'] == 900
+    assert config['searches'][0]['credentials'] == [('main', {'consumer_key': 'k', 'consumer_secret': 's',
+                                                              'access_token': 't', 'access_token_secret': 'ts'})]
+
+
+def test_sampling():
+    base = timestamp_to_snowflake(1577836800000)
+
+    def line(index, seconds=0, **fields):
+        tweet = dict({'created_at': 'Wed Jan 01 00:00:00 +0000 2020', 'id': base + index + (seconds * 1000 << 22)},
+                     **fields)
+
+        return json.dumps(tweet).encode('utf-8')
+
+    sampler = ReservoirSampler(100, seed=0)
+
+    admitted = sum(sampler.offer(line(index)) for index in range(10000))
+
+    assert not sampler.offer(b'{"delete":{"status":{"id":1}}}')
+    assert sampler.seen == 10000
+
+    # Algorithm L admits about size * (1 + ln(n / size)) tweets, the rest are not even decoded
+    assert 100 < admitted < 1000
+
+    ids = [tweet['id'] - base for tweet in sampler.sample()]
+
+    assert len(set(ids)) == 100 and all(0 <= tweet_id < 10000 for tweet_id in ids)
+
+    counts = [0] * 100
+
+    for seed in range(2000):
+        sampler = ReservoirSampler(10, seed=seed)
+
+        for index in range(100):
+            sampler.offer({'id': index})
+
+        for tweet in sampler.sample():
+            counts[tweet['id']] += 1
+
+    assert abs(sum(counts[:50]) - sum(counts[50:])) < 0.1 * sum(counts)
+
+    for half_life in (60., 1.):
+        sampler = DecayedSampler(100, half_life=half_life, seed=0)
+
+        for second in range(1000):
+            for index in range(10):
+                sampler.offer(line(index, second))
+
+        seconds = [((tweet['id'] - base) >> 22) / 1000. for tweet in sampler.sample()]
+
+        # a uniform sample would average 500 seconds, while this one comes from the last few half lives (or the last
+        # seconds, as there are just 10 tweets per second)
+        assert len(seconds) == 100
+        assert sum(seconds) / 100. > 1000 - 3 * max(half_life, 10.)
+
+    with pytest.raises(ValueError):
+        DecayedSampler(10, half_life=0)
+
+    sampler = StratifiedSampler(2, seed=0)
+
+    sampler.offer(line(0, retweeted_status={'id': 1, 'lang': 'es', 'text': '\\"lang\\": \\"fr\\"'}, lang='en'))
+
+    for index in range(1, 100):
+        sampler.offer(line(index, lang='es' if index % 10 else 'ca'))
+
+    sample = sampler.sample()
+
+    assert sorted(sample) == ['ca', 'en', 'es']
+    assert [len(sample[stratum]) for stratum in ('ca', 'en', 'es')] == [2, 1, 2]
+
+    sampler = StratifiedSampler(5, key='country', max_strata=1, seed=0)
+
+    sampler.offer(line(0, place=None, retweeted_status={'place': {'country_code': 'FR'}}))
+    sampler.offer(line(1, place={'name': 'Madrid', 'country_code': 'ES'}))
+    sampler.offer(line(2, place={'country_code': 'PT'}))
+    sampler.offer({'id': 3, 'place': {'country_code': 'ES'}})
+
+    assert dict((stratum, sorted(tweet['id'] - base for tweet in tweets if tweet['id'] >= base))
+                for stratum, tweets in sampler.sample().items()) == {'ES': [1], None: [0, 2]}
+
+    sampler = StratifiedSampler(1, key=lambda tweet: tweet['user']['verified'])
+
+    sampler.offer(line(0, user={'verified': True}))
+
+    assert list(sampler.sample()) == [True]
+
+    with pytest.raises(ValueError):
+        StratifiedSampler(10, key='place')
+
+    sampler = ReservoirSampler(2, seed=0)
+
+    lines = [line(index, retweeted_status={'id': 1}) if index == 3 else line(index) for index in range(8)]
+
+    tweets = stream.stream_tweets(_stream_access(b'\r\n'.join(lines) + b'\r\n'), 'cats', retry=1,
+                                  filter_retweets=True, sampler=sampler)
+
+    streamed = list()
+
+    with pytest.raises(ConnectionError):
+        for tweet in tweets:
+            streamed.append(tweet['id'] - base)
+
+    assert streamed[:2] == [0, 1] and 3 not in streamed
+    assert sampler.seen == 7
+    assert set(tweet['id'] - base for tweet in sampler.sample()) <= set(streamed)
+
+    with pytest.raises(ValueError):
+        stream.stream_tweets(_stream_access(), 'cats', sampler=[])
+
+
 if __name__ == '__main__':
     test_twipper()
+    test_routing()
+    test_query()
+    test_geo()
+    test_polygons()
+    test_analytics()
+    test_framing()
+    test_sinks()
+    test_search()
+    test_archive()
+    test_partitions()
+    test_snowflakes()
+    test_normalize()
+    test_pool()
+    test_transport()
+    test_transport_http2()
+    test_parallel_parsing()
+    test_pagination()
+    test_retry()
+    test_budget()
+    test_user_shards()
+    test_backfill()
+    test_cli()
+    test_sampling()
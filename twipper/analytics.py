@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2019 Alvaro Bartolome
+# See LICENSE for details.
+
+import heapq
+import random
+import time
+
+from urllib.parse import urlparse
+
+
+ENTITY_KINDS = ['hashtags', 'mentions', 'domains']
+
+_PRIME = (1 << 61) - 1
+
+
+def extract_entities(tweet):
+    """
+    This function retrieves the hashtags, user mentions and url domains of a tweet straight from the entities included
+    on its payload by Twitter (the extended ones when available), so the text of the tweet does not need to be parsed.
+    Hashtags and mentions are lowercased, and domains are stripped from their `www.` prefix.
+
+    Args:
+        tweet (:obj:`dict`): tweet as retrieved from the Twitter API.
+
+    Returns:
+        :obj:`dict` - entities:
+            Returns a :obj:`dict` containing a :obj:`list` of `hashtags`, `mentions` and `domains` of the tweet.
+    """
+
+    if 'extended_tweet' in tweet and 'entities' in tweet['extended_tweet']:
+        entities = tweet['extended_tweet']['entities']
+    else:
+        entities = tweet.get('entities') or {}
+
+    domains = list()
+
+    for url in entities.get('urls', []):
+        netloc = urlparse(url.get('expanded_url') or url.get('url') or '').netloc.lower()
+
+        if netloc.startswith('www.'):
+            netloc = netloc[4:]
+
+        if netloc:
+            domains.append(netloc)
+
+    return {
+        'hashtags': [hashtag['text'].lower() for hashtag in entities.get('hashtags', []) if 'text' in hashtag],
+        'mentions': [mention['screen_name'].lower() for mention in entities.get('user_mentions', [])
+                     if 'screen_name' in mention],
+        'domains': domains,
+    }
+
+
+class CountMinSketch(object):
+    """
+    CountMinSketch is a probabilistic frequency table of fixed size, which estimates how many times an item has been
+    seen with an error of at most `e / width` times the total count with probability `1 - exp(-depth)`, never
+    underestimating it. Sketches with the same dimensions and seed can be added and subtracted.
+    """
+
+    def __init__(self, width=2048, depth=4, seed=0):
+        """
+        This function is the constructor of :obj:`twipper.analytics.CountMinSketch` class.
+
+        Args:
+            width (:obj:`int`, optional): number of counters per row, default is 2048.
+            depth (:obj:`int`, optional): number of rows (hash functions), default is 4.
+            seed (:obj:`int`, optional): seed of the hash functions, default is 0.
+
+        Raises:
+            ValueError: raised if the introduced arguments do not match or errored.
+        """
+
+        if not isinstance(width, int) or width < 1:
+            raise ValueError('width must be an `int` equal or higher than 1!')
+
+        if not isinstance(depth, int) or depth < 1:
+            raise ValueError('depth must be an `int` equal or higher than 1!')
+
+        self.width = width
+        self.depth = depth
+        self.seed = seed
+
+        generator = random.Random(seed)
+
+        self._hashes = [(generator.randrange(1, _PRIME), generator.randrange(0, _PRIME)) for _ in range(depth)]
+        self._rows = [[0] * width for _ in range(depth)]
+
+        self.total = 0
+
+    def _indices(self, item):
+        value = hash(item)
+
+        return [((a * value + b) % _PRIME) % self.width for a, b in self._hashes]
+
+    def add(self, item, count=1):
+        for row, index in zip(self._rows, self._indices(item)):
+            row[index] += count
+
+        self.total += count
+
+    def estimate(self, item):
+        return min(row[index] for row, index in zip(self._rows, self._indices(item)))
+
+    def _check(self, other):
+        if not isinstance(other, CountMinSketch) or \
+                (self.width, self.depth, self.seed) != (other.width, other.depth, other.seed):
+            raise ValueError('sketches must have the same width, depth and seed!')
+
+    def merge(self, other):
+        self._check(other)
+
+        for row, other_row in zip(self._rows, other._rows):
+            for index, value in enumerate(other_row):
+                row[index] += value
+
+        self.total += other.total
+
+    def subtract(self, other):
+        self._check(other)
+
+        for row, other_row in zip(self._rows, other._rows):
+            for index, value in enumerate(other_row):
+                row[index] -= value
+
+        self.total -= other.total
+
+
+class SpaceSaving(object):
+    """
+    SpaceSaving keeps track of the `k` most frequent items of a stream using just `k` counters, so on, whenever a new
+    item arrives and every counter is taken, the item with the lowest count is evicted and the new one inherits its
+    count (which is kept as the error bound of the new item). Every item whose frequency is higher than `total / k` is
+    guaranteed to be tracked.
+    """
+
+    def __init__(self, k=100):
+        """
+        This function is the constructor of :obj:`twipper.analytics.SpaceSaving` class.
+
+        Args:
+            k (:obj:`int`, optional): number of counters, which is the maximum number of tracked items, default is 100.
+
+        Raises:
+            ValueError: raised if the introduced arguments do not match or errored.
+        """
+
+        if not isinstance(k, int) or k < 1:
+            raise ValueError('k must be an `int` equal or higher than 1!')
+
+        self.k = k
+
+        self.counts = dict()
+        self.errors = dict()
+
+        self._heap = list()
+
+    def add(self, item, count=1):
+        if item in self.counts:
+            self.counts[item] += count
+        elif len(self.counts) < self.k:
+            self.counts[item] = count
+            self.errors[item] = 0
+        else:
+            while True:
+                minimum, evicted = heapq.heappop(self._heap)
+
+                if self.counts.get(evicted) == minimum:
+                    break
+
+            del self.counts[evicted]
+            del self.errors[evicted]
+
+            self.counts[item] = minimum + count
+            self.errors[item] = minimum
+
+        heapq.heappush(self._heap, (self.counts[item], item))
+
+        if len(self._heap) > 4 * self.k:
+            self._heap = [(value, key) for key, value in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def top(self, n=10):
+        return heapq.nlargest(n, self.counts.items(), key=lambda item: item[1])
+
+
+class TrendTracker(object):
+    """
+    TrendTracker computes the trending hashtags, mentions and url domains of a stream of tweets over a sliding time
+    window using bounded memory. The window is split into buckets, each one holding a :obj:`SpaceSaving` summary per
+    entity kind, while a :obj:`CountMinSketch` per kind keeps the counts of the whole window (buckets are subtracted
+    from it when they expire). So on, the top items can be retrieved at any time without rescanning any tweet, as the
+    candidates of every live bucket are just ranked with the sketch of the window.
+    """
+
+    def __init__(self, window=3600, buckets=12, k=100, width=2048, depth=4):
+        """
+        This function is the constructor of :obj:`twipper.analytics.TrendTracker` class.
+
+        Args:
+            window (:obj:`int`, optional): length of the sliding window in seconds, default is one hour.
+            buckets (:obj:`int`, optional): number of buckets the window is split into, default is 12.
+            k (:obj:`int`, optional): number of items tracked per bucket and entity kind, default is 100.
+            width (:obj:`int`, optional): width of the Count-Min sketches, default is 2048.
+            depth (:obj:`int`, optional): depth of the Count-Min sketches, default is 4.
+
+        Raises:
+            ValueError: raised if the introduced arguments do not match or errored.
+        """
+
+        if not isinstance(window, (int, float)) or window <= 0:
+            raise ValueError('window must be a number higher than 0!')
+
+        if not isinstance(buckets, int) or buckets < 1:
+            raise ValueError('buckets must be an `int` equal or higher than 1!')
+
+        self.window = window
+        self.span = float(window) / buckets
+        self.k = k
+        self.width = width
+        self.depth = depth
+
+        self._buckets = list()
+        self._sketches = dict((kind, CountMinSketch(width, depth)) for kind in ENTITY_KINDS)
+
+    def _bucket(self, timestamp):
+        start = int(timestamp // self.span)
+
+        self._expire(start)
+
+        if not self._buckets or self._buckets[-1][0] < start:
+            bucket = (start,
+                      dict((kind, SpaceSaving(self.k)) for kind in ENTITY_KINDS),
+                      dict((kind, CountMinSketch(self.width, self.depth)) for kind in ENTITY_KINDS))
+
+            self._buckets.append(bucket)
+
+            return bucket
+
+        for bucket in reversed(self._buckets):
+            if bucket[0] <= start:
+                return bucket
+
+        return None
+
+    def _expire(self, start):
+        oldest = start - int(round(self.window / self.span)) + 1
+
+        while self._buckets and self._buckets[0][0] < oldest:
+            _, _, sketches = self._buckets.pop(0)
+
+            for kind in ENTITY_KINDS:
+                self._sketches[kind].subtract(sketches[kind])
+
+    def update(self, tweet, timestamp=None):
+        """
+        This function adds the entities of the introduced tweet to the window they belong to, based on the
+        `timestamp_ms` of the tweet (or on the current time if not available). Tweets older than the window are ignored.
+
+        Args:
+            tweet (:obj:`dict`): tweet as retrieved from the Twitter API.
+            timestamp (:obj:`float`, optional): time of the tweet in seconds since epoch, default is `None`.
+        """
+
+        if timestamp is None:
+            if 'timestamp_ms' in tweet:
+                timestamp = int(tweet['timestamp_ms']) / 1000.
+            else:
+                timestamp = time.time()
+
+        bucket = self._bucket(timestamp)
+
+        if bucket is None:
+            return
+
+        _, summaries, sketches = bucket
+
+        for kind, items in extract_entities(tweet).items():
+            for item in items:
+                summaries[kind].add(item)
+                sketches[kind].add(item)
+                self._sketches[kind].add(item)
+
+    def consume(self, tweets):
+        """
+        This function updates the tracker with every tweet of the introduced iterable (e.g. the generator returned by
+        :func:`twipper.streaming.stream_tweets`) and yields them back, so it can be placed in front of any consumer.
+        """
+
+        for tweet in tweets:
+            self.update(tweet)
+            yield tweet
+
+    def top(self, kind='hashtags', n=10, now=None):
+        """
+        This function retrieves the most frequent items of the introduced kind on the current window.
+
+        Args:
+            kind (:obj:`str`, optional): either `hashtags`, `mentions` or `domains`, default is `hashtags`.
+            n (:obj:`int`, optional): number of items to retrieve, default is 10.
+            now (:obj:`float`, optional):
+                current time in seconds since epoch, used to expire old buckets, default is `None` which means that
+                the window ends with the latest tweet.
+
+        Returns:
+            :obj:`list` - top:
+                Returns a :obj:`list` of `(item, estimated_count)` tuples sorted by descending count.
+
+        Raises:
+            ValueError: raised if the introduced kind is not valid.
+        """
+
+        if kind not in ENTITY_KINDS:
+            raise ValueError('kind can just be `hashtags`, `mentions` or `domains`!')
+
+        if now is not None:
+            self._expire(int(now // self.span))
+
+        candidates = set()
+
+        for _, summaries, _ in self._buckets:
+            candidates.update(summaries[kind].counts.keys())
+
+        sketch = self._sketches[kind]
+
+        return heapq.nlargest(n, ((item, sketch.estimate(item)) for item in candidates), key=lambda item: item[1])
+
+    def count(self, kind, item):
+        """
+        This function retrieves the estimated number of occurrences of an item on the current window.
+        """
+
+        if kind not in ENTITY_KINDS:
+            raise ValueError('kind can just be `hashtags`, `mentions` or `domains`!')
+
+        return self._sketches[kind].estimate(item)
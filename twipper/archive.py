@@ -0,0 +1,419 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2019 Alvaro Bartolome
+# See LICENSE for details.
+
+import json
+import mmap
+import os
+import struct
+
+from twipper.utils import timestamp_to_snowflake
+
+
+INDEX_MAGIC = b'TWPIDX01'
+
+_HEADER = struct.Struct('<8sQ')
+_ENTRY = struct.Struct('<QQI')
+
+
+def index_path(path):
+    """
+    This function retrieves the path to the index file of the archive on the introduced path.
+    """
+
+    return path + '.idx'
+
+
+class ArchiveWriter(object):
+    """
+    ArchiveWriter writes tweets sequentially onto an archive, which is made of a NDJSON data file (one tweet per line,
+    so it can still be processed with any other tool) and an index file containing an `(id, offset, length)` entry per
+    tweet sorted by id, so that any tweet can be retrieved with a binary search by :obj:`twipper.archive.ArchiveReader`.
+    The index is written once the writer is closed; since tweets are mostly written in id order, entries are just
+    sorted if they were not, and duplicated tweets are indexed just once. If a writer was not closed (e.g. the process
+    was killed), the tweets missing from the index are indexed again from the data file when appending to it.
+    """
+
+    def __init__(self, path, append=False):
+        """
+        This function is the constructor of :obj:`twipper.archive.ArchiveWriter` class.
+
+        Args:
+            path (:obj:`str`): path to the data file of the archive, the index is stored next to it.
+            append (:obj:`boolean`, optional):
+                whether to append the tweets to an existing archive or to overwrite it, default is `False`.
+
+        Raises:
+            ValueError: raised if the introduced arguments do not match or errored.
+        """
+
+        if not path or not isinstance(path, str):
+            raise ValueError('path must be a `str`!')
+
+        if not isinstance(append, bool):
+            raise ValueError('append must be a `boolean`!')
+
+        self.path = path
+
+        self._entries = bytearray()
+        self._sorted = True
+        self._last = -1
+
+        if append and os.path.exists(path):
+            self._file = open(path, 'ab')
+
+            size = self._file.tell()
+            indexed = 0
+
+            if os.path.exists(index_path(path)):
+                with open(index_path(path), 'rb') as index:
+                    self._entries += _read_entries(index.read())
+
+                for _, offset, length in _ENTRY.iter_unpack(self._entries):
+                    indexed = max(indexed, offset + length + 1)
+
+                if indexed > size:
+                    self._entries, indexed = bytearray(), 0
+
+            if self._entries:
+                self._last = _ENTRY.unpack_from(self._entries, len(self._entries) - _ENTRY.size)[0]
+
+            if indexed < size:
+                with open(path, 'rb') as data:
+                    for tweet_id, offset, length in _scan_entries(data, indexed):
+                        self._index(tweet_id, offset, length)
+
+                    data.seek(size - 1)
+
+                    if data.read(1) != b'\n':
+                        self._file.write(b'\n')
+        else:
+            self._file = open(path, 'wb')
+
+        self._offset = self._file.tell()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, tweet):
+        """
+        This function appends the introduced tweet to the data file of the archive.
+
+        Args:
+            tweet (:obj:`dict`): tweet as retrieved from the Twitter API.
+        """
+
+        if 'id' not in tweet:
+            return
+
+        self.write_raw(tweet['id'], json.dumps(tweet, separators=(',', ':')).encode('utf-8'))
+
+    def write_raw(self, tweet_id, data):
+        """
+        This function appends the introduced encoded tweet to the data file of the archive, so tweets retrieved as
+        bytes do not need to be decoded and encoded again.
+
+        Args:
+            tweet_id (:obj:`int`): id of the tweet.
+            data (:obj:`bytes`): tweet encoded as JSON, without any line break.
+        """
+
+        tweet_id = int(tweet_id)
+
+        self._file.write(data)
+        self._file.write(b'\n')
+
+        self._index(tweet_id, self._offset, len(data))
+        self._offset += len(data) + 1
+
+    def _index(self, tweet_id, offset, length):
+        self._entries += _ENTRY.pack(tweet_id, offset, length)
+
+        if tweet_id <= self._last:
+            self._sorted = False
+
+        self._last = tweet_id
+
+    def write_many(self, tweets):
+        """
+        This function appends every tweet of the introduced iterable (such as the :obj:`list` returned by
+        :func:`twipper.premium.search_tweets`) to the archive.
+        """
+
+        for tweet in tweets:
+            self.write(tweet)
+
+    def tee(self, tweets):
+        """
+        This function archives every tweet of the introduced iterable (such as the generator returned by
+        :func:`twipper.streaming.stream_tweets`) while yielding them back, so it can be placed in front of any consumer.
+        """
+
+        for tweet in tweets:
+            self.write(tweet)
+            yield tweet
+
+    def close(self):
+        """
+        This function closes the data file of the archive and writes its index.
+        """
+
+        if self._file is None:
+            return
+
+        self._file.close()
+        self._file = None
+
+        entries = self._entries
+
+        if not self._sorted:
+            unique = dict()
+
+            for entry in _ENTRY.iter_unpack(entries):
+                unique.setdefault(entry[0], entry)
+
+            entries = bytearray()
+
+            for tweet_id in sorted(unique):
+                entries += _ENTRY.pack(*unique[tweet_id])
+
+        temporary = index_path(self.path) + '.tmp'
+
+        with open(temporary, 'wb') as index:
+            index.write(_HEADER.pack(INDEX_MAGIC, len(entries) // _ENTRY.size))
+            index.write(entries)
+
+        os.replace(temporary, index_path(self.path))
+
+        self._entries = bytearray()
+
+
+def _scan_entries(file, offset):
+    """
+    This function retrieves the `(id, offset, length)` entries of the tweets of a data file from the introduced offset
+    on, skipping the lines which cannot be decoded, such as the last one if it was not completely written.
+    """
+
+    file.seek(offset)
+
+    for line in file:
+        length = len(line) - 1
+
+        if line.endswith(b'\n'):
+            try:
+                tweet_id = int(json.loads(line.decode('utf-8'))['id'])
+            except (ValueError, KeyError, TypeError):
+                tweet_id = None
+
+            if tweet_id is not None:
+                yield tweet_id, offset, length
+
+        offset += len(line)
+
+
+def _read_entries(data):
+    if len(data) < _HEADER.size:
+        raise ValueError('archive index is not valid.')
+
+    magic, count = _HEADER.unpack_from(data)
+
+    if magic != INDEX_MAGIC or len(data) < _HEADER.size + count * _ENTRY.size:
+        raise ValueError('archive index is not valid.')
+
+    return data[_HEADER.size:_HEADER.size + count * _ENTRY.size]
+
+
+class ArchiveReader(object):
+    """
+    ArchiveReader retrieves tweets from an archive written by :obj:`twipper.archive.ArchiveWriter`. Both the data and
+    the index files are memory mapped, so retrieving a tweet by its id is a binary search over the index followed by a
+    slice of the data file, and scanning a range of ids (or of time, since tweet ids are snowflakes) just requires two
+    binary searches, with no file read other than the pages containing the requested tweets.
+    """
+
+    def __init__(self, path):
+        """
+        This function is the constructor of :obj:`twipper.archive.ArchiveReader` class.
+
+        Args:
+            path (:obj:`str`): path to the data file of the archive.
+
+        Raises:
+            ValueError: raised if the introduced arguments do not match or the index is not valid.
+        """
+
+        if not path or not isinstance(path, str):
+            raise ValueError('path must be a `str`!')
+
+        self.path = path
+
+        self._files = [open(path, 'rb'), open(index_path(path), 'rb')]
+
+        self._data = _map(self._files[0])
+        self._index = _map(self._files[1])
+
+        if len(self._index) < _HEADER.size:
+            self.close()
+            raise ValueError('archive index is not valid.')
+
+        magic, self.count = _HEADER.unpack_from(self._index)
+
+        if magic != INDEX_MAGIC or len(self._index) < _HEADER.size + self.count * _ENTRY.size:
+            self.close()
+            raise ValueError('archive index is not valid.')
+
+        self._view = memoryview(self._data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, tweet_id):
+        return self._find(int(tweet_id)) is not None
+
+    def _entry(self, position):
+        return _ENTRY.unpack_from(self._index, _HEADER.size + position * _ENTRY.size)
+
+    def _bisect(self, tweet_id):
+        lower, upper = 0, self.count
+
+        while lower < upper:
+            middle = (lower + upper) // 2
+
+            if self._entry(middle)[0] < tweet_id:
+                lower = middle + 1
+            else:
+                upper = middle
+
+        return lower
+
+    def _find(self, tweet_id):
+        position = self._bisect(tweet_id)
+
+        if position < self.count:
+            entry = self._entry(position)
+
+            if entry[0] == tweet_id:
+                return entry
+
+        return None
+
+    def raw(self, tweet_id):
+        """
+        This function retrieves the encoded tweet with the introduced id as a :obj:`memoryview` over the data file, so
+        no bytes are copied, or `None` if it is not archived.
+        """
+
+        entry = self._find(int(tweet_id))
+
+        if entry is None:
+            return None
+
+        return self._view[entry[1]:entry[1] + entry[2]]
+
+    def get(self, tweet_id):
+        """
+        This function retrieves the tweet with the introduced id, or `None` if it is not archived.
+        """
+
+        data = self.raw(tweet_id)
+
+        return None if data is None else json.loads(data.tobytes().decode('utf-8'))
+
+    def scan(self, start_id=None, end_id=None, raw=False):
+        """
+        This function retrieves every archived tweet whose id is within the introduced range, in id order.
+
+        Args:
+            start_id (:obj:`int`, optional): lowest id to retrieve (inclusive), default is `None`.
+            end_id (:obj:`int`, optional): highest id to retrieve (exclusive), default is `None`.
+            raw (:obj:`boolean`, optional):
+                whether to yield every tweet as a :obj:`memoryview` over the data file instead of decoding it.
+
+        Returns:
+            :obj:`dict` - tweet:
+                Yields every tweet on the range, or a :obj:`memoryview` of its bytes if `raw` is `True`.
+        """
+
+        lower = 0 if start_id is None else self._bisect(int(start_id))
+        upper = self.count if end_id is None else self._bisect(int(end_id))
+
+        for position in range(lower, upper):
+            _, offset, length = self._entry(position)
+
+            if raw:
+                yield self._view[offset:offset + length]
+            else:
+                yield json.loads(self._view[offset:offset + length].tobytes().decode('utf-8'))
+
+    def between(self, start, end, raw=False):
+        """
+        This function retrieves every archived tweet created within the introduced time range, in id order.
+
+        Args:
+            start (:obj:`int`): start of the range as milliseconds since epoch (inclusive).
+            end (:obj:`int`): end of the range as milliseconds since epoch (exclusive).
+            raw (:obj:`boolean`, optional): whether to yield every tweet as a :obj:`memoryview` instead of decoding it.
+        """
+
+        return self.scan(timestamp_to_snowflake(start), timestamp_to_snowflake(end), raw=raw)
+
+    def ids(self):
+        """
+        This function retrieves the ids of every archived tweet, in order.
+        """
+
+        for position in range(self.count):
+            yield self._entry(position)[0]
+
+    @property
+    def id_range(self):
+        """
+        This property contains the lowest and the highest archived ids as a :obj:`tuple`, or `None` if it is empty.
+        """
+
+        if self.count < 1:
+            return None
+
+        return self._entry(0)[0], self._entry(self.count - 1)[0]
+
+    def close(self):
+        """
+        This function unmaps and closes the files of the archive. If any memory view retrieved from the reader is still
+        alive, the data file is unmapped once the last of them is released instead.
+        """
+
+        if getattr(self, '_view', None) is not None:
+            self._view.release()
+            self._view = None
+
+        for mapping in (self._data, self._index):
+            if isinstance(mapping, mmap.mmap):
+                try:
+                    mapping.close()
+                except BufferError:
+                    pass
+
+        self._data = self._index = None
+
+        for file in self._files:
+            file.close()
+
+        self._files = list()
+
+
+def _map(file):
+    if os.fstat(file.fileno()).st_size == 0:
+        return b''
+
+    return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
@@ -5,14 +5,23 @@
 # See LICENSE for details.
 
 import json
-import oauth2
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
 from twipper.credentials import Twipper
+from twipper.pagination import paginate, peek_json_string
+from twipper.query import QUERY_LENGTH, shard_user_query
+from twipper.retry import RetryPolicy, SearchResult, get_retry_policy
+from twipper.utils import date_to_timestamp, time_window_to_ids
 
 # from twipper.utils import available_languages
 
+ENDPOINT = 'search/tweets'
+
 
 def search_tweets(access, query, page_count=1, filter_retweets=False, verified_account=False,
-                  language=None, result_type='mixed', count=100):
+                  language=None, result_type='mixed', count=100, from_date=None, to_date=None, prefetch=1,
+                  retry_policy=None, since_id=None, max_id=None):
     """
     This function retrieves historical tweets on batch processing. These tweets contain the specified words on the
     query, which can use operators such as AND or OR, as specified on
@@ -35,11 +44,28 @@ def search_tweets(access, query, page_count=1, filter_retweets=False, verified_a
         result_type (:obj:`str`, optional):
             value to indicate which type of tweets want to be retrieved, it can either be `mixed`, `popular` or `recent`
         count (:obj:`int`, optional): number of tweets per requests to retrieve (default and max is 100).
+        from_date (:obj:`str`, optional):
+            starting date of the time interval to retrieve tweets from (`yyyymmddhhmm` format), default is `None`.
+        to_date (:obj:`str`, optional):
+            end date of the time interval to retrieve tweets from (`yyyymmddhhmm` format), default is `None`. Both dates
+            are translated into `since_id` and `max_id` bounds, as tweet ids contain the time they were created at.
+        prefetch (:obj:`int`, optional):
+            number of pages fetched ahead while the current one is being parsed, default is 1, and 0 disables it.
+        retry_policy (:obj:`twipper.retry.RetryPolicy`, optional):
+            policy used to retry the failed requests, default is the shared one (see
+            :func:`twipper.retry.get_retry_policy`).
+        since_id (:obj:`int`, optional):
+            just tweets with a higher id are retrieved, such as the ones posted after the last tweet already retrieved,
+            default is `None`. If `from_date` is introduced too, the tightest bound is used.
+        max_id (:obj:`int`, optional):
+            just tweets with an id lower or equal are retrieved, such as the ones older than the ones already
+            retrieved, default is `None`. If `to_date` is introduced too, the tightest bound is used.
 
     Returns:
         :obj:`list` - tweets:
             Returns a :obj:`list` containing all the retrieved tweets from Twitter API, based on the search query
-            previously specified on the function arguments.
+            previously specified on the function arguments, as a :obj:`twipper.retry.SearchResult` whose `metadata`
+            report whether the results were truncated because a page could not be retrieved.
 
     Raises:
         ValueError: raised if the introduced arguments do not match or errored.
@@ -48,11 +74,6 @@ def search_tweets(access, query, page_count=1, filter_retweets=False, verified_a
     if not access or not isinstance(access, Twipper):
         raise ValueError('access object to api.twitter is not valid!')
 
-    api = access.api
-
-    if not isinstance(api, oauth2.Client):
-        raise ValueError('api is not valid!')
-
     if not isinstance(query, str):
         raise ValueError('query must be a string!')
 
@@ -65,7 +86,7 @@ def search_tweets(access, query, page_count=1, filter_retweets=False, verified_a
     if isinstance(page_count, int) and page_count < 1:
         raise ValueError('page_count must be an `int` equal or higher than 1!')
 
-    if not isinstance(language, str):
+    if language and not isinstance(language, str):
         raise ValueError('language must be a `str`!')
 
     if not isinstance(filter_retweets, bool):
@@ -83,6 +104,24 @@ def search_tweets(access, query, page_count=1, filter_retweets=False, verified_a
     if not isinstance(count, int):
         raise ValueError('count must be an `int` between 1 and 100!')
 
+    if not isinstance(prefetch, int) or prefetch < 0:
+        raise ValueError('prefetch must be an `int` equal or higher than 0!')
+
+    if retry_policy is not None and not isinstance(retry_policy, RetryPolicy):
+        raise ValueError('retry_policy must be a `twipper.retry.RetryPolicy`!')
+
+    for name, value in (('since_id', since_id), ('max_id', max_id)):
+        if value is not None and (not isinstance(value, int) or value < 0):
+            raise ValueError(name + ' must be an `int` equal or higher than 0!')
+
+    window_since_id, window_max_id = _time_window(from_date, to_date)
+
+    if window_since_id is not None:
+        since_id = window_since_id if since_id is None else max(since_id, window_since_id)
+
+    if window_max_id is not None:
+        max_id = window_max_id if max_id is None else min(max_id, window_max_id)
+
     if verified_account:
         query += " filter:verified"
 
@@ -120,74 +159,20 @@ def search_tweets(access, query, page_count=1, filter_retweets=False, verified_a
     else:
         url += '&result_type=mixed'
 
-    url += '&tweet_mode=extended'
-
-    response, content = api.request(url, method='GET')
+    if since_id is not None:
+        url += '&since_id=' + str(since_id)
 
-    if response.status != 200:
-        raise ConnectionError('connection errored with code ' + str(response.status) + '.')
+    if max_id is not None:
+        url += '&max_id=' + str(max_id)
 
-    tweets = list()
-
-    try:
-        data = json.loads(content.decode('utf-8'))
-    except json.decoder.JSONDecodeError:
-        raise RuntimeError('retrieved content could not be parsed.')
-
-    if 'statuses' in data:
-        if len(data['statuses']) > 0:
-            tweets += data['statuses']
-
-            if 'search_metadata' in data:
-                if 'next_results' in data['search_metadata']:
-                    next_url = data['search_metadata']['next_results']
-                else:
-                    return tweets
-            else:
-                return tweets
-        else:
-            raise IndexError('no tweets could be retrieved.')
-    else:
-        raise IndexError('no tweets could be retrieved.')
-
-    base_url = 'https://api.twitter.com/1.1/search/tweets.json'
-
-    if page_count > 1:
-        for _ in range(page_count - 1):
-            response, content = api.request(base_url + next_url, method='GET')
-
-            if response.status != 200:
-                break
-
-            try:
-                data = json.loads(content.decode('utf-8'))
-            except json.decoder.JSONDecodeError:
-                break
-
-            if 'statuses' in data:
-                if len(data['statuses']) > 0:
-                    tweets += data['statuses']
-
-                    if 'search_metadata' in data:
-                        if 'next_results' in data['search_metadata']:
-                            next_url = data['search_metadata']['next_results']
-                        else:
-                            break
-                    else:
-                        break
-                else:
-                    break
-            else:
-                break
+    url += '&tweet_mode=extended'
 
-    if len(tweets) > 0:
-        return tweets
-    else:
-        raise IndexError('no tweets could be retrieved.')
+    return _paginate(access, url, page_count, since_id, prefetch, retry_policy)
 
 
 def search_user_tweets(access, screen_name, page_count=1, filter_retweets=False,
-                       language=None, result_type='mixed', count=100):
+                       language=None, result_type='mixed', count=100, from_date=None, to_date=None, prefetch=1,
+                       retry_policy=None):
     """
     This function retrieves historical tweets from a Twitter user by their screen_name (@), whenever they grant the
     application access their tweets for commercial purposes on ReadOnly permission. Retrieved tweets are stored on a
@@ -205,11 +190,22 @@ def search_user_tweets(access, screen_name, page_count=1, filter_retweets=False,
         result_type (:obj:`str`, optional):
             value to indicate which type of tweets want to be retrieved, it can either be `mixed`, `popular` or `recent`
         count (:obj:`int`, optional): number of tweets per requests to retrieve (default and max is 100).
+        from_date (:obj:`str`, optional):
+            starting date of the time interval to retrieve tweets from (`yyyymmddhhmm` format), default is `None`.
+        to_date (:obj:`str`, optional):
+            end date of the time interval to retrieve tweets from (`yyyymmddhhmm` format), default is `None`. Both dates
+            are translated into `since_id` and `max_id` bounds, as tweet ids contain the time they were created at.
+        prefetch (:obj:`int`, optional):
+            number of pages fetched ahead while the current one is being parsed, default is 1, and 0 disables it.
+        retry_policy (:obj:`twipper.retry.RetryPolicy`, optional):
+            policy used to retry the failed requests, default is the shared one (see
+            :func:`twipper.retry.get_retry_policy`).
 
     Returns:
         :obj:`list` - tweets:
             Returns a `list` containing all the retrieved tweets from Twitter, which means all the available tweets from
-            the user specified on the arguments of the function.
+            the user specified on the arguments of the function, as a :obj:`twipper.retry.SearchResult` whose
+            `metadata` report whether the results were truncated because a page could not be retrieved.
 
     Raises:
         ValueError: raised if the introduced arguments do not match or errored.
@@ -218,11 +214,6 @@ def search_user_tweets(access, screen_name, page_count=1, filter_retweets=False,
     if not access or not isinstance(access, Twipper):
         raise ValueError('access object to api.twitter is not valid!')
 
-    api = access.api
-
-    if not isinstance(api, oauth2.Client):
-        raise ValueError('api is not valid!')
-
     if not isinstance(screen_name, str):
         raise ValueError('screen_name must be a string!')
 
@@ -235,7 +226,7 @@ def search_user_tweets(access, screen_name, page_count=1, filter_retweets=False,
     if isinstance(page_count, int) and page_count < 1:
         raise ValueError('page_count must be an `int` equal or higher than 1!')
 
-    if not isinstance(language, str):
+    if language and not isinstance(language, str):
         raise ValueError('language must be a `str`!')
 
     if not isinstance(filter_retweets, bool):
@@ -250,6 +241,14 @@ def search_user_tweets(access, screen_name, page_count=1, filter_retweets=False,
     if not isinstance(count, int):
         raise ValueError('count must be an `int` between 1 and 100!')
 
+    if not isinstance(prefetch, int) or prefetch < 0:
+        raise ValueError('prefetch must be an `int` equal or higher than 0!')
+
+    if retry_policy is not None and not isinstance(retry_policy, RetryPolicy):
+        raise ValueError('retry_policy must be a `twipper.retry.RetryPolicy`!')
+
+    since_id, max_id = _time_window(from_date, to_date)
+
     url = 'https://api.twitter.com/1.1/search/tweets.json?q=from:' + screen_name
 
     if filter_retweets:
@@ -284,67 +283,230 @@ def search_user_tweets(access, screen_name, page_count=1, filter_retweets=False,
     else:
         url += '&result_type=mixed'
 
+    if since_id is not None:
+        url += '&since_id=' + str(since_id)
+
+    if max_id is not None:
+        url += '&max_id=' + str(max_id)
+
     url += '&tweet_mode=extended'
 
-    response, content = api.request(url, method='GET')
+    return _paginate(access, url, page_count, since_id, prefetch, retry_policy)
 
-    if response.status != 200:
-        raise ConnectionError('connection errored with code ' + str(response.status))
 
-    tweets = list()
+def search_users_tweets(access, screen_names, page_count=1, filter_retweets=False, language=None, result_type='mixed',
+                        count=100, from_date=None, to_date=None, prefetch=1, retry_policy=None, workers=4):
+    """
+    This function retrieves historical tweets on batch processing from many Twitter users at once. Instead of searching
+    the tweets of every user on its own, the `from:` operators of the users are OR'ed together into as few queries as
+    the 500 characters limit of the standard search allows (see :func:`twipper.query.shard_user_query`), and up to
+    `workers` queries are searched concurrently through a :obj:`twipper.pool.CredentialPool`, which keeps them within
+    the rate limit of the credentials. The retrieved tweets are demultiplexed back to the user who posted them and
+    yielded as soon as the query of the user is done.
+
+    Args:
+        access (:obj:`twipper.credentials.Twipper` or :obj:`twipper.pool.CredentialPool`):
+            object containing all the credentials needed to access api.twitter, or a pool of them.
+        screen_names (:obj:`list`): screen names of the users whose tweets are going to be retrieved.
+        page_count (:obj:`int`, optional):
+            specifies the amount of pages to retrieve per query, which are shared by every user packed into it.
+        filter_retweets (:obj:`boolean`, optional):
+            can be either `True` or `False`, to filter out retweets or not, respectively.
+        language (:obj:`str`, optional): is the language on which the tweet has been written.
+        result_type (:obj:`str`, optional): can be either `mixed`, `popular` or `recent`.
+        count (:obj:`int`, optional): number of tweets per page, up to 100.
+        from_date (:obj:`str`, optional):
+            starting date of the time interval to retrieve tweets from (`yyyymmddhhmm` format), default is `None`.
+        to_date (:obj:`str`, optional):
+            end date of the time interval to retrieve tweets from (`yyyymmddhhmm` format), default is `None`.
+        prefetch (:obj:`int`, optional):
+            number of pages fetched ahead while the current one is being parsed, default is 1, and 0 disables it.
+        retry_policy (:obj:`twipper.retry.RetryPolicy`, optional):
+            policy used to retry the failed requests, default is the shared one (see
+            :func:`twipper.retry.get_retry_policy`).
+        workers (:obj:`int`, optional): maximum number of queries searched concurrently, default is 4.
+
+    Returns:
+        :obj:`generator` - tweets:
+            Yields a :obj:`tuple` containing the screen name of every user and a :obj:`twipper.retry.SearchResult` with
+            its retrieved tweets, whose `metadata` are the ones of the search of the query the user was packed into,
+            which is included as `rule`.
+
+    Raises:
+        ValueError: raised if the introduced arguments do not match or errored.
+    """
+
+    # imported here, as twipper.pool relies on this module
+    from twipper.pool import CredentialPool
+
+    if isinstance(access, Twipper):
+        access = CredentialPool([access])
+    elif not isinstance(access, CredentialPool):
+        raise ValueError('access object to api.twitter is not valid!')
+
+    if not screen_names or not isinstance(screen_names, (list, tuple, set)):
+        raise ValueError('screen_names must be a `list` of `str`!')
+
+    if not page_count or not isinstance(page_count, int) or page_count < 1:
+        raise ValueError('page_count must be an `int` equal or higher than 1!')
+
+    if not isinstance(filter_retweets, bool):
+        raise ValueError('filter_retweets must be a `bool`!')
+
+    if not isinstance(workers, int) or workers < 1:
+        raise ValueError('workers must be an `int` equal or higher than 1!')
+
+    shards = shard_user_query(screen_names, query='-filter:retweets' if filter_retweets else None,
+                              max_length=QUERY_LENGTH)
+
+    kwargs = {
+        'page_count': page_count,
+        'language': language,
+        'result_type': result_type,
+        'count': count,
+        'from_date': from_date,
+        'to_date': to_date,
+        'prefetch': prefetch,
+        'retry_policy': retry_policy,
+    }
+
+    return _search_shards(access, shards, kwargs, workers)
+
+
+def _search_shards(pool, shards, kwargs, workers):
+    def search(rule):
+        try:
+            return pool.search_tweets(rule, **kwargs)
+        except IndexError:
+            return SearchResult()
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+
+    shards = iter(shards)
+    pending = dict()
+
+    def submit():
+        for rule, users in shards:
+            pending[executor.submit(search, rule)] = (rule, users)
+
+            return
 
     try:
-        data = json.loads(content.decode('utf-8'))
-    except json.decoder.JSONDecodeError:
-        raise RuntimeError('retrieved content could not be parsed.')
-
-    if 'statuses' in data:
-        if len(data['statuses']) > 0:
-            tweets += data['statuses']
-
-            if 'search_metadata' in data:
-                if 'next_results' in data['search_metadata']:
-                    next_url = data['search_metadata']['next_results']
-                else:
-                    return tweets
-            else:
-                return tweets
-        else:
-            raise IndexError('no tweets could be retrieved.')
-    else:
-        raise IndexError('no tweets could be retrieved.')
+        for _ in range(workers):
+            submit()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                rule, users = pending.pop(future)
+
+                results = future.result().by_user(users, rule=rule)
+
+                for user in users:
+                    yield user, results[user]
+
+                submit()
+    finally:
+        executor.shutdown(wait=False)
+
+
+def _paginate(access, url, page_count, since_id, prefetch, retry_policy):
+    """
+    This function retrieves up to `page_count` pages of the standard search starting on the introduced url, following
+    the `next_results` cursor of every page (see :func:`twipper.pagination.paginate`), and sending every request
+    through the introduced retry policy. The pages which cannot be retrieved after the first one truncate the results,
+    as reported on the metadata of the returned :obj:`twipper.retry.SearchResult`.
+    """
 
     base_url = 'https://api.twitter.com/1.1/search/tweets.json'
 
-    if page_count > 1:
-        for _ in range(page_count - 1):
-            response, content = api.request(base_url + next_url, method='GET')
-
-            if response.status != 200:
-                break
-
-            try:
-                data = json.loads(content.decode('utf-8'))
-            except json.decoder.JSONDecodeError:
-                break
-
-            if 'statuses' in data:
-                if len(data['statuses']) > 0:
-                    tweets += data['statuses']
-
-                    if 'search_metadata' in data:
-                        if 'next_results' in data['search_metadata']:
-                            next_url = data['search_metadata']['next_results']
-                        else:
-                            break
-                    else:
-                        break
-                else:
-                    break
-            else:
-                break
+    policy = retry_policy if retry_policy is not None else get_retry_policy()
+
+    metadata = dict()
+
+    def request(target):
+        response = access.transport.request('GET', target, auth=access.oauth)
+
+        access.record_rate_limit(ENDPOINT, response.headers, response.status_code)
+
+        return response
+
+    def fetch(next_url):
+        if next_url is None:
+            return policy.send(lambda: request(url), ENDPOINT)
+
+        if since_id is not None and 'since_id=' not in next_url:
+            next_url += '&since_id=' + str(since_id)
+
+        try:
+            return policy.send(lambda: request(base_url + next_url), ENDPOINT)
+        except ConnectionError as e:
+            return e
+
+    def truncate(error):
+        metadata.update(truncated=True, error=error)
+
+    def parse(response, page):
+        if isinstance(response, ConnectionError):
+            return truncate(str(response))
+
+        if response.status_code != 200:
+            if page == 0:
+                raise ConnectionError('connection errored with code ' + str(response.status_code) + '.')
+
+            return truncate('connection errored with code ' + str(response.status_code) + '.')
+
+        try:
+            data = json.loads(response.content.decode('utf-8'))
+        except json.decoder.JSONDecodeError:
+            if page == 0:
+                raise RuntimeError('retrieved content could not be parsed.')
+
+            return truncate('retrieved content could not be parsed.')
+
+        if not data.get('statuses'):
+            if page == 0:
+                raise IndexError('no tweets could be retrieved.')
+
+            return metadata.update(next=None)
+
+        cursor = (data.get('search_metadata') or {}).get('next_results')
+
+        metadata.update(pages=page + 1, next=cursor)
+
+        return data['statuses'], cursor
+
+    def peek(content):
+        return peek_json_string(content, 'next_results')
+
+    tweets = list()
+
+    for statuses in paginate(fetch, parse, peek, page_count, prefetch=prefetch):
+        tweets += statuses
 
     if len(tweets) > 0:
-        return tweets
+        return SearchResult(tweets, metadata)
     else:
         raise IndexError('no tweets could be retrieved.')
+
+
+def _time_window(from_date, to_date):
+    start = end = None
+
+    if from_date is not None:
+        if not isinstance(from_date, str):
+            raise ValueError('from_date must be a `str`!')
+
+        start = date_to_timestamp(from_date)
+
+    if to_date is not None:
+        if not isinstance(to_date, str):
+            raise ValueError('to_date must be a `str`!')
+
+        end = date_to_timestamp(to_date)
+
+    if start is not None and end is not None and start >= end:
+        raise ValueError('incorrect dates, as from_date should be earlier than to_date.')
+
+    return time_window_to_ids(start, end)
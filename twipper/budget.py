@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2019 Alvaro Bartolome
+# See LICENSE for details.
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+PAGE_SIZES = {
+    'sandbox': 100,
+    'premium': 500,
+}
+
+RULE_LENGTHS = {
+    'sandbox': 256,
+    'premium': 1024,
+}
+
+SANDBOX_CAPS = {
+    '30day': (250, 25000),
+    'fullarchive': (50, 5000),
+}
+
+
+class Budget(object):
+    """
+    Budget is the class which keeps track of the billable requests sent to the premium search of the Twitter API, and of
+    the tweets retrieved through it, on a monthly ledger per plan and dev environment label (the ones of the
+    :obj:`twipper.credentials.Twipper` object used), which is persisted as JSON if a path is introduced. Searches done
+    through a budget use the largest page size allowed by the tier of the subscription, and are either refused or
+    throttled (retrieving fewer pages) whenever they would exceed the monthly caps of requests or tweets. A persisted
+    ledger can be shared by several budgets, even from other processes, as it is re-read under a file lock before
+    being checked or updated; the requests reserved by the searches in progress are just shared within a budget.
+    """
+
+    def __init__(self, tier='sandbox', requests=None, tweets=None, path=None, mode='refuse'):
+        """
+        This function is the constructor of :obj:`twipper.budget.Budget` class, which validates the introduced
+        parameters and loads the ledger stored on the introduced path, if any.
+
+        Args:
+            tier (:obj:`str`, optional):
+                tier of the premium subscription, either `sandbox` (100 tweets per request) or `premium` (500 tweets per
+                request), default is `sandbox`.
+            requests (:obj:`int`, optional):
+                monthly cap of requests, default is the one of the sandbox (250 for 30day and 50 for fullarchive) on
+                sandbox tier, and no cap on premium tier.
+            tweets (:obj:`int`, optional):
+                monthly cap of tweets, default is the one of the sandbox (25000 for 30day and 5000 for fullarchive) on
+                sandbox tier, and no cap on premium tier.
+            path (:obj:`str`, optional): path of the JSON file where the ledger is persisted, default is `None`.
+            mode (:obj:`str`, optional):
+                either `refuse`, to refuse the searches which would exceed the caps, or `throttle`, to retrieve just the
+                pages which fit into them, default is `refuse`.
+
+        Raises:
+            ValueError: raised if the introduced arguments do not match or errored.
+        """
+
+        if tier not in PAGE_SIZES:
+            raise ValueError('tier must be either `sandbox` or `premium`!')
+
+        for name, value in (('requests', requests), ('tweets', tweets)):
+            if value is not None and (not isinstance(value, int) or value < 0):
+                raise ValueError(name + ' must be an `int` equal or higher than 0!')
+
+        if path is not None and not isinstance(path, str):
+            raise ValueError('path must be a `str`!')
+
+        if mode not in ('refuse', 'throttle'):
+            raise ValueError('mode must be either `refuse` or `throttle`!')
+
+        self.tier = tier
+        self.requests = requests
+        self.tweets = tweets
+        self.path = path
+        self.mode = mode
+
+        self.ledger = dict()
+        self.reserved = dict()
+
+        self._lock = threading.Lock()
+
+        self._load()
+
+    def _load(self):
+        if self.path is not None and os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.ledger = json.load(f)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with self._lock:
+            if self.path is None:
+                yield
+                return
+
+            # the ledger itself is replaced on every save, so the lock is held on a sibling file, and it is released
+            # as soon as that file is closed
+            with open(self.path + '.lock', 'a') as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+
+                self._load()
+
+                yield
+
+    @staticmethod
+    def _key(access):
+        return access.plan + '/' + access.label
+
+    @staticmethod
+    def _month():
+        return time.strftime('%Y-%m', time.gmtime())
+
+    def page_size(self):
+        """
+        This function retrieves the largest amount of tweets per request allowed by the tier of the subscription.
+        """
+
+        return PAGE_SIZES[self.tier]
+
+    def rule_length(self):
+        """
+        This function retrieves the maximum length in characters of the rules allowed by the tier of the subscription.
+        """
+
+        return RULE_LENGTHS[self.tier]
+
+    def caps(self, access):
+        """
+        This function retrieves the monthly caps of requests and tweets of the plan of the introduced credentials, as a
+        :obj:`tuple`, whose values are `None` if there is no cap.
+        """
+
+        requests, tweets = self.requests, self.tweets
+
+        if self.tier == 'sandbox' and access.plan in SANDBOX_CAPS:
+            default_requests, default_tweets = SANDBOX_CAPS[access.plan]
+
+            requests = default_requests if requests is None else requests
+            tweets = default_tweets if tweets is None else tweets
+
+        return requests, tweets
+
+    def usage(self, access, month=None):
+        """
+        This function retrieves the requests sent and tweets retrieved on the introduced month (`yyyy-mm` format,
+        default is the current one) with the plan and dev environment label of the introduced credentials.
+
+        Args:
+            access (:obj:`twipper.credentials.Twipper`): object containing the plan and dev environment label.
+            month (:obj:`str`, optional): month of the usage, in `yyyy-mm` format, default is the current one.
+
+        Returns:
+            :obj:`dict` - usage:
+                Returns a :obj:`dict` containing the `requests` and `tweets` spent, along with the ones spent per
+                `queries`.
+        """
+
+        with self._locked():
+            usage = self.ledger.get(self._key(access), dict()).get(month or self._month())
+
+            if usage is None:
+                return {'requests': 0, 'tweets': 0, 'queries': dict()}
+
+            return json.loads(json.dumps(usage))
+
+    def reserve(self, access, pages):
+        """
+        This function reserves the requests needed to retrieve the introduced amount of pages, so that concurrent
+        searches cannot exceed the monthly caps either, and returns the amount of pages which can be retrieved.
+
+        Args:
+            access (:obj:`twipper.credentials.Twipper`): object containing the plan and dev environment label.
+            pages (:obj:`int`): amount of pages to retrieve.
+
+        Returns:
+            :obj:`int` - pages:
+                Returns the amount of pages which can be retrieved, which must be released with
+                :func:`twipper.budget.Budget.settle` once the search is done.
+
+        Raises:
+            ConnectionError: raised if the search would exceed the monthly caps of the plan.
+        """
+
+        key = self._key(access)
+        requests, tweets = self.caps(access)
+
+        with self._locked():
+            usage = self.ledger.get(key, dict()).get(self._month(), dict())
+            reserved = self.reserved.get(key, 0)
+
+            allowed = pages
+
+            if requests is not None:
+                allowed = min(allowed, requests - usage.get('requests', 0) - reserved)
+
+            if tweets is not None:
+                left = tweets - usage.get('tweets', 0) - reserved * self.page_size()
+
+                allowed = min(allowed, left // self.page_size())
+
+            if allowed <= 0 or (allowed < pages and self.mode == 'refuse'):
+                raise ConnectionError('monthly budget of ' + key + ' does not allow ' + str(pages) + ' more requests.')
+
+            self.reserved[key] = reserved + allowed
+
+            return allowed
+
+    def settle(self, access, reserved, query, requests, tweets):
+        """
+        This function releases the requests reserved by a search and records the requests it actually sent and the
+        tweets it retrieved on the ledger, which is then persisted, if a path was introduced.
+
+        Args:
+            access (:obj:`twipper.credentials.Twipper`): object containing the plan and dev environment label.
+            reserved (:obj:`int`): amount of pages reserved with :func:`twipper.budget.Budget.reserve`.
+            query (:obj:`str`): query of the search.
+            requests (:obj:`int`): amount of requests sent.
+            tweets (:obj:`int`): amount of tweets retrieved.
+        """
+
+        key = self._key(access)
+
+        with self._locked():
+            self.reserved[key] = max(0, self.reserved.get(key, 0) - reserved)
+
+            usage = self.ledger.setdefault(key, dict()).setdefault(self._month(),
+                                                                   {'requests': 0, 'tweets': 0, 'queries': dict()})
+
+            cost = usage['queries'].setdefault(query, {'searches': 0, 'requests': 0, 'tweets': 0})
+
+            for entry in (usage, cost):
+                entry['requests'] += requests
+                entry['tweets'] += tweets
+
+            cost['searches'] += 1
+
+            if self.path is not None:
+                self._save()
+
+    def cost(self, access, query, month=None):
+        """
+        This function retrieves the amount of `searches`, `requests` and `tweets` spent on the introduced query on the
+        introduced month (`yyyy-mm` format, default is the current one), as a :obj:`dict`.
+        """
+
+        return self.usage(access, month=month)['queries'].get(query, {'searches': 0, 'requests': 0, 'tweets': 0})
+
+    def _save(self):
+        temporary = self.path + '.tmp'
+
+        with open(temporary, 'w') as f:
+            json.dump(self.ledger, f, indent=2, sort_keys=True)
+
+        os.replace(temporary, self.path)
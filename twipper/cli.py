@@ -0,0 +1,948 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2019 Alvaro Bartolome
+# See LICENSE for details.
+
+import argparse
+import calendar
+import functools
+import json
+import logging
+import os
+import re
+import signal
+import socketserver
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+try:
+    import tomllib
+except ImportError:
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+import twipper.batch as batch
+import twipper.premium as premium
+import twipper.streaming as streaming
+from twipper.archive import ArchiveWriter
+from twipper.budget import Budget
+from twipper.credentials import Twipper
+from twipper.pool import CredentialPool
+from twipper.query import QUERY_LENGTH, shard_user_query
+from twipper.sinks import PartitionedSink, SQLiteSink
+
+
+SINKS = ['sqlite', 'partitioned', 'archive']
+
+STOP_TIMEOUT = 60.
+
+FLUSH_INTERVAL = 10.
+
+FAR_FUTURE = '999912312359'
+
+_ENVIRONMENT = re.compile(r'\$\{([A-Za-z_][A-Za-z0-9_]*)\}')
+
+logger = logging.getLogger('twipper')
+
+
+def load_config(path):
+    """
+    This function loads the configuration file of a collector, which can be written either in TOML (`.toml`), YAML
+    (`.yaml` or `.yml`, which requires PyYAML) or JSON (`.json`), and validates it (see
+    :func:`twipper.cli.parse_config`). Every `${NAME}` found on a string is replaced by the value of the environment
+    variable `NAME`, so that secrets such as the credentials do not need to be written on the file.
+
+    Args:
+        path (:obj:`str`): path to the configuration file.
+
+    Returns:
+        :obj:`dict` - config:
+            Returns the validated configuration.
+
+    Raises:
+        ValueError: raised if the configuration file is not valid.
+        ImportError: raised if the parser required by the format of the file is not installed.
+    """
+
+    if not isinstance(path, str):
+        raise ValueError('path must be a `str`!')
+
+    extension = os.path.splitext(path)[1].lower()
+
+    with open(path, 'rb') as f:
+        content = f.read()
+
+    if extension == '.toml':
+        if tomllib is None:
+            raise ImportError('tomli is required to load TOML files before Python 3.11, install it with '
+                              '`pip install tomli`.')
+
+        try:
+            config = tomllib.loads(content.decode('utf-8'))
+        except tomllib.TOMLDecodeError as e:
+            raise ValueError('configuration file could not be parsed: ' + str(e))
+    elif extension in ('.yaml', '.yml'):
+        if yaml is None:
+            raise ImportError('PyYAML is required to load YAML files, install it with `pip install pyyaml`.')
+
+        try:
+            config = yaml.safe_load(content)
+        except yaml.YAMLError as e:
+            raise ValueError('configuration file could not be parsed: ' + str(e))
+    elif extension == '.json':
+        try:
+            config = json.loads(content.decode('utf-8'))
+        except json.decoder.JSONDecodeError as e:
+            raise ValueError('configuration file could not be parsed: ' + str(e))
+    else:
+        raise ValueError('configuration file must be either `.toml`, `.yaml`, `.yml` or `.json`!')
+
+    return parse_config(_substitute(config))
+
+
+def _substitute(value):
+    if isinstance(value, str):
+        def variable(match):
+            if match.group(1) not in os.environ:
+                raise ValueError('environment variable `' + match.group(1) + '` is not set!')
+
+            return os.environ[match.group(1)]
+
+        return _ENVIRONMENT.sub(variable, value)
+
+    if isinstance(value, dict):
+        return dict((key, _substitute(item)) for key, item in value.items())
+
+    if isinstance(value, list):
+        return [_substitute(item) for item in value]
+
+    return value
+
+
+def parse_config(config):
+    """
+    This function validates the configuration of a collector and fills in its defaults. The configuration contains the
+    named `credentials`, the `streams` and the `searches` (polling jobs) to run, every one of them with a unique `name`
+    and a `sink` where its tweets are stored, and optionally the `metrics` endpoint, the premium `budget` and the
+    `reload_interval` in seconds between checks of the configuration file. For example, in TOML::
+
+        [credentials.main]
+        consumer_key = "${CONSUMER_KEY}"
+        consumer_secret = "${CONSUMER_SECRET}"
+        access_token = "${ACCESS_TOKEN}"
+        access_token_secret = "${ACCESS_TOKEN_SECRET}"
+
+        [[streams]]
+        name = "pets"
+        credentials = "main"
+        query = "cats,dogs"
+        sink = { type = "sqlite", path = "pets.db" }
+
+        [[searches]]
+        name = "accounts"
+        credentials = "main"
+        users = ["alvarobartt"]
+        interval = 900
+        sink = { type = "partitioned", path = "accounts" }
+
+    Streams either track a `query` or the `countries` introduced, and searches either search a `query` or the tweets of
+    the `users` introduced on the `batch` or `premium` `api`. Searches can use several credentials at once, which are
+    pooled (see :obj:`twipper.pool.CredentialPool`), but streams and premium searches just use one.
+
+    Args:
+        config (:obj:`dict`): configuration of the collector.
+
+    Returns:
+        :obj:`dict` - config:
+            Returns the validated configuration, including its defaults.
+
+    Raises:
+        ValueError: raised if the configuration is not valid.
+    """
+
+    if not isinstance(config, dict):
+        raise ValueError('configuration must be a `dict`!')
+
+    unknown = set(config) - {'credentials', 'streams', 'searches', 'metrics', 'budget', 'reload_interval'}
+
+    if unknown:
+        raise ValueError('unknown configuration sections: ' + ', '.join(sorted(unknown)) + '.')
+
+    credentials = config.get('credentials') or dict()
+
+    if not isinstance(credentials, dict) or not credentials:
+        raise ValueError('credentials must be a `dict` containing at least one set of credentials!')
+
+    for name, values in credentials.items():
+        if not isinstance(values, dict):
+            raise ValueError('credentials `' + name + '` must be a `dict`!')
+
+        for key in ('consumer_key', 'consumer_secret', 'access_token', 'access_token_secret'):
+            if not isinstance(values.get(key), str) or not values[key]:
+                raise ValueError('credentials `' + name + '` must contain `' + key + '`!')
+
+    parsed = {
+        'credentials': credentials,
+        'streams': list(),
+        'searches': list(),
+        'metrics': _parse_metrics(config.get('metrics')),
+        'budget': _parse_budget(config.get('budget')),
+        'reload_interval': config.get('reload_interval', 5),
+    }
+
+    if not isinstance(parsed['reload_interval'], (int, float)) or parsed['reload_interval'] <= 0:
+        raise ValueError('reload_interval must be a `float` higher than 0!')
+
+    names = set()
+
+    for kind in ('streams', 'searches'):
+        jobs = config.get(kind) or list()
+
+        if not isinstance(jobs, list):
+            raise ValueError(kind + ' must be a `list`!')
+
+        for job in jobs:
+            job = _parse_stream(job, credentials) if kind == 'streams' else _parse_search(job, credentials)
+
+            if job['name'] in names:
+                raise ValueError('job names must be unique, but `' + job['name'] + '` is repeated!')
+
+            names.add(job['name'])
+            parsed[kind].append(job)
+
+    return parsed
+
+
+def _parse_metrics(metrics):
+    if metrics is None:
+        return None
+
+    if not isinstance(metrics, dict):
+        raise ValueError('metrics must be a `dict`!')
+
+    host, port = metrics.get('host', '127.0.0.1'), metrics.get('port', 9464)
+
+    if not isinstance(host, str) or not isinstance(port, int) or not 0 <= port < 65536:
+        raise ValueError('metrics must contain a `str` host and an `int` port!')
+
+    return {'host': host, 'port': port}
+
+
+def _parse_budget(budget):
+    if budget is None:
+        return None
+
+    if not isinstance(budget, dict):
+        raise ValueError('budget must be a `dict`!')
+
+    # validated by twipper.budget.Budget itself
+    Budget(**budget)
+
+    return budget
+
+
+def _parse_job(job, credentials, fields):
+    if not isinstance(job, dict):
+        raise ValueError('every job must be a `dict`!')
+
+    name = job.get('name')
+
+    if not isinstance(name, str) or not name:
+        raise ValueError('every job must have a `name`!')
+
+    unknown = set(job) - set(fields) - {'name', 'credentials', 'sink', 'language', 'filter_retweets'}
+
+    if unknown:
+        raise ValueError('job `' + name + '` contains unknown fields: ' + ', '.join(sorted(unknown)) + '.')
+
+    names = job.get('credentials', next(iter(credentials)))
+    names = [names] if isinstance(names, str) else names
+
+    if not isinstance(names, list) or not names or not all(item in credentials for item in names):
+        raise ValueError('job `' + name + '` must use any of the configured credentials!')
+
+    sink = job.get('sink')
+
+    if not isinstance(sink, dict) or sink.get('type') not in SINKS or not isinstance(sink.get('path'), str):
+        raise ValueError('job `' + name + '` must have a `sink` with a `type` (' + ', '.join(SINKS) + ') and a `path`!')
+
+    if job.get('language') is not None and not isinstance(job['language'], str):
+        raise ValueError('job `' + name + '` language must be a `str`!')
+
+    if not isinstance(job.get('filter_retweets', False), bool):
+        raise ValueError('job `' + name + '` filter_retweets must be a `bool`!')
+
+    parsed = dict((key, job[key]) for key in fields if key in job)
+
+    parsed.update({
+        'name': name,
+        'credentials': [(item, credentials[item]) for item in names],
+        'sink': sink,
+        'language': job.get('language'),
+        'filter_retweets': job.get('filter_retweets', False),
+    })
+
+    return parsed
+
+
+def _parse_stream(job, credentials):
+    job = _parse_job(job, credentials, ('query', 'countries', 'exact', 'backfill', 'workers'))
+
+    if ('query' in job) == ('countries' in job):
+        raise ValueError('stream `' + job['name'] + '` must have either a `query` or `countries`!')
+
+    if 'countries' in job and (not isinstance(job['countries'], list) or not job['countries']):
+        raise ValueError('stream `' + job['name'] + '` countries must be a `list` of `str`!')
+
+    if len(job['credentials']) != 1:
+        raise ValueError('stream `' + job['name'] + '` must use a single set of credentials!')
+
+    return job
+
+
+def _parse_search(job, credentials):
+    job = _parse_job(job, credentials, ('query', 'users', 'api', 'interval', 'page_count'))
+
+    if ('query' in job) == ('users' in job):
+        raise ValueError('search `' + job['name'] + '` must have either a `query` or `users`!')
+
+    if 'users' in job and (not isinstance(job['users'], list) or not job['users']):
+        raise ValueError('search `' + job['name'] + '` users must be a `list` of `str`!')
+
+    job.setdefault('api', 'batch')
+    job.setdefault('interval', 900)
+    job.setdefault('page_count', 1)
+
+    if job['api'] not in ('batch', 'premium'):
+        raise ValueError('search `' + job['name'] + '` api must be either `batch` or `premium`!')
+
+    if not isinstance(job['interval'], (int, float)) or job['interval'] <= 0:
+        raise ValueError('search `' + job['name'] + '` interval must be a `float` higher than 0!')
+
+    if not isinstance(job['page_count'], int) or job['page_count'] < 1:
+        raise ValueError('search `' + job['name'] + '` page_count must be an `int` equal or higher than 1!')
+
+    if job['api'] == 'premium' and len(job['credentials']) != 1:
+        raise ValueError('search `' + job['name'] + '` must use a single set of credentials on premium!')
+
+    return job
+
+
+class Metrics(object):
+    """
+    Metrics is the class which holds the counters and gauges of a collector, such as the tweets collected and the
+    errors of every job, and renders them on the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self.counters = dict()
+        self.gauges = dict()
+
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        """
+        This function increases the introduced counter, identified by its name and labels.
+        """
+
+        key = (name, tuple(sorted(labels.items())))
+
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """
+        This function sets the value of the introduced gauge, identified by its name and labels.
+        """
+
+        with self._lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def render(self):
+        """
+        This function renders every counter and gauge on the Prometheus text exposition format.
+        """
+
+        lines = list()
+
+        with self._lock:
+            for kind, values in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted(set(name for name, _ in values)):
+                    lines.append('# TYPE twipper_' + name + ' ' + kind)
+
+                    for (metric, labels), value in sorted(values.items()):
+                        if metric == name:
+                            lines.append('twipper_' + name + _labels(labels) + ' ' + str(value))
+
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+
+    return '{' + ','.join(key + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+                          for key, value in labels) + '}'
+
+
+class _MetricsServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self.server.collector.update_metrics()
+
+            body = self.server.collector.metrics.render().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif self.path == '/health':
+            body, content_type = b'ok\n', 'text/plain; charset=utf-8'
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Collector(object):
+    """
+    Collector is the class which runs the streams and searches (polling jobs) of a configuration file concurrently,
+    each of them on its own thread, storing their tweets on their sinks. The configuration file is checked every
+    `reload_interval` seconds (and reloaded on SIGHUP), so that changes are applied without a restart: just the jobs
+    which were removed or changed are stopped, once they finish storing the tweets they are handling, and just the new
+    or changed ones are started, so the rest keep collecting. If the new configuration is not valid, it is logged and
+    the running one is kept. Counters of the collected tweets and errors of every job, along with the rate limits of
+    every credential and the premium budget, are exposed on a local Prometheus endpoint if `metrics` are configured.
+    """
+
+    def __init__(self, path, connect=None):
+        """
+        This function is the constructor of :obj:`twipper.cli.Collector` class.
+
+        Args:
+            path (:obj:`str`): path to the configuration file (see :func:`twipper.cli.load_config`).
+            connect (:obj:`function`, optional):
+                function which creates the :obj:`twipper.credentials.Twipper` object of a set of credentials, given its
+                name and configuration, default is `None` which means that they are created from the configured keys.
+
+        Raises:
+            ValueError: raised if the introduced arguments do not match or errored.
+        """
+
+        if not isinstance(path, str):
+            raise ValueError('path must be a `str`!')
+
+        self.path = path
+        self.connect = connect if connect is not None else _connect
+
+        self.config = None
+        self.jobs = dict()
+        self.metrics = Metrics()
+        self.budget = None
+        self.server = None
+
+        self._credentials = dict()
+        self._lock = threading.RLock()
+        self._apply_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._modified = None
+
+    def credential(self, name, values):
+        """
+        This function retrieves the :obj:`twipper.credentials.Twipper` object of the introduced credentials, which is
+        created on first use and shared by every job using the same credentials.
+        """
+
+        key = (name, json.dumps(values, sort_keys=True))
+
+        with self._lock:
+            if key not in self._credentials:
+                self._credentials[key] = self.connect(name, values)
+
+            return self._credentials[key]
+
+    def access(self, job):
+        """
+        This function retrieves the credentials of the introduced job, pooled if it uses several of them.
+        """
+
+        credentials = [self.credential(name, values) for name, values in job['credentials']]
+
+        return credentials[0] if len(credentials) == 1 else CredentialPool(credentials)
+
+    def start(self):
+        """
+        This function loads the configuration file, starts its jobs and the metrics endpoint, if configured, and starts
+        watching the configuration file for changes.
+
+        Raises:
+            ValueError: raised if the configuration file is not valid.
+        """
+
+        self._modified = os.path.getmtime(self.path)
+
+        self.apply(load_config(self.path))
+
+        metrics = self.config['metrics']
+
+        if metrics is not None:
+            self.server = _MetricsServer((metrics['host'], metrics['port']), _MetricsHandler)
+            self.server.collector = self
+
+            threading.Thread(target=self.server.serve_forever, name='twipper-metrics', daemon=True).start()
+
+            logger.info('metrics exposed on http://%s:%d/metrics', *self.server.server_address[:2])
+
+        threading.Thread(target=self._watch, name='twipper-reload', daemon=True).start()
+
+    def _watch(self):
+        while not self._stopped.wait(self.config['reload_interval']):
+            try:
+                modified = os.path.getmtime(self.path)
+            except OSError:
+                continue
+
+            if modified != self._modified:
+                self._modified = modified
+                self.reload()
+
+    def reload(self):
+        """
+        This function reloads the configuration file and applies its changes, keeping the running configuration if the
+        new one is not valid.
+
+        Returns:
+            :obj:`boolean` - reloaded:
+                Returns `True` if the configuration was reloaded, `False` otherwise.
+        """
+
+        try:
+            config = load_config(self.path)
+        except (ValueError, ImportError, OSError) as e:
+            logger.error('configuration could not be reloaded, keeping the running one: %s', e)
+            self.metrics.inc('reload_errors_total')
+
+            return False
+
+        self.apply(config)
+        self.metrics.inc('reloads_total')
+
+        logger.info('configuration reloaded from %s', self.path)
+
+        return True
+
+    def apply(self, config):
+        """
+        This function applies the introduced configuration, stopping the running jobs which were removed or changed and
+        starting the new or changed ones.
+        """
+
+        wanted = dict((job['name'], job) for job in config['streams'] + config['searches'])
+
+        # configurations are applied one at a time, but stopped jobs are awaited without holding the lock, which the
+        # metrics endpoint and the jobs themselves (to retrieve their credentials) need meanwhile
+        with self._apply_lock:
+            with self._lock:
+                stopped = list()
+
+                for name, job in list(self.jobs.items()):
+                    if wanted.get(name) != job.spec:
+                        job.stop()
+                        stopped.append(self.jobs.pop(name))
+
+            # jobs are replaced once the previous ones are done, as every streaming credential holds a single connection
+            _join(stopped)
+
+            with self._lock:
+                if self._stopped.is_set():
+                    return
+
+                if config['budget'] != (self.config or dict()).get('budget'):
+                    self.budget = Budget(**config['budget']) if config['budget'] is not None else None
+
+                self.config = config
+
+                for name, spec in wanted.items():
+                    if name not in self.jobs:
+                        self.jobs[name] = _Job(self, spec)
+                        self.jobs[name].start()
+
+                        logger.info('job %s started', name)
+
+    def update_metrics(self):
+        """
+        This function updates the gauges of the rate limits of every credential and of the premium budget.
+        """
+
+        with self._lock:
+            credentials = dict((name, access) for (name, _), access in self._credentials.items())
+            budget = self.budget
+
+        for name, access in credentials.items():
+            for endpoint, status in access.rate_limit_status().items():
+                if status.get('remaining') is not None:
+                    self.metrics.set('rate_limit_remaining', status['remaining'], credentials=name, endpoint=endpoint)
+
+            if budget is not None and access.plan and access.label:
+                usage = budget.usage(access)
+
+                self.metrics.set('budget_requests', usage['requests'], credentials=name)
+                self.metrics.set('budget_tweets', usage['tweets'], credentials=name)
+
+    def stop(self):
+        """
+        This function stops every job, waiting for them to store the tweets they are handling, and the metrics endpoint.
+        """
+
+        self._stopped.set()
+
+        with self._apply_lock:
+            with self._lock:
+                stopped, self.jobs = list(self.jobs.values()), dict()
+
+                for job in stopped:
+                    job.stop()
+
+            _join(stopped)
+
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def run(self):
+        """
+        This function starts the collector and runs it until SIGINT or SIGTERM are received, reloading the
+        configuration file on SIGHUP.
+        """
+
+        self.start()
+
+        def terminate(*args):
+            self._stopped.set()
+
+        signal.signal(signal.SIGINT, terminate)
+        signal.signal(signal.SIGTERM, terminate)
+
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, lambda *args: threading.Thread(target=self.reload, daemon=True).start())
+
+        while not self._stopped.wait(1):
+            pass
+
+        logger.info('stopping collector')
+
+        self.stop()
+
+
+def _connect(name, values):
+    access = Twipper(values['consumer_key'], values['consumer_secret'], values['access_token'],
+                     values['access_token_secret'])
+
+    access.plan = values.get('plan', '')
+    access.label = values.get('label', '')
+
+    return access
+
+
+def _join(jobs):
+    for job in jobs:
+        job.join(STOP_TIMEOUT)
+
+        if job.is_alive():
+            logger.warning('job %s did not stop within %d seconds', job.spec['name'], STOP_TIMEOUT)
+
+
+class _Job(object):
+    """
+    _Job runs a stream or a search of the configuration of a collector on its own thread until it is stopped.
+    """
+
+    def __init__(self, collector, spec):
+        self.collector = collector
+        self.spec = spec
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='twipper-' + spec['name'], daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def _run(self):
+        name = self.spec['name']
+        metrics = self.collector.metrics
+
+        metrics.set('job_running', 1, job=name)
+
+        try:
+            sink = _open_sink(self.spec['sink'])
+
+            try:
+                if 'interval' in self.spec:
+                    self._search(sink)
+                else:
+                    self._stream(sink)
+            finally:
+                sink.close()
+        except Exception:
+            logger.exception('job %s failed', name)
+            metrics.inc('errors_total', job=name)
+        finally:
+            metrics.set('job_running', 0, job=name)
+
+    def _write(self, sink, tweets):
+        flushed = time.time()
+
+        for tweet in tweets:
+            sink.write(tweet)
+
+            self.collector.metrics.inc('tweets_total', job=self.spec['name'])
+
+            if hasattr(sink, 'flush') and time.time() - flushed >= FLUSH_INTERVAL:
+                sink.flush()
+                flushed = time.time()
+
+        if hasattr(sink, 'flush'):
+            sink.flush()
+
+    def _stream(self, sink):
+        spec, failures = self.spec, 0
+
+        while not self._stop.is_set():
+            try:
+                access = self.collector.access(spec)
+
+                # streams run until stopped, so the date limit is set to the farthest date possible
+                if 'query' in spec:
+                    tweets = streaming.stream_tweets(access, spec['query'], language=spec['language'],
+                                                     filter_retweets=spec['filter_retweets'], date_limit=FAR_FUTURE,
+                                                     retry='no_limit', workers=spec.get('workers'),
+                                                     backfill=spec.get('backfill'), stop=self._stop)
+                else:
+                    tweets = streaming.stream_multi_country_tweets(access, spec['countries'], language=spec['language'],
+                                                                   filter_retweets=spec['filter_retweets'],
+                                                                   date_limit=FAR_FUTURE, retry='no_limit',
+                                                                   exact=spec.get('exact', False), stop=self._stop)
+
+                    tweets = (tweet for _, tweet in tweets)
+
+                self._write(sink, tweets)
+
+                failures = 0
+            except Exception as e:
+                logger.warning('stream %s errored, reconnecting: %s', spec['name'], e)
+
+                self.collector.metrics.inc('errors_total', job=spec['name'])
+
+                failures += 1
+
+            # Twitter asks to back off exponentially from failed connections
+            self._stop.wait(min(320, 5 * 2 ** failures) if failures else 1)
+
+    def _search(self, sink):
+        spec = self.spec
+
+        # tweets posted since the last one retrieved for every batch rule, and the start of the next premium window
+        since_ids, window = dict(), time.time() - spec['interval']
+
+        while not self._stop.is_set():
+            started = time.time()
+
+            try:
+                if spec['api'] == 'premium':
+                    window = self._search_premium(sink, window, started)
+                else:
+                    self._search_batch(sink, since_ids, started)
+            except Exception as e:
+                logger.warning('search %s errored: %s', spec['name'], e)
+
+                self.collector.metrics.inc('errors_total', job=spec['name'])
+
+            self._stop.wait(max(0, spec['interval'] - (time.time() - started)))
+
+    def _truncated(self, result):
+        if result.metadata['truncated'] or result.metadata['next'] is not None:
+            logger.warning('search %s was truncated: %s', self.spec['name'],
+                           result.metadata['error'] or 'more than ' + str(self.spec['page_count']) + ' pages')
+
+            self.collector.metrics.inc('truncated_total', job=self.spec['name'])
+
+    def _search_batch(self, sink, since_ids, started):
+        spec = self.spec
+        access = self.collector.access(spec)
+
+        if isinstance(access, CredentialPool):
+            search = access.search_tweets
+        else:
+            search = functools.partial(batch.search_tweets, access)
+
+        if 'users' in spec:
+            # retweets are filtered on the rules themselves, so that they are counted on their length
+            query = '-filter:retweets' if spec['filter_retweets'] else None
+
+            rules = [rule for rule, _ in shard_user_query(spec['users'], query=query, max_length=QUERY_LENGTH)]
+        else:
+            rules = [spec['query']]
+
+        # the first search of every rule looks back one interval, and the next ones start on its last tweet
+        from_date = time.strftime('%Y%m%d%H%M', time.gmtime(started - spec['interval']))
+
+        for rule in rules:
+            since_id, max_id, newest = since_ids.get(rule), None, since_ids.get(rule)
+
+            # pages are retrieved newest first, so once page_count pages are retrieved, the older tweets left are
+            # searched below the oldest one retrieved, until every tweet posted since the last search is retrieved
+            while not self._stop.is_set():
+                try:
+                    result = search(rule, page_count=spec['page_count'], language=spec['language'],
+                                    filter_retweets=spec['filter_retweets'] and 'users' not in spec,
+                                    result_type='recent', from_date=from_date if since_id is None else None,
+                                    since_id=since_id, max_id=max_id)
+                except IndexError:
+                    break
+
+                self._write(sink, result)
+
+                ids = [int(tweet['id']) for tweet in result]
+
+                if ids:
+                    newest, max_id = max(ids + [newest or 0]), min(ids) - 1
+
+                if result.metadata['truncated']:
+                    self._truncated(result)
+                    break
+
+                if result.metadata['next'] is None or not ids:
+                    break
+
+            since_ids[rule] = newest
+
+    def _search_premium(self, sink, window, started):
+        spec = self.spec
+
+        # premium dates have minute precision, so windows are just searched once they span a whole minute, and the
+        # next one starts where the last one searched ended, so no tweet is skipped however short the interval is
+        from_date, to_date = (time.strftime('%Y%m%d%H%M', time.gmtime(value)) for value in (window, started))
+
+        if from_date >= to_date:
+            return window
+
+        access = self.collector.access(spec)
+
+        options = {
+            'language': spec['language'],
+            'filter_retweets': spec['filter_retweets'],
+            'budget': self.collector.budget,
+        }
+
+        try:
+            if 'users' in spec:
+                results = premium.search_users_tweets(access, spec['users'], spec['page_count'], from_date, to_date,
+                                                      **options)
+            else:
+                results = {None: premium.search_tweets(access, spec['query'], spec['page_count'], from_date, to_date,
+                                                       **options)}
+        except IndexError:
+            results = dict()
+
+        for result in results.values():
+            self._write(sink, result)
+
+        # the users searched with the same rule share the metadata of its search
+        for result in dict((result.metadata.get('rule'), result) for result in results.values()).values():
+            self._truncated(result)
+
+        return calendar.timegm(time.strptime(to_date, '%Y%m%d%H%M'))
+
+def _open_sink(sink):
+    if sink['type'] == 'sqlite':
+        return SQLiteSink(sink['path'])
+
+    if sink['type'] == 'partitioned':
+        return PartitionedSink(sink['path'], partition=sink.get('partition', 'hour'))
+
+    return ArchiveWriter(sink['path'], append=True)
+
+
+def main(argv=None):
+    """
+    This function is the entry point of the `twipper` command, which either runs a collector from a configuration file
+    (`twipper run <config>`) or just validates it (`twipper check <config>`).
+
+    Args:
+        argv (:obj:`list`, optional): arguments of the command, default is `None` which means `sys.argv`.
+
+    Returns:
+        :obj:`int` - status:
+            Returns the exit status of the command.
+    """
+
+    parser = argparse.ArgumentParser(prog='twipper', description='twipper - collects tweets from a config file.')
+    commands = parser.add_subparsers(dest='command')
+
+    run = commands.add_parser('run', help='run the streams and searches of a configuration file')
+    run.add_argument('config', help='path to the configuration file (TOML, YAML or JSON)')
+    run.add_argument('--log-level', default='INFO', help='logging level, default is INFO')
+
+    check = commands.add_parser('check', help='validate a configuration file')
+    check.add_argument('config', help='path to the configuration file (TOML, YAML or JSON)')
+
+    arguments = parser.parse_args(argv)
+
+    if arguments.command is None:
+        parser.print_help()
+        return 2
+
+    if arguments.command == 'check':
+        try:
+            config = load_config(arguments.config)
+        except (ValueError, ImportError, OSError) as e:
+            print('invalid configuration: ' + str(e), file=sys.stderr)
+            return 1
+
+        print('valid configuration: ' + str(len(config['streams'])) + ' streams and ' +
+              str(len(config['searches'])) + ' searches.')
+
+        return 0
+
+    logging.basicConfig(level=arguments.log_level.upper(), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    try:
+        Collector(arguments.config).run()
+    except (ValueError, ImportError, OSError) as e:
+        logger.error('collector could not be started: %s', e)
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,11 +5,13 @@
 # See LICENSE for details.
 
 import json
+import threading
 
 import oauth2
-import requests
 from requests_oauthlib import OAuth1
 
+from twipper.transport import Transport, get_transport
+
 
 class Twipper(object):
     """
@@ -18,7 +20,10 @@ class Twipper(object):
     https://developer.twitter.com/.
     """
 
-    def __init__(self, consumer_key, consumer_secret, access_token, access_token_secret):
+    # guards the rate limits of every credential, which are updated from any thread sending requests with them
+    _rate_limits_lock = threading.Lock()
+
+    def __init__(self, consumer_key, consumer_secret, access_token, access_token_secret, transport=None):
         """
         This function is the constructor of :obj:`twipper.credentials.Twipper` class,
         which will instantiate the class and initialize it with the respective arguments specified.
@@ -28,6 +33,8 @@ class Twipper(object):
            consumer_secret (:obj:`str`): Twitter API Consumer Key Secret.
            access_token (:obj:`str`): Twitter API Access Token.
            access_token_secret (:obj:`str`): Twitter API Access Token Secret.
+           transport (:obj:`twipper.transport.Transport`, optional):
+               transport every request is sent through, default is `None` which means the shared one.
         """
 
         self.consumer_key = consumer_key
@@ -35,6 +42,11 @@ class Twipper(object):
         self.access_token = access_token
         self.access_token_secret = access_token_secret
 
+        if transport is not None and not isinstance(transport, Transport):
+            raise ValueError('transport must be a `twipper.transport.Transport`!')
+
+        self.transport = transport if transport is not None else get_transport()
+
         self.api = self.__get_api()
         self.oauth = self.__get_oauth()
         self.oauth_token = self.__get_oauth_token()
@@ -42,6 +54,8 @@ class Twipper(object):
         self.plan = ''
         self.label = ''
 
+        self.rate_limits = dict()
+
     @property
     def plan(self):
         return self._plan
@@ -64,6 +78,48 @@ class Twipper(object):
         else:
             raise Exception('invalid value for dev environment label.')
 
+    def record_rate_limit(self, endpoint, headers, status=None):
+        """
+        This function records the rate limit status of an endpoint from the `x-rate-limit-*` headers of the last
+        response retrieved from it, so that the remaining requests of every endpoint are known without calling the
+        `application/rate_limit_status` endpoint. A `429` status code marks the endpoint as exhausted.
+
+        Args:
+            endpoint (:obj:`str`): name of the endpoint, such as `search/tweets`.
+            headers (:obj:`dict`): headers of the response (case-insensitive or lowercased).
+            status (:obj:`int`, optional): status code of the response, default is `None`.
+        """
+
+        limit = headers.get('x-rate-limit-limit')
+        remaining = headers.get('x-rate-limit-remaining')
+        reset = headers.get('x-rate-limit-reset')
+
+        if remaining is None and status != 429:
+            return
+
+        with self._rate_limits_lock:
+            current = self.rate_limits.get(endpoint, {})
+
+            self.rate_limits[endpoint] = {
+                'limit': int(limit) if limit is not None else current.get('limit'),
+                'remaining': 0 if status == 429 else int(remaining),
+                'reset': int(reset) if reset is not None else current.get('reset'),
+            }
+
+    def rate_limit_status(self):
+        """
+        This function retrieves a copy of the rate limit status of every endpoint recorded with
+        :meth:`twipper.credentials.Twipper.record_rate_limit`, which can be safely iterated while other threads keep
+        sending requests with these credentials.
+
+        Returns:
+            :obj:`dict` - rate_limits:
+                Returns a :obj:`dict` containing the `limit`, `remaining` and `reset` values of every endpoint.
+        """
+
+        with self._rate_limits_lock:
+            return dict((endpoint, dict(status)) for endpoint, status in self.rate_limits.items())
+
     def __get_api(self):
         """
         This function validates the credentials of the Twitter API, by validating the token with oauth2 as it is the
@@ -136,9 +192,9 @@ class Twipper(object):
             'client_secret': self.consumer_secret,
         }
 
-        response = requests.post(base_url,
-                                 auth=(self.consumer_key, self.consumer_secret),
-                                 data=data)
+        response = self.transport.request('POST', base_url,
+                                          auth=(self.consumer_key, self.consumer_secret),
+                                          data=data)
 
         if response.status_code != 200:
             return None
@@ -178,9 +234,9 @@ class Twipper(object):
 
         data = json.dumps(data)
 
-        response = requests.post(base_url,
-                                 headers=headers,
-                                 data=data)
+        response = self.transport.request('POST', base_url,
+                                          headers=headers,
+                                          data=data)
 
         if response.status_code != 200:
             return False
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2019 Alvaro Bartolome
+# See LICENSE for details.
+
+import zlib
+
+
+READ_SIZE = 64 * 1024
+
+
+class LineFramer(object):
+    """
+    LineFramer splits the bytes retrieved from the Twitter Streaming API into messages delimited by `\\r\\n`. Retrieved
+    chunks are appended to a single reusable :obj:`bytearray`, which is scanned just once (the search for the next
+    delimiter resumes where the previous one stopped) and compacted once per chunk, so on, every message is copied just
+    once, straight from the buffer into the :obj:`bytearray` handed to the JSON decoder. Blank lines, which are the
+    keep-alive signals sent by Twitter, are skipped.
+    """
+
+    def __init__(self, delimiter=b'\r\n'):
+        self.delimiter = delimiter
+
+        self._buffer = bytearray()
+        self._scan = 0
+
+    def feed(self, data):
+        """
+        This function appends the introduced chunk of bytes to the buffer and yields every complete message on it.
+
+        Args:
+            data (:obj:`bytes`): chunk of bytes retrieved from the connection.
+
+        Returns:
+            :obj:`bytearray` - message:
+                Yields a :obj:`bytearray` per complete message on the buffer, without its delimiter.
+        """
+
+        buffer = self._buffer
+        buffer += data
+
+        start = 0
+
+        while True:
+            end = buffer.find(self.delimiter, self._scan)
+
+            if end < 0:
+                break
+
+            if end > start:
+                yield buffer[start:end]
+
+            start = end + len(self.delimiter)
+            self._scan = start
+
+        if start:
+            del buffer[:start]
+
+        self._scan = max(0, len(buffer) - len(self.delimiter) + 1)
+
+    @property
+    def pending(self):
+        return len(self._buffer)
+
+
+class LengthFramer(object):
+    """
+    LengthFramer splits the bytes retrieved from the Twitter Streaming API when it is requested with the
+    `delimited=length` parameter, where every message is preceded by a line containing its length in bytes. So on,
+    instead of scanning every message looking for its delimiter, just the short length lines are scanned and messages
+    are sliced straight from the buffer once all their bytes are available.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._length = None
+
+    def feed(self, data):
+        """
+        This function appends the introduced chunk of bytes to the buffer and yields every complete message on it.
+
+        Args:
+            data (:obj:`bytes`): chunk of bytes retrieved from the connection.
+
+        Returns:
+            :obj:`bytearray` - message:
+                Yields a :obj:`bytearray` per complete message on the buffer.
+
+        Raises:
+            ValueError: raised if a length line does not contain a valid length.
+        """
+
+        buffer = self._buffer
+        buffer += data
+
+        start = 0
+
+        while True:
+            if self._length is None:
+                end = buffer.find(b'\r\n', start)
+
+                if end < 0:
+                    break
+
+                line = buffer[start:end].strip()
+                start = end + 2
+
+                if not line:
+                    continue
+
+                try:
+                    self._length = int(line)
+                except ValueError:
+                    raise ValueError('invalid message length `' + line.decode('utf-8', 'replace') + '`.')
+
+            if len(buffer) - start < self._length:
+                break
+
+            yield buffer[start:start + self._length]
+
+            start += self._length
+            self._length = None
+
+        if start:
+            del buffer[:start]
+
+    @property
+    def pending(self):
+        return len(self._buffer)
+
+
+def iter_messages(chunks, delimited=None, keep_alives=False):
+    """
+    This function splits the introduced chunks of bytes (such as the ones retrieved from the Twitter Streaming API
+    with :meth:`requests.Response.iter_content`) into messages, using either a :obj:`twipper.framing.LineFramer` or a
+    :obj:`twipper.framing.LengthFramer` if the stream was requested with `delimited=length`.
+
+    Args:
+        chunks (:obj:`iterable`): chunks of bytes retrieved from the connection.
+        delimited (:obj:`str`, optional): either `None` or `length`, as sent on the `delimited` parameter.
+        keep_alives (:obj:`boolean`, optional):
+            if `True`, an empty message is yielded for every keep-alive, this is, for every chunk which neither
+            completes a message nor leaves a partial one, so that consumers can act while the stream is idle, default
+            is `False`.
+
+    Returns:
+        :obj:`bytearray` - message:
+            Yields a :obj:`bytearray` per complete message, which can be decoded with :func:`json.loads`.
+
+    Raises:
+        ValueError: raised if the introduced arguments do not match or errored.
+    """
+
+    if delimited is None:
+        framer = LineFramer()
+    elif delimited == 'length':
+        framer = LengthFramer()
+    else:
+        raise ValueError('delimited can just be `None` or `length`!')
+
+    for chunk in chunks:
+        if chunk:
+            idle = True
+
+            for message in framer.feed(chunk):
+                idle = False
+                yield message
+
+            if keep_alives and idle and not framer.pending:
+                yield bytearray()
+
+
+def decompress(chunks, encoding=None):
+    """
+    This function incrementally decompresses the introduced chunks of bytes retrieved from a connection whose
+    `Content-Encoding` is `gzip` or `deflate`, yielding the decompressed bytes as soon as each chunk is received. Since
+    Twitter flushes the compressed stream after every message, partial chunks still produce complete messages promptly.
+    Chunks are yielded untouched if there is no encoding.
+
+    Args:
+        chunks (:obj:`iterable`): chunks of (compressed) bytes retrieved from the connection.
+        encoding (:obj:`str`, optional): value of the `Content-Encoding` header of the response, default is `None`.
+
+    Returns:
+        :obj:`bytes` - data:
+            Yields the decompressed :obj:`bytes` of every chunk.
+
+    Raises:
+        ValueError: raised if the introduced encoding is not supported.
+    """
+
+    encoding = (encoding or 'identity').strip().lower()
+
+    if encoding == 'identity':
+        for chunk in chunks:
+            yield chunk
+
+        return
+
+    if encoding == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif encoding == 'deflate':
+        decompressor = zlib.decompressobj()
+    else:
+        raise ValueError('content encoding `' + encoding + '` is not supported.')
+
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+
+        if data:
+            yield data
+
+    data = decompressor.flush()
+
+    if data:
+        yield data
@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2019 Alvaro Bartolome
+# See LICENSE for details.
+
+import json
+import math
+import os
+
+
+COUNTRY_POLYGONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resources', 'countries.json')
+
+
+def parse_bounding_box(bounding_box):
+    """
+    This function converts a bounding box as formatted on the `locations` parameter of the Twitter Streaming API (and as
+    returned by :func:`twipper.utils.country_to_bounding_box`) into its coordinates. Bounding boxes crossing the
+    antimeridian (where the western longitude is higher than the eastern one) are split in two, since Twitter expects
+    the western longitude to be lower than the eastern one.
+
+    Args:
+        bounding_box (:obj:`str` or :obj:`tuple`): bounding box as `west,south,east,north` or as a :obj:`tuple`.
+
+    Returns:
+        :obj:`list` - boxes:
+            Returns a :obj:`list` of :obj:`tuple` containing the `(west, south, east, north)` coordinates of the boxes.
+
+    Raises:
+        ValueError: raised if the introduced bounding box is not valid.
+    """
+
+    if isinstance(bounding_box, str):
+        bounding_box = bounding_box.split(',')
+
+    try:
+        west, south, east, north = [float(value) for value in bounding_box]
+    except (TypeError, ValueError):
+        raise ValueError('bounding_box must contain the `west,south,east,north` coordinates!')
+
+    if south > north:
+        raise ValueError('bounding_box southern latitude must be lower than the northern one!')
+
+    if west > east:
+        return [(west, south, 180.0, north), (-180.0, south, east, north)]
+
+    return [(west, south, east, north)]
+
+
+def tweet_point(tweet):
+    """
+    This function retrieves the location of a tweet as a single point, which is either its exact coordinates (when the
+    user shared them) or the center of the bounding box of the place the tweet is tagged with.
+
+    Args:
+        tweet (:obj:`dict`): tweet as retrieved from the Twitter API.
+
+    Returns:
+        :obj:`tuple` - point:
+            Returns a :obj:`tuple` containing the `(longitude, latitude)` of the tweet or `None` if it is not located.
+    """
+
+    coordinates = tweet.get('coordinates')
+
+    if coordinates and coordinates.get('coordinates'):
+        longitude, latitude = coordinates['coordinates'][:2]
+        return float(longitude), float(latitude)
+
+    place = tweet.get('place')
+
+    if place and place.get('bounding_box') and place['bounding_box'].get('coordinates'):
+        ring = place['bounding_box']['coordinates'][0]
+
+        longitudes = [float(point[0]) for point in ring]
+        latitudes = [float(point[1]) for point in ring]
+
+        return (min(longitudes) + max(longitudes)) / 2, (min(latitudes) + max(latitudes)) / 2
+
+    return None
+
+
+class BoundingBoxIndex(object):
+    """
+    BoundingBoxIndex is a spatial index over a set of named bounding boxes, which splits the world into a regular grid
+    and precomputes which boxes overlap each cell, so on, locating a point just requires a dictionary lookup and a few
+    comparisons no matter how many boxes the index contains. Whenever a point falls into more than one box, the smallest
+    one is the one retrieved, as it is the most specific.
+    """
+
+    def __init__(self, boxes, cell_size=1.0):
+        """
+        This function is the constructor of :obj:`twipper.geo.BoundingBoxIndex` class, which builds the grid from
+        the introduced bounding boxes.
+
+        Args:
+            boxes (:obj:`dict`): names as keys and bounding boxes as values, formatted as `west,south,east,north`.
+            cell_size (:obj:`float`, optional): size in degrees of every cell of the grid, default is 1 degree.
+
+        Raises:
+            ValueError: raised if the introduced arguments do not match or errored.
+        """
+
+        if not isinstance(boxes, dict):
+            raise ValueError('boxes must be a `dict`!')
+
+        if not isinstance(cell_size, (int, float)) or cell_size <= 0:
+            raise ValueError('cell_size must be a number higher than 0!')
+
+        self.cell_size = float(cell_size)
+
+        self.boxes = list()
+
+        for name, bounding_box in boxes.items():
+            for box in parse_bounding_box(bounding_box):
+                self.boxes.append((name, box))
+
+        self.boxes.sort(key=lambda item: (item[1][2] - item[1][0]) * (item[1][3] - item[1][1]))
+
+        self._cells = dict()
+
+        for position, (_, (west, south, east, north)) in enumerate(self.boxes):
+            for x in range(self._cell(west), self._cell(east) + 1):
+                for y in range(self._cell(south), self._cell(north) + 1):
+                    self._cells.setdefault((x, y), list()).append(position)
+
+    def _cell(self, value):
+        return int(math.floor(value / self.cell_size))
+
+    @property
+    def locations(self):
+        """
+        This property formats every bounding box of the index as the `locations` parameter of Twitter Streaming API.
+        """
+
+        return ','.join(','.join(str(value) for value in box) for _, box in self.boxes)
+
+    def locate(self, longitude, latitude):
+        """
+        This function retrieves the name of the smallest bounding box of the index containing the introduced point.
+
+        Args:
+            longitude (:obj:`float`): longitude of the point.
+            latitude (:obj:`float`): latitude of the point.
+
+        Returns:
+            :obj:`str` - name:
+                Returns the name of the bounding box containing the point, or `None` if no box contains it.
+        """
+
+        for position in self._cells.get((self._cell(longitude), self._cell(latitude)), ()):
+            name, (west, south, east, north) = self.boxes[position]
+
+            if west <= longitude <= east and south <= latitude <= north:
+                return name
+
+        return None
+
+    def locate_tweet(self, tweet):
+        """
+        This function retrieves the name of the bounding box of the index a tweet belongs to, based on its coordinates
+        or on the bounding box of the place it is tagged with.
+
+        Args:
+            tweet (:obj:`dict`): tweet as retrieved from the Twitter API.
+
+        Returns:
+            :obj:`str` - name:
+                Returns the name of the bounding box containing the tweet, or `None` if it cannot be located.
+        """
+
+        point = tweet_point(tweet)
+
+        if point is None:
+            return None
+
+        return self.locate(*point)
+
+
+def point_in_ring(longitude, latitude, ring):
+    """
+    This function checks whether a point is inside a closed ring of coordinates or not, using the ray casting
+    algorithm, which counts how many edges of the ring a ray cast from the point towards the east crosses.
+
+    Args:
+        longitude (:obj:`float`): longitude of the point.
+        latitude (:obj:`float`): latitude of the point.
+        ring (:obj:`list`): list of `[longitude, latitude]` points, as formatted on GeoJSON.
+
+    Returns:
+        :obj:`boolean` - inside:
+            Returns `True` if the point is inside the ring or `False` otherwise.
+    """
+
+    inside = False
+
+    previous_x, previous_y = ring[-1][0], ring[-1][1]
+
+    for point in ring:
+        x, y = point[0], point[1]
+
+        if (y > latitude) != (previous_y > latitude):
+            if longitude < (previous_x - x) * (latitude - y) / (previous_y - y) + x:
+                inside = not inside
+
+        previous_x, previous_y = x, y
+
+    return inside
+
+
+def point_in_polygon(longitude, latitude, polygon):
+    """
+    This function checks whether a point is inside a GeoJSON polygon or not, which means that it is inside its exterior
+    ring but not inside any of its holes.
+
+    Args:
+        longitude (:obj:`float`): longitude of the point.
+        latitude (:obj:`float`): latitude of the point.
+        polygon (:obj:`list`): list of rings of the polygon, where the first one is the exterior ring.
+
+    Returns:
+        :obj:`boolean` - inside:
+            Returns `True` if the point is inside the polygon or `False` otherwise.
+    """
+
+    if not point_in_ring(longitude, latitude, polygon[0]):
+        return False
+
+    for hole in polygon[1:]:
+        if point_in_ring(longitude, latitude, hole):
+            return False
+
+    return True
+
+
+class PolygonIndex(object):
+    """
+    PolygonIndex is a spatial index over a set of named polygons (such as country borders), which splits the world
+    into a regular grid and classifies every cell as either fully inside a polygon or crossed by its border. So on,
+    points falling into a cell fully inside a polygon are located with just a dictionary lookup, and the exact
+    point-in-polygon test is only computed for the few points that fall close to a border.
+    """
+
+    def __init__(self, polygons, cell_size=0.25):
+        """
+        This function is the constructor of :obj:`twipper.geo.PolygonIndex` class, which builds the grid from the
+        introduced polygons.
+
+        Args:
+            polygons (:obj:`dict`):
+                names as keys and a :obj:`list` of GeoJSON polygons (each one a :obj:`list` of rings) as values.
+            cell_size (:obj:`float`, optional): size in degrees of every cell of the grid, default is 0.25 degrees.
+
+        Raises:
+            ValueError: raised if the introduced arguments do not match or errored.
+        """
+
+        if not isinstance(polygons, dict):
+            raise ValueError('polygons must be a `dict`!')
+
+        if not isinstance(cell_size, (int, float)) or cell_size <= 0:
+            raise ValueError('cell_size must be a number higher than 0!')
+
+        self.cell_size = float(cell_size)
+
+        self.names = sorted(polygons.keys())
+
+        self.polygons = list()
+
+        self._inside = dict()
+        self._border = dict()
+
+        for name in self.names:
+            for polygon in polygons[name]:
+                self.polygons.append((name, polygon))
+                self._add(len(self.polygons) - 1, polygon)
+
+    def _cell(self, value):
+        return int(math.floor(value / self.cell_size))
+
+    def _add(self, position, polygon):
+        border = set()
+
+        for ring in polygon:
+            previous = ring[-1]
+
+            for point in ring:
+                for x in range(self._cell(min(previous[0], point[0])), self._cell(max(previous[0], point[0])) + 1):
+                    for y in range(self._cell(min(previous[1], point[1])), self._cell(max(previous[1], point[1])) + 1):
+                        border.add((x, y))
+
+                previous = point
+
+        for cell in border:
+            self._border.setdefault(cell, list()).append(position)
+
+        exterior = polygon[0]
+
+        south = self._cell(min(point[1] for point in exterior))
+        north = self._cell(max(point[1] for point in exterior))
+
+        # cells are filled row by row with a scanline: the edges crossed by the latitude of the centers of a row are
+        # sorted, and the centers between every even crossing and the next one are inside (as on the ray casting)
+        for y in range(south, north + 1):
+            latitude = (y + .5) * self.cell_size
+
+            crossings = list()
+
+            for ring in polygon:
+                previous_x, previous_y = ring[-1][0], ring[-1][1]
+
+                for point in ring:
+                    x, point_y = point[0], point[1]
+
+                    if (point_y > latitude) != (previous_y > latitude):
+                        crossings.append((previous_x - x) * (latitude - point_y) / (previous_y - point_y) + x)
+
+                    previous_x, previous_y = x, point_y
+
+            crossings.sort()
+
+            for start, end in zip(crossings[::2], crossings[1::2]):
+                for x in range(int(math.ceil(start / self.cell_size - .5)), int(math.ceil(end / self.cell_size - .5))):
+                    if (x, y) not in border:
+                        self._inside[(x, y)] = self.polygons[position][0]
+
+    @classmethod
+    def from_geojson(cls, path=COUNTRY_POLYGONS, names=None, cell_size=0.25):
+        """
+        This function builds a :obj:`twipper.geo.PolygonIndex` from a GeoJSON `FeatureCollection` of `Polygon` or
+        `MultiPolygon` features, named after their `name` property (lowercased). By default, the country borders bundled
+        with twipper are used, which are the 177 countries of Natural Earth at 1:110m (public domain, named after their
+        Natural Earth short name, e.g. `united states of america` or `dem. rep. congo`, and rounded to 0.01 degrees),
+        but any other GeoJSON file (e.g. Natural Earth countries at 1:50m) can be used.
+
+        Args:
+            path (:obj:`str`, optional): path to the GeoJSON file, default are the bundled country borders.
+            names (:obj:`list`, optional): names of the features to load, default is `None` which loads all of them.
+            cell_size (:obj:`float`, optional): size in degrees of every cell of the grid, default is 0.25 degrees.
+
+        Returns:
+            :obj:`twipper.geo.PolygonIndex` - index:
+                Returns the index built from the polygons of the GeoJSON file.
+
+        Raises:
+            ValueError: raised if the file could not be loaded or if any of the introduced names is not available.
+        """
+
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                collection = json.load(f)
+        except (IOError, ValueError):
+            raise ValueError('GeoJSON file `' + str(path) + '` could not be loaded.')
+
+        if names is not None:
+            names = set(name.lower().strip() for name in names)
+
+        polygons = dict()
+
+        for feature in collection.get('features', []):
+            name = str(feature.get('properties', {}).get('name', '')).lower().strip()
+
+            if names is not None and name not in names:
+                continue
+
+            geometry = feature.get('geometry') or {}
+
+            if geometry.get('type') == 'Polygon':
+                polygons.setdefault(name, list()).append(geometry['coordinates'])
+            elif geometry.get('type') == 'MultiPolygon':
+                polygons.setdefault(name, list()).extend(geometry['coordinates'])
+
+        if names is not None and names - set(polygons.keys()):
+            raise ValueError('polygons of `' + '`, `'.join(sorted(names - set(polygons.keys()))) + '` are not '
+                             'available on `' + str(path) + '`.')
+
+        return cls(polygons, cell_size=cell_size)
+
+    def locate(self, longitude, latitude):
+        """
+        This function retrieves the name of the polygon of the index containing the introduced point.
+
+        Args:
+            longitude (:obj:`float`): longitude of the point.
+            latitude (:obj:`float`): latitude of the point.
+
+        Returns:
+            :obj:`str` - name:
+                Returns the name of the polygon containing the point, or `None` if no polygon contains it.
+        """
+
+        cell = (self._cell(longitude), self._cell(latitude))
+
+        if cell in self._inside:
+            return self._inside[cell]
+
+        for position in self._border.get(cell, ()):
+            name, polygon = self.polygons[position]
+
+            if point_in_polygon(longitude, latitude, polygon):
+                return name
+
+        return None
+
+    def locate_tweet(self, tweet):
+        """
+        This function retrieves the name of the polygon of the index a tweet belongs to, based on its coordinates or on
+        the center of the bounding box of the place it is tagged with.
+
+        Args:
+            tweet (:obj:`dict`): tweet as retrieved from the Twitter API.
+
+        Returns:
+            :obj:`str` - name:
+                Returns the name of the polygon containing the tweet, or `None` if it cannot be located.
+        """
+
+        point = tweet_point(tweet)
+
+        if point is None:
+            return None
+
+        return self.locate(*point)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2019 Alvaro Bartolome
+# See LICENSE for details.
+
+from collections import OrderedDict
+
+from twipper.utils import TWITTER_EPOCH
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+
+SCHEMA = [
+    ('id', 'int64'),
+    ('timestamp_ms', 'int64'),
+    ('created_at', 'object'),
+    ('lang', 'object'),
+    ('text', 'object'),
+    ('user_id', 'int64'),
+    ('screen_name', 'object'),
+    ('name', 'object'),
+    ('verified', 'bool'),
+    ('followers_count', 'int64'),
+    ('friends_count', 'int64'),
+    ('retweet_count', 'int64'),
+    ('favorite_count', 'int64'),
+    ('in_reply_to_id', 'int64'),
+    ('is_retweet', 'bool'),
+    ('retweeted_id', 'int64'),
+    ('retweeted_screen_name', 'object'),
+    ('is_quote', 'bool'),
+    ('quoted_id', 'int64'),
+    ('quoted_text', 'object'),
+]
+"""
+Columns (and their NumPy dtypes) generated when normalizing tweets. The `text` of a retweet is the complete text of the
+retweeted tweet (since the text of the retweet itself is truncated), while `retweet_count` and `favorite_count` are
+the ones of the retweeted tweet too, as Twitter reports them. Missing ids and counts are filled with 0, and missing
+strings with `None`.
+"""
+
+
+def _text(status):
+    extended = status.get('extended_tweet')
+
+    if extended is not None and 'full_text' in extended:
+        return extended['full_text']
+
+    text = status.get('full_text')
+
+    if text is None:
+        text = status.get('text')
+
+    return text
+
+
+def normalize_tweets(tweets):
+    """
+    This function flattens the introduced tweets (such as a page retrieved with :func:`twipper.batch.search_tweets`)
+    into a column per field of :obj:`twipper.normalize.SCHEMA`, where every column is a NumPy array preallocated with
+    the length of the page and filled in a single pass over the tweets, so no intermediate records are built. The text
+    of every tweet is resolved from `extended_tweet.full_text`, `full_text` or `text` (in that order), using the
+    retweeted tweet for retweets, and timestamps are decoded at once from the snowflake ids.
+
+    Args:
+        tweets (:obj:`list`): tweets as retrieved from the Twitter API.
+
+    Returns:
+        :obj:`collections.OrderedDict` - columns:
+            Returns an :obj:`collections.OrderedDict` mapping every column name of the schema to a NumPy array.
+
+    Raises:
+        ImportError: raised if NumPy is not installed.
+    """
+
+    if np is None:
+        raise ImportError('numpy is required to normalize tweets, install it with `pip install numpy`.')
+
+    if not isinstance(tweets, (list, tuple)):
+        tweets = list(tweets)
+
+    size = len(tweets)
+
+    columns = OrderedDict((name, np.zeros(size, dtype=dtype) if dtype != 'object' else np.empty(size, dtype=object))
+                          for name, dtype in SCHEMA)
+
+    ids = columns['id']
+    created_at = columns['created_at']
+    lang = columns['lang']
+    text = columns['text']
+    user_id = columns['user_id']
+    screen_name = columns['screen_name']
+    name = columns['name']
+    verified = columns['verified']
+    followers_count = columns['followers_count']
+    friends_count = columns['friends_count']
+    retweet_count = columns['retweet_count']
+    favorite_count = columns['favorite_count']
+    in_reply_to_id = columns['in_reply_to_id']
+    is_retweet = columns['is_retweet']
+    retweeted_id = columns['retweeted_id']
+    retweeted_screen_name = columns['retweeted_screen_name']
+    is_quote = columns['is_quote']
+    quoted_id = columns['quoted_id']
+    quoted_text = columns['quoted_text']
+
+    empty = {}
+
+    for index, tweet in enumerate(tweets):
+        ids[index] = tweet['id']
+        created_at[index] = tweet.get('created_at')
+        lang[index] = tweet.get('lang')
+
+        user = tweet.get('user') or empty
+
+        user_id[index] = user.get('id') or 0
+        screen_name[index] = user.get('screen_name')
+        name[index] = user.get('name')
+        verified[index] = user.get('verified') or False
+        followers_count[index] = user.get('followers_count') or 0
+        friends_count[index] = user.get('friends_count') or 0
+
+        in_reply_to_id[index] = tweet.get('in_reply_to_status_id') or 0
+
+        retweeted = tweet.get('retweeted_status')
+
+        if retweeted is not None:
+            is_retweet[index] = True
+            retweeted_id[index] = retweeted.get('id') or 0
+            retweeted_screen_name[index] = (retweeted.get('user') or empty).get('screen_name')
+            content = retweeted
+        else:
+            content = tweet
+
+        text[index] = _text(content)
+        retweet_count[index] = content.get('retweet_count') or 0
+        favorite_count[index] = content.get('favorite_count') or 0
+
+        quoted = content.get('quoted_status')
+
+        if quoted is not None or content.get('is_quote_status'):
+            is_quote[index] = True
+            quoted_id[index] = (quoted or empty).get('id') or content.get('quoted_status_id') or 0
+            quoted_text[index] = _text(quoted) if quoted is not None else None
+
+    columns['timestamp_ms'] = (ids >> 22) + TWITTER_EPOCH
+
+    return columns
+
+
+def tweets_to_dataframe(tweets):
+    """
+    This function flattens the introduced tweets into a :obj:`pandas.DataFrame` whose columns are the ones of
+    :obj:`twipper.normalize.SCHEMA`, built straight from the arrays generated by
+    :func:`twipper.normalize.normalize_tweets` without copying them. Since the schema is fixed, pages can be
+    concatenated safely even if some fields were missing on any of them.
+
+    Args:
+        tweets (:obj:`list`): tweets as retrieved from the Twitter API.
+
+    Returns:
+        :obj:`pandas.DataFrame` - data:
+            Returns a :obj:`pandas.DataFrame` containing a row per tweet.
+
+    Raises:
+        ImportError: raised if pandas is not installed.
+    """
+
+    if pd is None:
+        raise ImportError('pandas is required to build a DataFrame, install it with `pip install pandas`.')
+
+    return pd.DataFrame(normalize_tweets(tweets), copy=False)
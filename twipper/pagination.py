@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2019 Alvaro Bartolome
+# See LICENSE for details.
+
+import json
+import queue
+import re
+import threading
+
+
+_END = object()
+
+_STRING = re.compile(rb'\s*:\s*("(?:[^"\\]|\\.)*")')
+
+
+def paginate(fetch, parse, peek, page_count, prefetch=1):
+    """
+    This function retrieves up to `page_count` pages of a paginated endpoint of the Twitter API, yielding the results
+    of every page. If `prefetch` is higher than 0, pages are fetched on a background thread up to `prefetch` pages ahead
+    of the one being parsed, so that network time overlaps with parsing and with the consumer; to do so, the cursor of
+    the next page is peeked from the raw bytes of every response as soon as it is retrieved, instead of waiting for the
+    whole page to be parsed. If the peeked cursor does not match the parsed one, the pages fetched ahead are discarded
+    and the remaining ones are fetched sequentially, so the retrieved results are always the same ones.
+
+    Args:
+        fetch (:obj:`function`): function which retrieves the response of a page, given its cursor (`None` for the
+            first page), or any other object if the page could not be retrieved, which is then handed to `parse`.
+        parse (:obj:`function`): function which, given a response and the index of its page, returns a :obj:`tuple`
+            containing the results of the page and the cursor of the next one (`None` if it is the last one), or
+            `None` if the pagination should stop.
+        peek (:obj:`function`): function which retrieves the cursor of the next page from the raw bytes of a response
+            without parsing it, or `None` if there is no next page.
+        page_count (:obj:`int`): maximum number of pages to retrieve.
+        prefetch (:obj:`int`, optional): number of pages fetched ahead of the one being parsed, default is 1, and 0
+            means that pages are fetched sequentially.
+
+    Returns:
+        :obj:`list` - results:
+            Yields the results of every retrieved page.
+    """
+
+    if not isinstance(prefetch, int) or prefetch < 0:
+        raise ValueError('prefetch must be an `int` equal or higher than 0!')
+
+    cursor, page = None, 0
+
+    if prefetch > 0 and page_count > 1:
+        pipeline = _Pipeline(fetch, peek, page_count, prefetch)
+
+        try:
+            while page < page_count:
+                response, peeked = pipeline.get()
+
+                parsed = parse(response, page)
+
+                if parsed is None:
+                    return
+
+                results, cursor = parsed
+                page += 1
+
+                yield results
+
+                if cursor is None:
+                    return
+
+                if cursor != peeked:
+                    break
+        finally:
+            pipeline.stop()
+
+    while page < page_count:
+        parsed = parse(fetch(cursor), page)
+
+        if parsed is None:
+            return
+
+        results, cursor = parsed
+        page += 1
+
+        yield results
+
+        if cursor is None:
+            return
+
+
+class _Pipeline(object):
+    """
+    _Pipeline fetches the pages of a paginated endpoint on a background thread, following the peeked cursors, while
+    keeping at most `prefetch` pages retrieved and not consumed yet.
+    """
+
+    def __init__(self, fetch, peek, page_count, prefetch):
+        self._fetch = fetch
+        self._peek = peek
+
+        self._pages = queue.Queue()
+        self._slots = threading.Semaphore(prefetch)
+        self._stopped = threading.Event()
+
+        self._thread = threading.Thread(target=self._run, args=(page_count,), daemon=True)
+        self._thread.start()
+
+    def _run(self, page_count):
+        cursor = None
+
+        try:
+            for _ in range(page_count):
+                self._slots.acquire()
+
+                if self._stopped.is_set():
+                    return
+
+                response = self._fetch(cursor)
+
+                cursor = self._peek(response.content) if getattr(response, 'status_code', None) == 200 else None
+
+                self._pages.put((response, cursor, None))
+
+                if cursor is None:
+                    return
+        except Exception as e:
+            self._pages.put((None, None, e))
+        finally:
+            self._pages.put(_END)
+
+    def get(self):
+        item = self._pages.get()
+
+        self._slots.release()
+
+        if item is _END:
+            raise RuntimeError('pages could not be prefetched.')
+
+        response, cursor, error = item
+
+        if error is not None:
+            raise error
+
+        return response, cursor
+
+    def stop(self):
+        self._stopped.set()
+        self._slots.release()
+
+
+def peek_json_string(content, key):
+    """
+    This function retrieves the value of the last string field named `key` from a raw JSON document, without parsing
+    it, as the cursors of the Twitter API are placed at the end of every page. Occurrences of the name preceded by an
+    escaping backslash or not followed by a string value are skipped, so that the contents of a string, such as the text
+    of a tweet, are not mistaken with the field.
+
+    Args:
+        content (:obj:`bytes`): raw JSON document.
+        key (:obj:`str`): name of the field.
+
+    Returns:
+        :obj:`str` - value:
+            Returns the value of the field, or `None` if the document does not contain it.
+    """
+
+    name = b'"' + key.encode('utf-8') + b'"'
+
+    position = content.rfind(name)
+
+    while position >= 0:
+        match = _STRING.match(content, position + len(name))
+
+        if match is not None and not _escaped(content, position):
+            return json.loads(match.group(1).decode('utf-8'))
+
+        position = content.rfind(name, 0, position)
+
+    return None
+
+
+def _escaped(content, position):
+    backslashes = 0
+
+    while position - backslashes > 0 and content[position - backslashes - 1] == 0x5c:
+        backslashes += 1
+
+    return backslashes % 2 == 1
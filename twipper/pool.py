@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2019 Alvaro Bartolome
+# See LICENSE for details.
+
+import sys
+import threading
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+import twipper.batch as batch
+import twipper.premium as premium
+import twipper.streaming as streaming
+from twipper.credentials import Twipper
+
+
+PREMIUM_ENDPOINT = 'tweets/search'
+STREAMING_ENDPOINT = 'statuses/filter'
+
+DEFAULT_LIMITS = {
+    batch.ENDPOINT: 180,
+    PREMIUM_ENDPOINT: 30,
+    STREAMING_ENDPOINT: 1,
+}
+
+RATE_LIMIT_WINDOW = 15 * 60
+
+
+class CredentialPool(object):
+    """
+    CredentialPool holds several :obj:`twipper.credentials.Twipper` objects and routes every call to the Twitter API
+    through the credential with the most remaining requests on the endpoint being called, based on the rate limit
+    headers recorded on every credential (see :meth:`twipper.credentials.Twipper.record_rate_limit`) minus the requests
+    currently in flight, as every search reserves as many requests as pages it retrieves. Credentials with no remaining
+    requests are parked until their rate limit window is reset, and every streaming credential holds just one
+    connection at a time, so the throughput grows linearly with the number of credentials. The pool is thread-safe, so
+    it can be shared by several workers.
+    """
+
+    def __init__(self, credentials):
+        """
+        This function is the constructor of :obj:`twipper.pool.CredentialPool` class.
+
+        Args:
+            credentials (:obj:`list`): :obj:`twipper.credentials.Twipper` objects to be pooled.
+
+        Raises:
+            ValueError: raised if the introduced arguments do not match or errored.
+        """
+
+        credentials = list(credentials) if credentials is not None else list()
+
+        if len(credentials) < 1:
+            raise ValueError('credentials must be a `list` containing at least one `twipper.credentials.Twipper`!')
+
+        for access in credentials:
+            if not isinstance(access, Twipper):
+                raise ValueError('every credential must be a `twipper.credentials.Twipper`!')
+
+        self.credentials = credentials
+
+        self._condition = threading.Condition()
+
+        self._inflight = [defaultdict(int) for _ in credentials]
+        self._requests = [defaultdict(int) for _ in credentials]
+        self._parked = [dict() for _ in credentials]
+
+    def __len__(self):
+        return len(self.credentials)
+
+    def _index(self, access):
+        for index, credential in enumerate(self.credentials):
+            if credential is access:
+                return index
+
+        raise ValueError('the introduced credential does not belong to the pool!')
+
+    @staticmethod
+    def _endpoint(access, endpoint):
+        if endpoint == PREMIUM_ENDPOINT:
+            return PREMIUM_ENDPOINT + '/' + access.plan
+
+        return endpoint
+
+    def _capacity(self, index, endpoint):
+        status = self.credentials[index].rate_limits.get(self._endpoint(self.credentials[index], endpoint))
+
+        if status and status.get('limit'):
+            return status['limit']
+
+        return DEFAULT_LIMITS.get(endpoint, sys.maxsize)
+
+    def _budget(self, index, endpoint, now):
+        access = self.credentials[index]
+        inflight = self._inflight[index][endpoint]
+
+        if self._parked[index].get(endpoint, 0) > now:
+            return 0
+
+        if endpoint == STREAMING_ENDPOINT:
+            return DEFAULT_LIMITS[STREAMING_ENDPOINT] - inflight
+
+        status = access.rate_limits.get(self._endpoint(access, endpoint))
+
+        if status is None or (status.get('reset') is not None and status['reset'] <= now):
+            limit = status.get('limit') if status else None
+
+            if limit is None:
+                limit = DEFAULT_LIMITS.get(endpoint, sys.maxsize)
+
+            return limit - inflight
+
+        return status['remaining'] - inflight
+
+    def _wake_up(self, endpoint, now):
+        times = list()
+
+        for index, access in enumerate(self.credentials):
+            if self._parked[index].get(endpoint, 0) > now:
+                times.append(self._parked[index][endpoint])
+                continue
+
+            status = access.rate_limits.get(self._endpoint(access, endpoint))
+
+            if status and status.get('reset') is not None and status['reset'] > now:
+                times.append(status['reset'])
+
+        return min(times) if times else None
+
+    def acquire(self, endpoint, block=True, timeout=None, cost=1):
+        """
+        This function retrieves the credential with the most remaining requests on the introduced endpoint, which is
+        then considered in use until it is released with :meth:`twipper.pool.CredentialPool.release`. If no credential
+        has `cost` requests left, it waits until any of them is reset or released.
+
+        Args:
+            endpoint (:obj:`str`): endpoint to be called, such as `search/tweets`, `tweets/search` (premium, for the
+                plan of every credential) or `statuses/filter` (streaming).
+            block (:obj:`boolean`, optional): whether to wait for a credential if all of them are exhausted.
+            timeout (:obj:`float`, optional): maximum number of seconds to wait, default is `None` (no limit).
+            cost (:obj:`int`, optional):
+                number of requests to reserve, such as the number of pages of a search, default is 1. It is capped to
+                the rate limit of every credential, so that calls costing more than a whole window can still be sent.
+
+        Returns:
+            :obj:`twipper.credentials.Twipper` - access:
+                Returns the credential to be used.
+
+        Raises:
+            ConnectionError: raised if every credential is exhausted and it could not wait for any of them.
+        """
+
+        deadline = None if timeout is None else time.time() + timeout
+
+        with self._condition:
+            while True:
+                now = time.time()
+
+                selected, budget = None, 0
+
+                for index in range(len(self.credentials)):
+                    remaining = self._budget(index, endpoint, now)
+
+                    if remaining > budget and remaining >= min(cost, self._capacity(index, endpoint)):
+                        selected, budget = index, remaining
+
+                if selected is not None:
+                    self._inflight[selected][endpoint] += cost
+                    self._requests[selected][endpoint] += 1
+
+                    return self.credentials[selected]
+
+                wake_up = self._wake_up(endpoint, now)
+
+                if not block or (deadline is not None and now >= deadline):
+                    raise ConnectionError('every credential of the pool is rate limited on `' + endpoint + '`.')
+
+                wait = None if wake_up is None else max(wake_up - now, 0.01)
+
+                if deadline is not None:
+                    wait = min(wait, deadline - now) if wait is not None else deadline - now
+
+                self._condition.wait(wait)
+
+    def release(self, access, endpoint, cost=1):
+        """
+        This function releases a credential retrieved with :meth:`twipper.pool.CredentialPool.acquire` (with the same
+        `cost`), so that it can be selected again by any waiting thread.
+        """
+
+        with self._condition:
+            index = self._index(access)
+
+            self._inflight[index][endpoint] = max(0, self._inflight[index][endpoint] - cost)
+
+            status = access.rate_limits.get(self._endpoint(access, endpoint))
+
+            if status and status.get('remaining') == 0 and status.get('reset') is None:
+                self._parked[index][endpoint] = time.time() + RATE_LIMIT_WINDOW
+
+            self._condition.notify_all()
+
+    def park(self, access, endpoint, until):
+        """
+        This function parks a credential on the introduced endpoint until the introduced time (seconds since epoch).
+        """
+
+        with self._condition:
+            self._parked[self._index(access)][endpoint] = until
+            self._condition.notify_all()
+
+    @contextmanager
+    def use(self, endpoint, block=True, timeout=None, cost=1):
+        """
+        This context manager acquires a credential for the introduced endpoint and releases it once done.
+        """
+
+        access = self.acquire(endpoint, block=block, timeout=timeout, cost=cost)
+
+        try:
+            yield access
+        finally:
+            self.release(access, endpoint, cost=cost)
+
+    def _call(self, endpoint, function, args, kwargs):
+        # every page of a search is a request, so as many requests as pages are reserved on the credential
+        cost = kwargs.get('page_count', args[1] if len(args) > 1 else 1)
+
+        if not isinstance(cost, int) or cost < 1:
+            cost = 1
+
+        for attempt in range(len(self.credentials)):
+            with self.use(endpoint, cost=cost) as access:
+                try:
+                    return function(access, *args, **kwargs)
+                except ConnectionError:
+                    status = access.rate_limits.get(self._endpoint(access, endpoint))
+
+                    if not status or status.get('remaining') != 0 or attempt == len(self.credentials) - 1:
+                        raise
+
+    def search_tweets(self, *args, **kwargs):
+        """
+        This function calls :func:`twipper.batch.search_tweets` with the least used credential of the pool.
+        """
+
+        return self._call(batch.ENDPOINT, batch.search_tweets, args, kwargs)
+
+    def search_user_tweets(self, *args, **kwargs):
+        """
+        This function calls :func:`twipper.batch.search_user_tweets` with the least used credential of the pool.
+        """
+
+        return self._call(batch.ENDPOINT, batch.search_user_tweets, args, kwargs)
+
+    def premium_search_tweets(self, *args, **kwargs):
+        """
+        This function calls :func:`twipper.premium.search_tweets` with the least used credential of the pool.
+        """
+
+        return self._call(PREMIUM_ENDPOINT, premium.search_tweets, args, kwargs)
+
+    def premium_search_user_tweets(self, *args, **kwargs):
+        """
+        This function calls :func:`twipper.premium.search_user_tweets` with the least used credential of the pool.
+        """
+
+        return self._call(PREMIUM_ENDPOINT, premium.search_user_tweets, args, kwargs)
+
+    def stream_tweets(self, *args, **kwargs):
+        """
+        This function calls :func:`twipper.streaming.stream_tweets` with a credential of the pool which is not streaming
+        yet, holding it until the returned generator is exhausted or closed.
+        """
+
+        with self.use(STREAMING_ENDPOINT) as access:
+            for tweet in streaming.stream_tweets(access, *args, **kwargs):
+                yield tweet
+
+    def utilization(self):
+        """
+        This function retrieves the utilization of every credential of the pool, this is, the number of calls routed
+        through it, the calls in flight and the used fraction of the rate limit window of every endpoint.
+
+        Returns:
+            :obj:`list` - utilization:
+                Returns a :obj:`list` containing a :obj:`dict` per credential, in the same order as the pool.
+        """
+
+        now = time.time()
+
+        utilization = list()
+
+        with self._condition:
+            for index, access in enumerate(self.credentials):
+                rate_limits = access.rate_limit_status()
+
+                used = dict()
+
+                for endpoint, status in rate_limits.items():
+                    if status.get('limit') and (status.get('reset') is None or status['reset'] > now):
+                        used[endpoint] = 1. - float(status['remaining']) / status['limit']
+
+                utilization.append({
+                    'credential': index,
+                    'requests': dict(self._requests[index]),
+                    'inflight': dict((key, value) for key, value in self._inflight[index].items() if value),
+                    'parked': dict((key, value) for key, value in self._parked[index].items() if value > now),
+                    'rate_limits': rate_limits,
+                    'used': used,
+                })
+
+        return utilization
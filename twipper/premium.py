@@ -4,17 +4,20 @@
 # Copyright 2018-2019 Alvaro Bartolome
 # See LICENSE for details.
 
-import datetime
 import json
 
-import oauth2
-import requests
+from twipper.budget import Budget
 from twipper.credentials import Twipper
+from twipper.pagination import paginate, peek_json_string
+from twipper.query import RULE_LENGTH, shard_user_query
+from twipper.retry import RetryPolicy, SearchResult, get_retry_policy
+from twipper.utils import date_to_timestamp
 
 # from twipper.utils import available_languages
 
 
-def search_tweets(access, query, page_count, from_date, to_date, language=None, filter_retweets=False):
+def search_tweets(access, query, page_count, from_date, to_date, language=None, filter_retweets=False, prefetch=1,
+                  retry_policy=None, budget=None):
     """
     This function retrieves historical tweets on batch processing from Twitter's Full Archive or 30Day. These tweets
     contain the specified words on the query, which can use premium operators as specified on
@@ -26,17 +29,28 @@ def search_tweets(access, query, page_count, from_date, to_date, language=None,
     Args:
         access (:obj:`twipper.credentials.Twipper`): object containing all the credentials needed to access api.twitter
         query (:obj:`str`): contains the query with the words to search along Twitter historic data.
-        page_count (:obj:`int`): specifies the amount of pages (100 tweets per page) to retrieve data from.
+        page_count (:obj:`int`):
+            specifies the amount of pages (100 tweets per page, or the page size of the `budget`) to retrieve data from.
         from_date (:obj:`str`): starting date of the time interval to retrieve tweets from (`yyyymmddhhmm` format)
         to_date (:obj:`str`): end date of the time interval to retrieve tweets from (`yyyymmddhhmm` format)
         language (:obj:`str`): is the language on which the tweet has been written.
         filter_retweets (:obj:`boolean`, optional):
             can be either `True` or `False`, to filter out retweets or not, respectively.
+        prefetch (:obj:`int`, optional):
+            number of pages fetched ahead while the current one is being parsed, default is 1, and 0 disables it.
+        retry_policy (:obj:`twipper.retry.RetryPolicy`, optional):
+            policy used to retry the failed requests, default is the shared one (see
+            :func:`twipper.retry.get_retry_policy`).
+        budget (:obj:`twipper.budget.Budget`, optional):
+            budget which sets the amount of tweets per page, refuses or throttles the search if it would exceed the
+            monthly caps of the plan, and records its cost, default is `None`, which retrieves 100 tweets per page.
 
     Returns:
         tweets (:obj:`list`): description
             Returns a :obj:`list` containing all the retrieved tweets from Twitter, which means all the available tweets
-            from the user specified on the arguments of the function.
+            from the user specified on the arguments of the function, as a :obj:`twipper.retry.SearchResult` whose
+            `metadata` report whether the results were truncated because a page could not be retrieved, as well as the
+            `cost` of the search in requests and tweets.
 
     Raises:
         ValueError: raised if the introduced arguments do not match or errored.
@@ -45,11 +59,6 @@ def search_tweets(access, query, page_count, from_date, to_date, language=None,
     if not access or not isinstance(access, Twipper):
         raise ValueError('access object to api.twitter is not valid!')
 
-    api = access.api
-
-    if not isinstance(api, oauth2.Client):
-        raise ValueError('api is not valid!')
-
     oauth_token = access.oauth_token
 
     if not isinstance(oauth_token, str):
@@ -77,28 +86,28 @@ def search_tweets(access, query, page_count, from_date, to_date, language=None,
     if not from_date or not isinstance(from_date, str):
         raise ValueError('from_date must be a `bool`!')
 
-    try:
-        datetime.datetime.strptime(from_date, '%Y%m%d%H%M')
-    except ValueError:
-        raise ValueError('incorrect date format, it should be `yyyymmddhhmm`')
+    start_date = date_to_timestamp(from_date)
 
     if not to_date or not isinstance(to_date, str):
         raise ValueError('to_date must be a `bool`!')
 
-    try:
-        datetime.datetime.strptime(to_date, '%Y%m%d%H%M')
-    except ValueError:
-        raise ValueError('incorrect date format, it should be `yyyymmddhhmm`')
+    end_date = date_to_timestamp(to_date)
 
     if language and not isinstance(language, str):
         raise ValueError('language must be a `str`!')
 
-    start_date = datetime.datetime.strptime(from_date, '%Y%m%d%H%M')
-    end_date = datetime.datetime.strptime(to_date, '%Y%m%d%H%M')
-
     if start_date >= end_date:
         raise ValueError('incorrect dates, as from_date should be earlier than to_date.')
 
+    if not isinstance(prefetch, int) or prefetch < 0:
+        raise ValueError('prefetch must be an `int` equal or higher than 0!')
+
+    if retry_policy is not None and not isinstance(retry_policy, RetryPolicy):
+        raise ValueError('retry_policy must be a `twipper.retry.RetryPolicy`!')
+
+    if budget is not None and not isinstance(budget, Budget):
+        raise ValueError('budget must be a `twipper.budget.Budget`!')
+
     url = 'https://api.twitter.com/1.1/tweets/search/' + plan + '/' + label + '.json'
 
     headers = {
@@ -128,74 +137,12 @@ def search_tweets(access, query, page_count, from_date, to_date, language=None,
     if filter_retweets:
         query += ' -is:retweet'
 
-    data = {
-        'query': query,
-        'fromDate': from_date,
-        'toDate': to_date,
-        'maxResults': 100
-    }
-
-    data = json.dumps(data)
-
-    response = requests.post(url, headers=headers, data=data)
-
-    tweets = list()
-
-    if response.status_code != 200:
-        raise ConnectionError('connection to api.twitter could not be established, with error '
-                              'code ' + str(response.status_code))
-
-    result = response.json()
-
-    if 'results' in result:
-        tweets += result['results']
-    else:
-        raise IndexError('no tweets could be retrieved.')
-
-    if 'next' not in result:
-        if len(tweets) > 0:
-            return tweets
-        else:
-            raise IndexError(' no tweets could be retrieved.')
-    else:
-        next_page = result['next']
-
-        if page_count > 1:
-            for _ in range(page_count - 1):
-                data = {
-                    'query': query,
-                    'fromDate': from_date,
-                    'toDate': to_date,
-                    'maxResults': 100,
-                    'next': next_page
-                }
-
-                data = json.dumps(data)
-
-                response = requests.post(url, headers=headers, data=data)
+    return _paginate(access, url, headers, query, from_date, to_date, page_count, prefetch, retry_policy,
+                     budget)
 
-                if response.status_code != 200:
-                    break
-
-                result = response.json()
-
-                if 'results' in result:
-                    tweets += result['results']
-                else:
-                    break
-
-                if 'next' in result:
-                    next_page = result['next']
-                else:
-                    break
-
-        if len(tweets) > 0:
-            return tweets
-        else:
-            raise IndexError('no tweets could be retrieved.')
 
-
-def search_user_tweets(access, screen_name, page_count, from_date, to_date, language=None, filter_retweets=False):
+def search_user_tweets(access, screen_name, page_count, from_date, to_date, language=None, filter_retweets=False,
+                       prefetch=1, retry_policy=None, budget=None):
     """
     This function retrieves historical tweets on batch processing from Twitter's Full Archive or 30Day from a specific
     user via its screen name (Twitter name). These tweets contain the specified words on the query, which can use
@@ -210,17 +157,28 @@ def search_user_tweets(access, screen_name, page_count, from_date, to_date, lang
         screen_name (:obj:`str`):
             is the Twitter's public name of the account that tweets are going to be retrieved, note that the account
             must be public.
-        page_count (:obj:`int`): specifies the amount of pages (100 tweets per page) to retrieve data from.
+        page_count (:obj:`int`):
+            specifies the amount of pages (100 tweets per page, or the page size of the `budget`) to retrieve data from.
         from_date (:obj:`str`): starting date of the time interval to retrieve tweets from (`yyyymmddhhmm` format)
         to_date (:obj:`str`): end date of the time interval to retrieve tweets from (`yyyymmddhhmm` format)
         language (:obj:`str`): is the language on which the tweet has been written.
         filter_retweets (:obj:`boolean`, optional):
             can be either `True` or `False`, to filter out retweets or not, respectively.
+        prefetch (:obj:`int`, optional):
+            number of pages fetched ahead while the current one is being parsed, default is 1, and 0 disables it.
+        retry_policy (:obj:`twipper.retry.RetryPolicy`, optional):
+            policy used to retry the failed requests, default is the shared one (see
+            :func:`twipper.retry.get_retry_policy`).
+        budget (:obj:`twipper.budget.Budget`, optional):
+            budget which sets the amount of tweets per page, refuses or throttles the search if it would exceed the
+            monthly caps of the plan, and records its cost, default is `None`, which retrieves 100 tweets per page.
 
     Returns:
         tweets (:obj:`list`): description
             Returns a :obj:`list` containing all the retrieved tweets from Twitter, which means all the available tweets
-            from the user specified on the arguments of the function.
+            from the user specified on the arguments of the function, as a :obj:`twipper.retry.SearchResult` whose
+            `metadata` report whether the results were truncated because a page could not be retrieved, as well as the
+            `cost` of the search in requests and tweets.
 
     Raises:
         ValueError: raised if the introduced arguments do not match or errored.
@@ -229,11 +187,6 @@ def search_user_tweets(access, screen_name, page_count, from_date, to_date, lang
     if not access or not isinstance(access, Twipper):
         raise ValueError('access object to api.twitter is not valid!')
 
-    api = access.api
-
-    if not isinstance(api, oauth2.Client):
-        raise ValueError('api is not valid!')
-
     oauth_token = access.oauth_token
 
     if not isinstance(oauth_token, str):
@@ -261,28 +214,28 @@ def search_user_tweets(access, screen_name, page_count, from_date, to_date, lang
     if not from_date or not isinstance(from_date, str):
         raise ValueError('from_date must be a `bool`!')
 
-    try:
-        datetime.datetime.strptime(from_date, '%Y%m%d%H%M')
-    except ValueError:
-        raise ValueError('incorrect date format, it should be `yyyymmddhhmm`')
+    start_date = date_to_timestamp(from_date)
 
     if not to_date or not isinstance(to_date, str):
         raise ValueError('to_date must be a `bool`!')
 
-    try:
-        datetime.datetime.strptime(to_date, '%Y%m%d%H%M')
-    except ValueError:
-        raise ValueError('incorrect date format, it should be `yyyymmddhhmm`')
+    end_date = date_to_timestamp(to_date)
 
     if language and not isinstance(language, str):
         raise ValueError('language must be a `str`!')
 
-    start_date = datetime.datetime.strptime(from_date, '%Y%m%d%H%M')
-    end_date = datetime.datetime.strptime(to_date, '%Y%m%d%H%M')
-
     if start_date >= end_date:
         raise ValueError('incorrect dates, as from_date should be earlier than to_date.')
 
+    if not isinstance(prefetch, int) or prefetch < 0:
+        raise ValueError('prefetch must be an `int` equal or higher than 0!')
+
+    if retry_policy is not None and not isinstance(retry_policy, RetryPolicy):
+        raise ValueError('retry_policy must be a `twipper.retry.RetryPolicy`!')
+
+    if budget is not None and not isinstance(budget, Budget):
+        raise ValueError('budget must be a `twipper.budget.Budget`!')
+
     url = 'https://api.twitter.com/1.1/tweets/search/' + plan + '/' + label + '.json'
 
     query = 'from:' + screen_name
@@ -314,68 +267,243 @@ def search_user_tweets(access, screen_name, page_count, from_date, to_date, lang
     if filter_retweets:
         query += ' -is:retweet'
 
-    data = {
-        'query': query,
-        'fromDate': from_date,
-        'toDate': to_date,
-        'maxResults': 100
-    }
+    return _paginate(access, url, headers, query, from_date, to_date, page_count, prefetch, retry_policy,
+                     budget)
 
-    data = json.dumps(data)
 
-    response = requests.post(url, headers=headers, data=data)
+def search_users_tweets(access, screen_names, page_count, from_date, to_date, language=None, filter_retweets=False,
+                        prefetch=1, retry_policy=None, budget=None):
+    """
+    This function retrieves historical tweets on batch processing from Twitter's Full Archive or 30Day from many users
+    at once, via their screen names (Twitter names). Instead of searching the tweets of every user on its own, the
+    `from:` operators of the users are OR'ed together into as few rules as the rule length limit allows (see
+    :func:`twipper.query.shard_user_query`), every rule is searched retrieving up to `page_count` pages, and the
+    retrieved tweets are then demultiplexed back to the user who posted them, so that the amount of requests needed
+    to monitor many users is reduced by an order of magnitude.
 
-    tweets = list()
+    Args:
+        access (:obj:`twipper.credentials.Twipper`): object containing all the credentials needed to access api.twitter
+        screen_names (:obj:`list`): screen names of the users whose tweets are going to be retrieved.
+        page_count (:obj:`int`):
+            specifies the amount of pages (100 tweets per page, or the page size of the `budget`) to retrieve per rule,
+            which are shared by every user packed into it.
+        from_date (:obj:`str`): starting date of the time interval to retrieve tweets from (`yyyymmddhhmm` format)
+        to_date (:obj:`str`): end date of the time interval to retrieve tweets from (`yyyymmddhhmm` format)
+        language (:obj:`str`): is the language on which the tweet has been written.
+        filter_retweets (:obj:`boolean`, optional):
+            can be either `True` or `False`, to filter out retweets or not, respectively.
+        prefetch (:obj:`int`, optional):
+            number of pages fetched ahead while the current one is being parsed, default is 1, and 0 disables it.
+        retry_policy (:obj:`twipper.retry.RetryPolicy`, optional):
+            policy used to retry the failed requests, default is the shared one (see
+            :func:`twipper.retry.get_retry_policy`).
+        budget (:obj:`twipper.budget.Budget`, optional):
+            budget which sets the amount of tweets per page and the length of the rules, refuses or throttles the
+            searches if they would exceed the monthly caps of the plan, and records their cost, default is `None`,
+            which retrieves 100 tweets per page with rules of up to 256 characters.
 
-    if response.status_code != 200:
-        raise ConnectionError('connection to api.twitter could not be established, with error \
-            code ' + str(response.status_code))
+    Returns:
+        :obj:`dict` - tweets:
+            Returns a :obj:`dict` containing a :obj:`twipper.retry.SearchResult` with the retrieved tweets of every
+            user, whose `metadata` are the ones of the search of the rule the user was packed into, which is included
+            as `rule`, so a truncated or unfinished rule is reported on every user packed into it.
 
-    result = response.json()
+    Raises:
+        ValueError: raised if the introduced arguments do not match or errored.
+    """
 
-    if 'results' in result:
-        tweets += result['results']
-    else:
-        raise IndexError('no tweets could be retrieved.')
+    if not access or not isinstance(access, Twipper):
+        raise ValueError('access object to api.twitter is not valid!')
 
-    if 'next' not in result:
-        if len(tweets) > 0:
-            return tweets
-        else:
-            raise IndexError(' no tweets could be retrieved.')
-    else:
-        next_page = result['next']
+    oauth_token = access.oauth_token
 
-        if page_count > 1:
-            for _ in range(page_count - 1):
-                data = {
-                    'query': query,
-                    'fromDate': from_date,
-                    'toDate': to_date,
-                    'maxResults': 100,
-                    'next': next_page
-                }
+    if not isinstance(oauth_token, str):
+        raise ValueError('oauth_token is not valid!')
 
-                data = json.dumps(data)
+    plan = access.plan
 
-                response = requests.post(url, headers=headers, data=data)
+    if not plan or not isinstance(plan, str):
+        raise ValueError('plan must be a `str`!')
 
-                if response.status_code != 200:
-                    break
+    label = access.label
 
-                result = response.json()
+    if not label or not isinstance(label, str):
+        raise ValueError('label must be a `str`!')
 
-                if 'results' in result:
-                    tweets += result['results']
-                else:
-                    break
+    if not screen_names or not isinstance(screen_names, (list, tuple, set)):
+        raise ValueError('screen_names must be a `list` of `str`!')
+
+    if not page_count or not isinstance(page_count, int):
+        raise ValueError('page_count must be an `int`!')
+
+    if isinstance(page_count, int) and page_count < 1:
+        raise ValueError('page_count must be an `int` equal or higher than 1!')
+
+    if not from_date or not isinstance(from_date, str):
+        raise ValueError('from_date must be a `bool`!')
 
-                if 'next' in result:
-                    next_page = result['next']
-                else:
-                    break
+    start_date = date_to_timestamp(from_date)
 
-        if len(tweets) > 0:
-            return tweets
+    if not to_date or not isinstance(to_date, str):
+        raise ValueError('to_date must be a `bool`!')
+
+    end_date = date_to_timestamp(to_date)
+
+    if language and not isinstance(language, str):
+        raise ValueError('language must be a `str`!')
+
+    if start_date >= end_date:
+        raise ValueError('incorrect dates, as from_date should be earlier than to_date.')
+
+    if not isinstance(prefetch, int) or prefetch < 0:
+        raise ValueError('prefetch must be an `int` equal or higher than 0!')
+
+    if retry_policy is not None and not isinstance(retry_policy, RetryPolicy):
+        raise ValueError('retry_policy must be a `twipper.retry.RetryPolicy`!')
+
+    if budget is not None and not isinstance(budget, Budget):
+        raise ValueError('budget must be a `twipper.budget.Budget`!')
+
+    url = 'https://api.twitter.com/1.1/tweets/search/' + plan + '/' + label + '.json'
+
+    headers = {
+        'Authorization': 'Bearer ' + oauth_token,
+        'Content-Type': 'application/json'
+    }
+
+    languages = [
+        'fr', 'en', 'ar', 'ja', 'es', 'de', 'it', 'id', 'pt', 'ko',
+        'tr', 'ru', 'nl', 'fil', 'msa', 'zh-tw', 'zh-cn', 'hi', 'no',
+        'sv', 'fi', 'da', 'pl', 'hu', 'fa', 'he', 'ur', 'th', 'uk',
+        'ca', 'ga', 'el', 'eu', 'cs', 'gl', 'ro', 'hr', 'en-gb', 'vi',
+        'bn', 'bg', 'sr', 'sk', 'gu', 'mr', 'ta', 'kn'
+    ]
+
+    query = ''
+
+    if language:
+        if language in languages:
+            query += ' lang:' + language
         else:
-            raise IndexError('no tweets could be retrieved.')
+            raise ValueError('the introduced language does not exist.')
+
+    if filter_retweets:
+        query += ' -is:retweet'
+
+    max_length = budget.rule_length() if budget is not None else RULE_LENGTH
+
+    results = dict()
+
+    for rule, users in shard_user_query(screen_names, query=query, max_length=max_length):
+        try:
+            tweets = _paginate(access, url, headers, rule, from_date, to_date, page_count, prefetch, retry_policy,
+                               budget)
+        except IndexError:
+            tweets = SearchResult()
+
+        results.update(tweets.by_user(users, rule=rule))
+
+    return results
+
+
+def _paginate(access, url, headers, query, from_date, to_date, page_count, prefetch, retry_policy, budget):
+    """
+    This function retrieves up to `page_count` pages of the premium search of the introduced query, following the
+    `next` cursor of every page (see :func:`twipper.pagination.paginate`), and sending every request through the
+    introduced retry policy. The pages which cannot be retrieved after the first one truncate the results, as reported
+    on the metadata of the returned :obj:`twipper.retry.SearchResult`. If a budget is introduced, the pages are reserved
+    on it beforehand and the cost of the search is recorded on it afterwards.
+    """
+
+    endpoint = 'tweets/search/' + access.plan
+
+    policy = retry_policy if retry_policy is not None else get_retry_policy()
+
+    metadata = dict()
+
+    page_size, reserved = 100, None
+
+    if budget is not None:
+        page_size, reserved = budget.page_size(), budget.reserve(access, page_count)
+
+        page_count = reserved
+
+    sent = list()
+
+    def request(data):
+        sent.append(data.get('next'))
+
+        response = access.transport.request('POST', url, headers=headers, data=json.dumps(data))
+
+        access.record_rate_limit(endpoint, response.headers, response.status_code)
+
+        return response
+
+    def fetch(next_page):
+        data = {
+            'query': query,
+            'fromDate': from_date,
+            'toDate': to_date,
+            'maxResults': page_size
+        }
+
+        if next_page is None:
+            return policy.send(lambda: request(data), endpoint)
+
+        data['next'] = next_page
+
+        try:
+            return policy.send(lambda: request(data), endpoint)
+        except ConnectionError as e:
+            return e
+
+    def truncate(error):
+        metadata.update(truncated=True, error=error)
+
+    def parse(response, page):
+        if isinstance(response, ConnectionError):
+            return truncate(str(response))
+
+        if response.status_code != 200:
+            if page == 0:
+                raise ConnectionError('connection to api.twitter could not be established, with error '
+                                      'code ' + str(response.status_code))
+
+            return truncate('connection errored with code ' + str(response.status_code) + '.')
+
+        try:
+            result = response.json()
+        except ValueError:
+            if page == 0:
+                raise
+
+            return truncate('retrieved content could not be parsed.')
+
+        if 'results' not in result:
+            if page == 0:
+                raise IndexError('no tweets could be retrieved.')
+
+            return truncate('retrieved content contains no results.')
+
+        metadata.update(pages=page + 1, next=result.get('next'))
+
+        return result['results'], result.get('next')
+
+    def peek(content):
+        return peek_json_string(content, 'next')
+
+    tweets = list()
+
+    try:
+        for results in paginate(fetch, parse, peek, page_count, prefetch=prefetch):
+            tweets += results
+    finally:
+        metadata['cost'] = {'requests': len(sent), 'tweets': len(tweets)}
+
+        if budget is not None:
+            budget.settle(access, reserved, query, len(sent), len(tweets))
+
+    if len(tweets) > 0:
+        return SearchResult(tweets, metadata)
+    else:
+        raise IndexError('no tweets could be retrieved.')
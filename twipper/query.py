@@ -0,0 +1,556 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2019 Alvaro Bartolome
+# See LICENSE for details.
+
+import functools
+import itertools
+import re
+
+
+TRACK_KEYWORD_LIMIT = 400
+TRACK_KEYWORD_LENGTH = 60
+
+RULE_LENGTH = 256
+QUERY_LENGTH = 500
+
+DNF_TERM_LIMIT = 10000
+
+SYNTAXES = ['standard', 'premium', 'streaming']
+
+FIELD_ALIASES = {
+    'standard': {
+        ('is', 'retweet'): ('filter', 'retweets'),
+        ('is', 'verified'): ('filter', 'verified'),
+    },
+    'premium': {
+        ('filter', 'retweets'): ('is', 'retweet'),
+        ('filter', 'verified'): ('is', 'verified'),
+    },
+}
+
+_TOKENS = re.compile(r'\s*(?:(\()|(\))|"([^"]*)"?|([^\s()"]+))')
+_FIELD = re.compile(r'^([a-z_]+):([^/].*)$')
+
+
+class Node(object):
+    """
+    Node is the base class of every element of the abstract syntax tree (AST) generated when parsing a query formatted
+    as specified by twipper. Nodes are immutable, so the parsed trees can be safely cached and shared.
+    """
+
+    __slots__ = ()
+
+    def _key(self):
+        raise NotImplementedError
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash((type(self).__name__, self._key()))
+
+    def __repr__(self):
+        return type(self).__name__ + repr(self._key())
+
+
+class Term(Node):
+    """Single keyword, hashtag or mention to be contained on the tweet."""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def _key(self):
+        return self.value,
+
+
+class Phrase(Node):
+    """Sequence of words to be contained on the tweet in the exact same order."""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def _key(self):
+        return self.value,
+
+
+class Field(Node):
+    """Operator over a tweet attribute, such as `from:user` or `lang:es`."""
+
+    __slots__ = ('name', 'value')
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+    def _key(self):
+        return self.name, self.value
+
+
+class Not(Node):
+    """Negation of the contained node."""
+
+    __slots__ = ('child',)
+
+    def __init__(self, child):
+        self.child = child
+
+    def _key(self):
+        return self.child,
+
+
+class And(Node):
+    """Conjunction of the contained nodes."""
+
+    __slots__ = ('children',)
+
+    def __init__(self, children):
+        self.children = tuple(children)
+
+    def _key(self):
+        return self.children
+
+
+class Or(Node):
+    """Disjunction of the contained nodes."""
+
+    __slots__ = ('children',)
+
+    def __init__(self, children):
+        self.children = tuple(children)
+
+    def _key(self):
+        return self.children
+
+
+def _tokenize(query):
+    tokens = list()
+
+    position = 0
+
+    while position < len(query):
+        match = _TOKENS.match(query, position)
+
+        if not match or match.end() == position:
+            break
+
+        position = match.end()
+
+        opening, closing, phrase, word = match.groups()
+
+        if opening:
+            tokens.append(('(', None))
+        elif closing:
+            tokens.append((')', None))
+        elif phrase is not None:
+            if phrase.strip():
+                tokens.append(('phrase', ' '.join(phrase.split())))
+        elif word in ('AND', 'OR', 'NOT'):
+            tokens.append((word, None))
+        elif word:
+            tokens.append(('word', word))
+
+    return tokens
+
+
+class _Parser(object):
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position][0]
+        return None
+
+    def take(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def parse(self):
+        node = self.parse_or()
+
+        if self.peek() is not None:
+            raise ValueError('unexpected `' + self.peek() + '` on query.')
+
+        return node
+
+    def parse_or(self):
+        children = [self.parse_and()]
+
+        while self.peek() == 'OR':
+            self.take()
+            children.append(self.parse_and())
+
+        return _join(Or, children)
+
+    def parse_and(self):
+        children = [self.parse_unary()]
+
+        while self.peek() not in (None, 'OR', ')'):
+            if self.peek() == 'AND':
+                self.take()
+
+            children.append(self.parse_unary())
+
+        return _join(And, children)
+
+    def parse_unary(self):
+        kind = self.peek()
+
+        if kind is None:
+            raise ValueError('query ended unexpectedly.')
+
+        if kind == 'NOT':
+            self.take()
+            return _negate(self.parse_unary())
+
+        if kind == '(':
+            self.take()
+
+            node = self.parse_or()
+
+            if self.peek() != ')':
+                raise ValueError('unbalanced parentheses on query.')
+
+            self.take()
+
+            return node
+
+        if kind == 'phrase':
+            return Phrase(self.take()[1])
+
+        if kind == 'word':
+            value = self.take()[1]
+
+            if value.startswith('-') and len(value) > 1:
+                return _negate(_word(value[1:]))
+
+            return _word(value)
+
+        raise ValueError('unexpected `' + kind + '` on query.')
+
+
+def _word(value):
+    match = _FIELD.match(value)
+
+    if match:
+        return Field(match.group(1), match.group(2))
+
+    return Term(value)
+
+
+def _negate(node):
+    if isinstance(node, Not):
+        return node.child
+
+    return Not(node)
+
+
+def _join(kind, children):
+    flattened = list()
+
+    for child in children:
+        if isinstance(child, kind):
+            flattened.extend(child.children)
+        elif child not in flattened:
+            flattened.append(child)
+
+    if len(flattened) == 1:
+        return flattened[0]
+
+    return kind(flattened)
+
+
+def parse(query):
+    """
+    This function parses the introduced query formatted as specified by twipper into an abstract syntax tree, so that it
+    can later be compiled into any of the query formats that Twitter requires. Queries are made of keywords, "exact
+    phrases" and field operators (such as `from:user` or `lang:es`), combined with the AND, OR and NOT operators (where
+    NOT binds the tightest and OR the loosest) and grouped with parentheses. Adjacent terms are joined with AND. Parsed
+    queries are cached, so parsing the same query more than once has no cost.
+
+    Args:
+        query (:obj:`str`): query formatted as specified by twipper.
+
+    Returns:
+        :obj:`twipper.query.Node` - tree:
+            Returns the root :obj:`twipper.query.Node` of the abstract syntax tree of the query.
+
+    Raises:
+        ValueError: raised if the introduced query is not valid.
+    """
+
+    if not query or not isinstance(query, str):
+        raise ValueError('`query` parameter is mandatory and should be a str!')
+
+    return _parse(query)
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse(query):
+    tokens = _tokenize(query)
+
+    if len(tokens) < 1:
+        raise ValueError('`query` parameter does not contain any term!')
+
+    return _Parser(tokens).parse()
+
+
+def _emit(node, syntax, parent=None):
+    if isinstance(node, Term):
+        return node.value
+
+    if isinstance(node, Phrase):
+        return '"' + node.value + '"'
+
+    if isinstance(node, Field):
+        name, value = FIELD_ALIASES[syntax].get((node.name, node.value), (node.name, node.value))
+        return name + ':' + value
+
+    if isinstance(node, Not):
+        return '-' + _emit(node.child, syntax, parent=Not)
+
+    if isinstance(node, And):
+        emitted = ' '.join(_emit(child, syntax, parent=And) for child in node.children)
+    else:
+        emitted = ' OR '.join(_emit(child, syntax, parent=Or) for child in node.children)
+
+    if parent is not None:
+        return '(' + emitted + ')'
+
+    return emitted
+
+
+def _is_negative(node):
+    if isinstance(node, Not):
+        return True
+
+    if isinstance(node, And):
+        return all(_is_negative(child) for child in node.children)
+
+    if isinstance(node, Or):
+        return any(_is_negative(child) for child in node.children)
+
+    return False
+
+
+def _conjunctions(node):
+    if isinstance(node, Term):
+        return [(node.value,)]
+
+    if isinstance(node, Phrase):
+        return [tuple(node.value.split(' '))]
+
+    if isinstance(node, Field):
+        raise ValueError('`' + node.name + ':` operator is not supported by Twitter Streaming.')
+
+    if isinstance(node, Not):
+        raise ValueError('NOT operator is not supported by Twitter Streaming.')
+
+    if isinstance(node, Or):
+        return list(itertools.chain.from_iterable(_conjunctions(child) for child in node.children))
+
+    conjunctions = [()]
+
+    for child in node.children:
+        conjunctions = [left + right for left in conjunctions for right in _conjunctions(child)]
+
+        if len(conjunctions) > DNF_TERM_LIMIT:
+            raise ValueError('query expands to more than ' + str(DNF_TERM_LIMIT) + ' streaming keywords.')
+
+    return conjunctions
+
+
+def streaming_keywords(query):
+    """
+    This function expands the introduced query into the list of keywords of a Twitter Streaming `track` parameter, where
+    every keyword is a set of space-separated words that must all be contained on the tweet, and a tweet matches the
+    `track` parameter if it matches any of its keywords. Exact phrases are expanded to the words they contain, since
+    Twitter Streaming does not support them.
+
+    Args:
+        query (:obj:`str` or :obj:`twipper.query.Node`): query formatted as specified by twipper or its parsed tree.
+
+    Returns:
+        :obj:`list` - keywords:
+            Returns a :obj:`list` of :obj:`str` containing the deduplicated keywords of the `track` parameter.
+
+    Raises:
+        ValueError: raised if the query contains operators not supported by Twitter Streaming.
+    """
+
+    if not isinstance(query, Node):
+        query = parse(query)
+
+    keywords = list()
+    seen = set()
+
+    for conjunction in _conjunctions(query):
+        words = list()
+
+        for word in conjunction:
+            if word not in words:
+                words.append(word)
+
+        keyword = ' '.join(words)
+
+        if keyword.lower() not in seen:
+            seen.add(keyword.lower())
+            keywords.append(keyword)
+
+    return keywords
+
+
+def compile_query(query, syntax='standard'):
+    """
+    This function compiles the introduced query formatted as specified by twipper into the query format required by
+    Twitter for either standard search (`standard`), premium search (`premium`) or the `track` parameter of Twitter
+    Streaming (`streaming`). Compiled queries are cached, so compiling the same query more than once has no cost.
+
+    Args:
+        query (:obj:`str`): query formatted as specified by twipper.
+        syntax (:obj:`str`, optional): target syntax, either `standard`, `premium` or `streaming`, default `standard`.
+
+    Returns:
+        :obj:`str` - compiled_query:
+            Returns a :obj:`str` containing the query formatted as required by Twitter.
+
+    Raises:
+        ValueError: raised if the introduced arguments are not valid or the query cannot be expressed on the syntax.
+    """
+
+    if syntax not in SYNTAXES:
+        raise ValueError('syntax can just be `standard`, `premium` or `streaming`!')
+
+    if not query or not isinstance(query, str):
+        raise ValueError('`query` parameter is mandatory and should be a str!')
+
+    return _compile(query, syntax)
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile(query, syntax):
+    tree = _parse(query)
+
+    if syntax == 'streaming':
+        return ','.join(streaming_keywords(tree))
+
+    if syntax == 'premium' and _is_negative(tree):
+        raise ValueError('premium queries cannot just contain negated terms.')
+
+    return _emit(tree, syntax)
+
+
+def shard_streaming_query(query, max_keywords=TRACK_KEYWORD_LIMIT, max_keyword_length=TRACK_KEYWORD_LENGTH):
+    """
+    This function compiles the introduced query into as many Twitter Streaming `track` parameters as needed so that
+    none of them exceeds the limits of a single streaming connection, which are 400 keywords of up to 60 bytes each.
+    Every shard can then be sent on its own connection, and the union of their results is the result of the query.
+
+    Args:
+        query (:obj:`str` or :obj:`list`):
+            query formatted as specified by twipper, or a :obj:`list` of them to be sharded together.
+        max_keywords (:obj:`int`, optional): maximum number of keywords per shard, default is 400.
+        max_keyword_length (:obj:`int`, optional): maximum length in bytes of every keyword, default is 60.
+
+    Returns:
+        :obj:`list` - shards:
+            Returns a :obj:`list` of :obj:`str` containing the `track` parameter of every shard.
+
+    Raises:
+        ValueError: raised if the introduced arguments are not valid or a keyword exceeds the length limit.
+    """
+
+    if not isinstance(max_keywords, int) or max_keywords < 1:
+        raise ValueError('max_keywords must be an `int` equal or higher than 1!')
+
+    if not isinstance(max_keyword_length, int) or max_keyword_length < 1:
+        raise ValueError('max_keyword_length must be an `int` equal or higher than 1!')
+
+    queries = [query] if isinstance(query, str) else list(query)
+
+    keywords = list()
+    seen = set()
+
+    for value in queries:
+        for keyword in streaming_keywords(value):
+            if len(keyword.encode('utf-8')) > max_keyword_length:
+                raise ValueError('keyword `' + keyword + '` exceeds the ' + str(max_keyword_length) +
+                                 ' bytes limit of Twitter Streaming.')
+
+            if keyword.lower() not in seen:
+                seen.add(keyword.lower())
+                keywords.append(keyword)
+
+    return [','.join(keywords[index:index + max_keywords]) for index in range(0, len(keywords), max_keywords)]
+
+
+def shard_user_query(screen_names, query=None, max_length=RULE_LENGTH):
+    """
+    This function packs the `from:` operators of the introduced users into as few Twitter search rules as possible,
+    OR'ing them together so that none of the rules exceeds the length limit, which is 256 characters for the premium
+    search on sandbox, 1024 on premium and 500 for the standard search. The introduced query, if any, is appended to
+    every rule, so that the union of the results of every rule is the result of the query for every user.
+
+    Args:
+        screen_names (:obj:`list`): screen names of the users, with or without the leading @.
+        query (:obj:`str`, optional): query appended to every rule, such as `lang:en -is:retweet`.
+        max_length (:obj:`int`, optional): maximum length in characters of every rule, default is 256.
+
+    Returns:
+        :obj:`list` - shards:
+            Returns a :obj:`list` of :obj:`tuple` containing every rule and the :obj:`list` of screen names it packs.
+
+    Raises:
+        ValueError: raised if the introduced arguments are not valid or a single user does not fit into a rule.
+    """
+
+    if not isinstance(max_length, int) or max_length < 1:
+        raise ValueError('max_length must be an `int` equal or higher than 1!')
+
+    if query is not None and not isinstance(query, str):
+        raise ValueError('query must be a `str`!')
+
+    suffix = ' ' + query.strip() if query and query.strip() else ''
+
+    def rule(users):
+        clauses = ['from:' + user for user in users]
+
+        return (clauses[0] if len(clauses) == 1 else '(' + ' OR '.join(clauses) + ')') + suffix
+
+    shards = list()
+    users = list()
+    seen = set()
+
+    for screen_name in screen_names:
+        if not isinstance(screen_name, str) or not screen_name.lstrip('@'):
+            raise ValueError('screen_names must be a `list` of `str`!')
+
+        screen_name = screen_name.lstrip('@')
+
+        if screen_name.lower() in seen:
+            continue
+
+        seen.add(screen_name.lower())
+
+        if len(rule([screen_name])) > max_length:
+            raise ValueError('user `' + screen_name + '` does not fit into a ' + str(max_length) + ' characters rule.')
+
+        if users and len(rule(users + [screen_name])) > max_length:
+            shards.append((rule(users), users))
+            users = list()
+
+        users.append(screen_name)
+
+    if users:
+        shards.append((rule(users), users))
+
+    return shards
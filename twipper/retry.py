@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2019 Alvaro Bartolome
+# See LICENSE for details.
+
+import random
+import threading
+import time
+
+import requests
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+_ERRORS = (ConnectionError, requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+           requests.exceptions.ChunkedEncodingError)
+
+if httpx is not None:
+    _ERRORS += (httpx.TransportError,)
+
+
+class CircuitBreaker(object):
+    """
+    CircuitBreaker is the class which keeps track of the consecutive failures of every endpoint of the Twitter API, so
+    that once an endpoint fails `threshold` times in a row its circuit is opened and every request to it fails straight
+    away during `cooldown` seconds, instead of keeping workers busy waiting for an endpoint which is struggling. Once
+    the cooldown expires, a single trial request is let through: if it succeeds the circuit is closed again, otherwise
+    it stays open for another cooldown.
+    """
+
+    def __init__(self, threshold=5, cooldown=30.):
+        """
+        This function is the constructor of :obj:`twipper.retry.CircuitBreaker` class, which validates the introduced
+        parameters.
+
+        Args:
+            threshold (:obj:`int`, optional): consecutive failures which open the circuit of an endpoint, default is 5.
+            cooldown (:obj:`float`, optional): seconds during which an open circuit rejects requests, default is 30.
+
+        Raises:
+            ValueError: raised if the introduced arguments do not match or errored.
+        """
+
+        if not isinstance(threshold, int) or threshold < 1:
+            raise ValueError('threshold must be an `int` equal or higher than 1!')
+
+        if not isinstance(cooldown, (int, float)) or cooldown < 0:
+            raise ValueError('cooldown must be a `float` equal or higher than 0!')
+
+        self.threshold = threshold
+        self.cooldown = cooldown
+
+        self.failures = dict()
+        self.opened = dict()
+
+        self._lock = threading.Lock()
+
+    def allow(self, endpoint):
+        """
+        This function checks whether a request can be sent to the introduced endpoint, which is the case unless its
+        circuit is open; once the cooldown of an open circuit expires, just one trial request is allowed per cooldown.
+
+        Args:
+            endpoint (:obj:`str`): endpoint of the Twitter API, such as `search/tweets`.
+
+        Returns:
+            :obj:`boolean` - allowed:
+                Returns `True` if the request can be sent, `False` otherwise.
+        """
+
+        with self._lock:
+            opened = self.opened.get(endpoint)
+
+            if opened is None:
+                return True
+
+            now = time.time()
+
+            if now - opened < self.cooldown:
+                return False
+
+            self.opened[endpoint] = now
+
+            return True
+
+    def success(self, endpoint):
+        """
+        This function records a successful request to the introduced endpoint, closing its circuit.
+        """
+
+        with self._lock:
+            self.failures.pop(endpoint, None)
+            self.opened.pop(endpoint, None)
+
+    def failure(self, endpoint):
+        """
+        This function records a failed request to the introduced endpoint, opening its circuit once the amount of
+        consecutive failures reaches the threshold.
+        """
+
+        with self._lock:
+            self.failures[endpoint] = self.failures.get(endpoint, 0) + 1
+
+            if self.failures[endpoint] >= self.threshold:
+                self.opened[endpoint] = time.time()
+
+    def state(self, endpoint):
+        """
+        This function retrieves the state of the circuit of the introduced endpoint, which is either `closed` or `open`.
+        """
+
+        with self._lock:
+            return 'open' if endpoint in self.opened else 'closed'
+
+
+class RetryPolicy(object):
+    """
+    RetryPolicy is the class which sends the requests to the Twitter API retrying the failures worth retrying, this is,
+    server errors (5xx), connection errors such as resets or timeouts, and rate limited requests (429) whose limit is
+    reset in less than `max_wait` seconds, in which case the reset time is awaited. The rest of the failures are retried
+    with exponential backoff and full jitter, so that the clients which failed at the same time do not retry at the same
+    time. Every request goes through the circuit breaker of the policy, so that endpoints which keep failing are not
+    requested until their cooldown expires.
+    """
+
+    def __init__(self, retries=3, backoff=1., max_backoff=30., max_wait=60., breaker=None):
+        """
+        This function is the constructor of :obj:`twipper.retry.RetryPolicy` class, which validates the introduced
+        parameters.
+
+        Args:
+            retries (:obj:`int`, optional): maximum amount of retries of every request, default is 3.
+            backoff (:obj:`float`, optional):
+                base backoff in seconds, which is doubled after every retry (and then jittered), default is 1.
+            max_backoff (:obj:`float`, optional): maximum backoff in seconds between retries, default is 30.
+            max_wait (:obj:`float`, optional):
+                maximum seconds to wait for the reset of a rate limit before retrying a rate limited request, default is
+                60; requests whose rate limit is reset later on are not retried.
+            breaker (:obj:`twipper.retry.CircuitBreaker`, optional):
+                circuit breaker of the policy, default is a new :obj:`twipper.retry.CircuitBreaker`.
+
+        Raises:
+            ValueError: raised if the introduced arguments do not match or errored.
+        """
+
+        if not isinstance(retries, int) or retries < 0:
+            raise ValueError('retries must be an `int` equal or higher than 0!')
+
+        for name, value in (('backoff', backoff), ('max_backoff', max_backoff), ('max_wait', max_wait)):
+            if not isinstance(value, (int, float)) or value < 0:
+                raise ValueError(name + ' must be a `float` equal or higher than 0!')
+
+        if breaker is not None and not isinstance(breaker, CircuitBreaker):
+            raise ValueError('breaker must be a `twipper.retry.CircuitBreaker`!')
+
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_wait = max_wait
+
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+
+    def delay(self, attempt, response=None):
+        """
+        This function calculates the seconds to wait before retrying a request, given the number of the retry (starting
+        on 0) and the failed response, if any.
+
+        Args:
+            attempt (:obj:`int`): number of the retry, starting on 0.
+            response (:obj:`requests.Response`, optional): failed response, if any.
+
+        Returns:
+            :obj:`float` - delay:
+                Returns the seconds to wait, or `None` if the request should not be retried.
+        """
+
+        if response is not None and response.status_code == 429:
+            reset = response.headers.get('x-rate-limit-reset')
+
+            if reset is None:
+                return None
+
+            wait = max(0., float(reset) - time.time())
+
+            return wait if wait <= self.max_wait else None
+
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def send(self, request, endpoint):
+        """
+        This function sends a request to the introduced endpoint of the Twitter API, retrying it according to the
+        policy, and returns its response, which is the last one retrieved if every retry failed.
+
+        Args:
+            request (:obj:`function`): function without arguments which sends the request and returns its response.
+            endpoint (:obj:`str`): endpoint of the Twitter API, such as `search/tweets`.
+
+        Returns:
+            :obj:`requests.Response` - response:
+                Returns the response of the request.
+
+        Raises:
+            ConnectionError:
+                raised if the circuit of the endpoint is open or if the connection could not be established.
+        """
+
+        attempt = 0
+
+        while True:
+            if not self.breaker.allow(endpoint):
+                raise ConnectionError('circuit of ' + endpoint + ' is open, as it keeps failing.')
+
+            try:
+                response = request()
+            except _ERRORS as e:
+                self.breaker.failure(endpoint)
+
+                if attempt >= self.retries:
+                    raise ConnectionError('connection to ' + endpoint + ' could not be established.') from e
+
+                time.sleep(self.delay(attempt))
+                attempt += 1
+
+                continue
+
+            if response.status_code >= 500:
+                self.breaker.failure(endpoint)
+            elif response.status_code != 429:
+                self.breaker.success(endpoint)
+
+            if response.status_code < 500 and response.status_code != 429:
+                return response
+
+            delay = self.delay(attempt, response) if attempt < self.retries else None
+
+            if delay is None:
+                return response
+
+            time.sleep(delay)
+            attempt += 1
+
+
+class SearchResult(list):
+    """
+    SearchResult is the :obj:`list` of tweets retrieved by a search, which also contains its `metadata`: the amount of
+    retrieved `pages`, the cursor of the `next` page (`None` if every page was retrieved), whether the results were
+    `truncated` because a page could not be retrieved, and the `error` which truncated them, if any.
+    """
+
+    def __init__(self, tweets=(), metadata=None):
+        list.__init__(self, tweets)
+
+        self.metadata = {'pages': 0, 'next': None, 'truncated': False, 'error': None}
+        self.metadata.update(metadata or dict())
+
+    def by_user(self, screen_names, **metadata):
+        """
+        This function demultiplexes the tweets of the result per user who posted them, such as when the `from:`
+        operators of many users are OR'ed together into the same search.
+
+        Args:
+            screen_names (:obj:`list`): screen names of the users, as their tweets are retrieved on any case.
+            **metadata: metadata to add to the ones of the result on the result of every user.
+
+        Returns:
+            :obj:`dict` - results:
+                Returns a :obj:`dict` containing a :obj:`twipper.retry.SearchResult` per user, whose metadata are the
+                ones of the result, and tweets posted by any other user are discarded.
+        """
+
+        results = dict((user, SearchResult(metadata=dict(self.metadata, **metadata))) for user in screen_names)
+        owners = dict((user.lower(), user) for user in screen_names)
+
+        for tweet in self:
+            owner = owners.get(((tweet.get('user') or dict()).get('screen_name') or '').lower())
+
+            if owner is not None:
+                results[owner].append(tweet)
+
+        return results
+
+
+_default = None
+_lock = threading.Lock()
+
+
+def get_retry_policy():
+    """
+    This function retrieves the retry policy shared by every search which does not specify a retry policy of its own,
+    creating it on first use, so that every search shares the same circuit breaker.
+    """
+
+    global _default
+
+    with _lock:
+        if _default is None:
+            _default = RetryPolicy()
+
+        return _default
+
+
+def set_retry_policy(policy):
+    """
+    This function replaces the shared retry policy retrieved with :func:`twipper.retry.get_retry_policy`.
+    """
+
+    global _default
+
+    if not isinstance(policy, RetryPolicy):
+        raise ValueError('policy must be a `twipper.retry.RetryPolicy`!')
+
+    with _lock:
+        _default = policy
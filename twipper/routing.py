@@ -0,0 +1,347 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2019 Alvaro Bartolome
+# See LICENSE for details.
+
+from collections import deque
+
+from twipper.query import TRACK_KEYWORD_LIMIT
+from twipper.streaming import stream_tweets
+
+
+class AhoCorasick(object):
+    """
+    AhoCorasick is a multi-pattern string matcher which finds every occurrence of a set of keywords in a text on a
+    single pass, so on, the matching cost depends on the length of the text and on the number of matches, but not on
+    the number of keywords the automaton has been built with.
+    """
+
+    def __init__(self, patterns):
+        """
+        This function is the constructor of :obj:`twipper.routing.AhoCorasick` class, which builds the keyword trie
+        and computes the failure links of the automaton from the introduced patterns.
+
+        Args:
+            patterns (:obj:`list`): list of :obj:`str` containing the keywords to look for, already lowercased.
+        """
+
+        self.patterns = list(patterns)
+
+        self._goto = [dict()]
+        self._fail = [0]
+        self._output = [list()]
+
+        for index, pattern in enumerate(self.patterns):
+            state = 0
+
+            for char in pattern:
+                if char not in self._goto[state]:
+                    self._goto.append(dict())
+                    self._fail.append(0)
+                    self._output.append(list())
+                    self._goto[state][char] = len(self._goto) - 1
+
+                state = self._goto[state][char]
+
+            self._output[state].append(index)
+
+        queue = deque(self._goto[0].values())
+
+        while queue:
+            state = queue.popleft()
+
+            for char, child in self._goto[state].items():
+                queue.append(child)
+
+                fallback = self._fail[state]
+
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def search(self, text):
+        """
+        This function scans the introduced text once and returns the indices of every pattern found on it, as long as
+        the occurrence is a whole word, which means that it is neither preceded nor followed by an alphanumeric
+        character (so `cat` matches `#cat` or `cat!` but not `cats`), just as the Twitter Streaming API does.
+
+        Args:
+            text (:obj:`str`): lowercased text to search the patterns in.
+
+        Returns:
+            :obj:`set` - matches:
+                Returns a :obj:`set` containing the indices of the patterns that were found on the text.
+        """
+
+        matches = set()
+
+        state = 0
+
+        for position, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+
+            state = self._goto[state].get(char, 0)
+
+            for index in self._output[state]:
+                start = position - len(self.patterns[index]) + 1
+
+                if start > 0 and (text[start - 1].isalnum() or text[start - 1] == '_'):
+                    continue
+
+                if position + 1 < len(text) and (text[position + 1].isalnum() or text[position + 1] == '_'):
+                    continue
+
+                matches.add(index)
+
+        return matches
+
+
+def tweet_text(tweet):
+    """
+    This function retrieves the text a Twitter Streaming `track` rule is matched against, which is the complete text of
+    the tweet (the extended one if available), the text of the quoted tweet and the expanded urls it contains.
+
+    Args:
+        tweet (:obj:`dict`): tweet as retrieved from the Twitter API.
+
+    Returns:
+        :obj:`str` - text:
+            Returns a lowercased :obj:`str` containing all the matchable content of the tweet.
+    """
+
+    texts = list()
+
+    for status in (tweet, tweet.get('retweeted_status'), tweet.get('quoted_status')):
+        if not status:
+            continue
+
+        if 'extended_tweet' in status:
+            texts.append(status['extended_tweet'].get('full_text', ''))
+        else:
+            texts.append(status.get('full_text', status.get('text', '')) or '')
+
+        for url in status.get('entities', {}).get('urls', []):
+            if url.get('expanded_url'):
+                texts.append(url['expanded_url'])
+
+    return '\n'.join(texts).lower()
+
+
+class StreamRouter(object):
+    """
+    StreamRouter merges several logical subscriptions, each one with its own set of keywords, into a single `track`
+    parameter so that all of them can be served from just one connection to the Twitter Streaming API. Every retrieved
+    tweet is then matched against all the subscriptions using an Aho-Corasick automaton built over the keywords, so on,
+    it is delivered just to the subscribers whose rules it matches.
+    """
+
+    def __init__(self):
+        """
+        This function is the constructor of :obj:`twipper.routing.StreamRouter` class, which initializes an empty
+        router with no subscriptions.
+        """
+
+        self._subscriptions = dict()
+        self._callbacks = dict()
+
+        self._automaton = None
+        self._phrases = list()
+        self._phrase_words = list()
+        self._phrase_subscribers = list()
+        self._word_phrases = list()
+
+    def subscribe(self, name, keywords, callback=None):
+        """
+        This function registers a new subscription (or replaces an existing one with the same name) on the router.
+        Keywords follow the Twitter Streaming `track` syntax, so on, every keyword is a phrase whose words must all be
+        contained on the tweet, and a tweet matches the subscription if it matches any of its phrases.
+
+        Args:
+            name (:obj:`str`): unique name of the subscriber.
+            keywords (:obj:`str` or :obj:`list`):
+                either a comma-separated :obj:`str` as used on `track` or a :obj:`list` of phrases.
+            callback (:obj:`callable`, optional):
+                function to be called with every matching tweet, default is `None`.
+
+        Raises:
+            ValueError: raised if the introduced arguments do not match or errored.
+        """
+
+        if not name or not isinstance(name, str):
+            raise ValueError('name must be a `str`!')
+
+        if isinstance(keywords, str):
+            keywords = keywords.split(',')
+
+        if not isinstance(keywords, (list, tuple, set)):
+            raise ValueError('keywords must be either a `str` or a `list`!')
+
+        if callback is not None and not callable(callback):
+            raise ValueError('callback must be callable!')
+
+        phrases = list()
+
+        for keyword in keywords:
+            if not isinstance(keyword, str):
+                raise ValueError('every keyword must be a `str`!')
+
+            phrase = ' '.join(keyword.lower().split())
+
+            if phrase and phrase not in phrases:
+                phrases.append(phrase)
+
+        if len(phrases) < 1:
+            raise ValueError('at least one keyword is mandatory!')
+
+        self._subscriptions[name] = phrases
+
+        if callback is not None:
+            self._callbacks[name] = callback
+        else:
+            self._callbacks.pop(name, None)
+
+        self._automaton = None
+
+    def unsubscribe(self, name):
+        """
+        This function removes the introduced subscription from the router.
+
+        Args:
+            name (:obj:`str`): name of the subscriber to remove.
+
+        Raises:
+            KeyError: raised if there is no subscription with the introduced name.
+        """
+
+        if name not in self._subscriptions:
+            raise KeyError('there is no subscription named `' + str(name) + '`.')
+
+        del self._subscriptions[name]
+        self._callbacks.pop(name, None)
+
+        self._automaton = None
+
+    @property
+    def subscribers(self):
+        return list(self._subscriptions.keys())
+
+    @property
+    def track(self):
+        """
+        This property merges the keywords of every subscription into a single Twitter Streaming `track` parameter,
+        where repeated keywords are just sent once.
+
+        Raises:
+            ValueError: raised if there are no subscriptions or if the merged rules exceed the `track` keyword limit.
+        """
+
+        self._build()
+
+        if len(self._phrases) < 1:
+            raise ValueError('there are no subscriptions on the router!')
+
+        if len(self._phrases) > TRACK_KEYWORD_LIMIT:
+            raise ValueError('merged subscriptions contain ' + str(len(self._phrases)) + ' keywords, but `track` '
+                             'just allows up to ' + str(TRACK_KEYWORD_LIMIT) + '.')
+
+        return ','.join(self._phrases)
+
+    def _build(self):
+        if self._automaton is not None:
+            return
+
+        phrases = dict()
+
+        for name, keywords in self._subscriptions.items():
+            for keyword in keywords:
+                phrases.setdefault(keyword, set()).add(name)
+
+        words = dict()
+
+        self._phrases = list(phrases.keys())
+        self._phrase_subscribers = list(phrases.values())
+        self._phrase_words = list()
+        self._word_phrases = list()
+
+        for index, phrase in enumerate(self._phrases):
+            word_ids = set()
+
+            for word in phrase.split(' '):
+                if word not in words:
+                    words[word] = len(words)
+                    self._word_phrases.append(list())
+
+                word_ids.add(words[word])
+
+            for word_id in word_ids:
+                self._word_phrases[word_id].append(index)
+
+            self._phrase_words.append(word_ids)
+
+        self._automaton = AhoCorasick(words.keys())
+
+    def route(self, tweet):
+        """
+        This function matches the introduced tweet against every subscription on the router, so to retrieve the names
+        of the subscribers it should be delivered to.
+
+        Args:
+            tweet (:obj:`dict`): tweet as retrieved from the Twitter API.
+
+        Returns:
+            :obj:`set` - subscribers:
+                Returns a :obj:`set` containing the names of the subscribers whose rules the tweet matches.
+        """
+
+        self._build()
+
+        found = self._automaton.search(tweet_text(tweet))
+
+        subscribers = set()
+
+        candidates = set()
+
+        for word_id in found:
+            candidates.update(self._word_phrases[word_id])
+
+        for index in candidates:
+            if self._phrase_words[index] <= found:
+                subscribers |= self._phrase_subscribers[index]
+
+        return subscribers
+
+    def stream(self, access, language=None, filter_retweets=False, tweet_limit=None, date_limit=None, retry=5):
+        """
+        This function opens a single stream to the Twitter Streaming API tracking the merged keywords of every
+        subscription, and routes each retrieved tweet to its subscribers, calling their callbacks if any. Tweets that
+        do not match any subscription (as Twitter also matches some fields the router does not) are discarded.
+        Arguments are the same ones as in :func:`twipper.streaming.stream_tweets`.
+
+        Returns:
+            :obj:`tuple` - (subscribers, tweet):
+                Yields a :obj:`tuple` containing the :obj:`set` of subscribers matching the tweet and the tweet itself.
+        """
+
+        tweets = stream_tweets(access=access,
+                               query=self.track,
+                               language=language,
+                               filter_retweets=filter_retweets,
+                               tweet_limit=tweet_limit,
+                               date_limit=date_limit,
+                               retry=retry)
+
+        for tweet in tweets:
+            subscribers = self.route(tweet)
+
+            if not subscribers:
+                continue
+
+            for name in subscribers:
+                if name in self._callbacks:
+                    self._callbacks[name](tweet)
+
+            yield subscribers, tweet
@@ -0,0 +1,381 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2019 Alvaro Bartolome
+# See LICENSE for details.
+
+import heapq
+import json
+import math
+import random
+import re
+import threading
+
+from twipper.pagination import peek_json_string
+from twipper.streaming import _TWEET_ID
+from twipper.utils import snowflake_to_timestamp
+
+
+STRATA_KEYS = ['lang', 'country']
+
+# weights are rescaled once they grow this many times e (about 1e43), far from overflowing a float
+_MAX_EXPONENT = 100.
+
+_PLACE = re.compile(rb'"place"\s*:\s*(null|\{)')
+
+_COUNTRY_CODE = re.compile(rb'"country_code"\s*:\s*"([^"]*)"')
+
+
+class _Sampler(object):
+    """
+    _Sampler holds what every sampler shares: the validation of its parameters, its random number generator and the
+    lock which lets the sample be read from any thread while tweets are offered from another one.
+    """
+
+    def __init__(self, size, seed=None):
+        if not isinstance(size, int) or size < 1:
+            raise ValueError('size must be an `int` equal or higher than 1!')
+
+        self.size = size
+        self.seen = 0
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _uniform(self):
+        # uniform value on the open interval (0, 1), so that its logarithm is always defined and negative
+        value = self._random.random()
+
+        while value == 0.:
+            value = self._random.random()
+
+        return value
+
+
+def _tweet_id(message):
+    if isinstance(message, dict):
+        return message.get('id')
+
+    match = _TWEET_ID.match(message)
+
+    return int(match.group(1)) if match is not None else None
+
+
+def _decode(item):
+    return item if isinstance(item, dict) else json.loads(item.decode('utf-8'))
+
+
+class ReservoirSampler(_Sampler):
+    """
+    ReservoirSampler keeps a uniform random sample of fixed size of every tweet offered to it, using Algorithm L, so
+    that instead of drawing a random number per tweet it draws how many of the following tweets are skipped, which is
+    just a counter decrement per skipped tweet. Raw messages, as retrieved from the Twitter Streaming API, are offered
+    as they are: the tweets they contain are just identified by their leading `created_at` and `id` fields, and are
+    not decoded until the sample is read, so the tweets dropped by the sampler are never decoded. Non-tweet messages,
+    such as deletion or limit notices, are ignored. Memory is constant: at most `size` tweets are kept.
+    """
+
+    def __init__(self, size, seed=None):
+        """
+        This function is the constructor of :obj:`twipper.sampling.ReservoirSampler` class.
+
+        Args:
+            size (:obj:`int`): amount of tweets of the sample.
+            seed (:obj:`int`, optional): seed of the random number generator, default is `None`.
+
+        Raises:
+            ValueError: raised if the introduced arguments do not match or errored.
+        """
+
+        _Sampler.__init__(self, size, seed=seed)
+
+        self._items = list()
+        self._log_w = 0.
+        self._skip = 0
+
+    def _next_skip(self):
+        self._log_w += math.log(self._uniform()) / self.size
+
+        # log(1 - w), computed from log(w) so that it is still defined when w is rounded to 1
+        return int(math.floor(math.log(self._uniform()) / math.log(-math.expm1(self._log_w))))
+
+    def offer(self, message):
+        """
+        This function offers a tweet to the sampler, either as a raw message (:obj:`bytes`) or already decoded.
+
+        Args:
+            message (:obj:`bytes` or :obj:`dict`): raw message retrieved from the Twitter Streaming API, or tweet.
+
+        Returns:
+            :obj:`boolean` - admitted:
+                Returns `True` if the tweet was admitted into the sample, `False` otherwise.
+        """
+
+        if _tweet_id(message) is None:
+            return False
+
+        with self._lock:
+            self.seen += 1
+
+            if len(self._items) < self.size:
+                self._items.append(message)
+
+                if len(self._items) == self.size:
+                    self._skip = self._next_skip()
+
+                return True
+
+            if self._skip > 0:
+                self._skip -= 1
+                return False
+
+            self._items[self._random.randrange(self.size)] = message
+            self._skip = self._next_skip()
+
+            return True
+
+    def sample(self):
+        """
+        This function retrieves the current sample, decoding the tweets which were not decoded yet.
+
+        Returns:
+            :obj:`list` - tweets:
+                Returns a :obj:`list` containing the tweets of the sample, in no particular order.
+        """
+
+        with self._lock:
+            self._items = [_decode(item) for item in self._items]
+
+            return list(self._items)
+
+
+class DecayedSampler(_Sampler):
+    """
+    DecayedSampler keeps a random sample of fixed size biased towards the most recent tweets, where the weight of
+    every tweet halves every `half_life` seconds since it was posted (which is derived from its snowflake id, so the
+    tweet does not need to be decoded). It is a weighted reservoir sample with exponential jumps (A-ExpJ, by Efraimidis
+    and Spirakis) over forward-decayed weights, so that the weights of the sampled tweets never need to be updated, and
+    a random number is just drawn for the tweets admitted into the sample, instead of for every tweet offered. Memory
+    is constant: at most `size` tweets are kept, and they are not decoded until the sample is read.
+    """
+
+    def __init__(self, size, half_life=3600., seed=None):
+        """
+        This function is the constructor of :obj:`twipper.sampling.DecayedSampler` class.
+
+        Args:
+            size (:obj:`int`): amount of tweets of the sample.
+            half_life (:obj:`float`, optional):
+                seconds after which the weight of a tweet is halved, default is 3600 (an hour).
+            seed (:obj:`int`, optional): seed of the random number generator, default is `None`.
+
+        Raises:
+            ValueError: raised if the introduced arguments do not match or errored.
+        """
+
+        _Sampler.__init__(self, size, seed=seed)
+
+        if not isinstance(half_life, (int, float)) or half_life <= 0:
+            raise ValueError('half_life must be a `float` higher than 0!')
+
+        self.half_life = half_life
+
+        self._rate = math.log(2) / half_life
+        self._origin = None
+        self._heap = list()
+        self._jump = None
+
+    def _weight(self, timestamp):
+        if self._origin is None:
+            self._origin = timestamp
+
+        exponent = self._rate * (timestamp - self._origin)
+
+        if exponent > _MAX_EXPONENT:
+            # moving the origin scales every weight by the same factor, so the keys keep their order, and after long
+            # gaps the older tweets are left with negligible weights anyway
+            factor = math.exp(min(exponent, 700.))
+
+            for entry in self._heap:
+                entry[0] *= factor
+
+            if self._jump is not None:
+                self._jump /= factor
+
+            self._origin, exponent = timestamp, 0.
+
+        return math.exp(max(exponent, -_MAX_EXPONENT))
+
+    def _next_jump(self):
+        # keys are stored as logarithms, so the threshold of the sample is negative
+        return math.log(self._uniform()) / min(self._heap[0][0], -1e-300)
+
+    def offer(self, message):
+        """
+        This function offers a tweet to the sampler, either as a raw message (:obj:`bytes`) or already decoded.
+
+        Args:
+            message (:obj:`bytes` or :obj:`dict`): raw message retrieved from the Twitter Streaming API, or tweet.
+
+        Returns:
+            :obj:`boolean` - admitted:
+                Returns `True` if the tweet was admitted into the sample, `False` otherwise.
+        """
+
+        tweet_id = _tweet_id(message)
+
+        if tweet_id is None:
+            return False
+
+        with self._lock:
+            self.seen += 1
+
+            weight = self._weight(snowflake_to_timestamp(tweet_id) / 1000.)
+
+            if len(self._heap) < self.size:
+                heapq.heappush(self._heap, [math.log(self._uniform()) / weight, self.seen, message])
+
+                if len(self._heap) == self.size:
+                    self._jump = self._next_jump()
+
+                return True
+
+            self._jump -= weight
+
+            if self._jump > 0:
+                return False
+
+            # the key of the admitted tweet is drawn above the threshold it just crossed
+            low = math.exp(self._heap[0][0] * weight)
+            key = math.log(1. - (1. - low) * self._random.random()) / weight
+
+            heapq.heapreplace(self._heap, [min(key, 0.), self.seen, message])
+
+            self._jump = self._next_jump()
+
+            return True
+
+    def sample(self):
+        """
+        This function retrieves the current sample, decoding the tweets which were not decoded yet.
+
+        Returns:
+            :obj:`list` - tweets:
+                Returns a :obj:`list` containing the tweets of the sample, in no particular order.
+        """
+
+        with self._lock:
+            for entry in self._heap:
+                entry[2] = _decode(entry[2])
+
+            return [entry[2] for entry in self._heap]
+
+
+class StratifiedSampler(_Sampler):
+    """
+    StratifiedSampler keeps a uniform random sample of fixed size per stratum, such as per language or per country, so
+    that the strata with fewer tweets are still represented on the sample. The language and the country of every tweet
+    are peeked from its raw message without decoding it (the last `lang` field, which is the one of the tweet, as
+    Twitter sends it after the retweeted and quoted tweets, and the `country_code` of its `place`), so just the tweets
+    kept on the sample are decoded; other strata can be defined with a function, but then every tweet is decoded.
+    Memory is constant: at most `max_strata` strata are sampled, and the tweets of any other stratum are sampled
+    together under the `None` stratum, along with the tweets without language or country.
+    """
+
+    def __init__(self, size, key='lang', max_strata=64, seed=None):
+        """
+        This function is the constructor of :obj:`twipper.sampling.StratifiedSampler` class.
+
+        Args:
+            size (:obj:`int`): amount of tweets of the sample of every stratum.
+            key (:obj:`str` or :obj:`function`, optional):
+                either `lang` or `country`, to stratify the tweets by language or by country, or a function which
+                returns the stratum of a decoded tweet, default is `lang`.
+            max_strata (:obj:`int`, optional): maximum amount of strata, default is 64.
+            seed (:obj:`int`, optional): seed of the random number generator, default is `None`.
+
+        Raises:
+            ValueError: raised if the introduced arguments do not match or errored.
+        """
+
+        _Sampler.__init__(self, size, seed=seed)
+
+        if key not in STRATA_KEYS and not callable(key):
+            raise ValueError('key must be either `lang`, `country` or a function!')
+
+        if not isinstance(max_strata, int) or max_strata < 1:
+            raise ValueError('max_strata must be an `int` equal or higher than 1!')
+
+        self.key = key
+        self.max_strata = max_strata
+
+        self.strata = dict()
+
+    def _stratum(self, message):
+        if callable(self.key):
+            return self.key(message)
+
+        if isinstance(message, dict):
+            if self.key == 'lang':
+                return message.get('lang')
+
+            return (message.get('place') or dict()).get('country_code')
+
+        if self.key == 'lang':
+            return peek_json_string(message, 'lang')
+
+        place = _PLACE.search(message)
+
+        if place is None or place.group(1) == b'null':
+            return None
+
+        country = _COUNTRY_CODE.search(message, place.end())
+
+        return country.group(1).decode('utf-8') if country is not None else None
+
+    def offer(self, message):
+        """
+        This function offers a tweet to the sampler, either as a raw message (:obj:`bytes`) or already decoded.
+
+        Args:
+            message (:obj:`bytes` or :obj:`dict`): raw message retrieved from the Twitter Streaming API, or tweet.
+
+        Returns:
+            :obj:`boolean` - admitted:
+                Returns `True` if the tweet was admitted into the sample of its stratum, `False` otherwise.
+        """
+
+        if _tweet_id(message) is None:
+            return False
+
+        if callable(self.key):
+            message = _decode(message)
+
+        stratum = self._stratum(message) or None
+
+        with self._lock:
+            self.seen += 1
+
+            if stratum not in self.strata and len(self.strata) - (None in self.strata) >= self.max_strata:
+                stratum = None
+
+            if stratum not in self.strata:
+                self.strata[stratum] = ReservoirSampler(self.size, seed=self._random.getrandbits(64))
+
+            sampler = self.strata[stratum]
+
+        return sampler.offer(message)
+
+    def sample(self):
+        """
+        This function retrieves the current sample of every stratum, decoding the tweets which were not decoded yet.
+
+        Returns:
+            :obj:`dict` - tweets:
+                Returns a :obj:`dict` containing a :obj:`list` with the tweets of the sample of every stratum.
+        """
+
+        with self._lock:
+            strata = dict(self.strata)
+
+        return dict((stratum, sampler.sample()) for stratum, sampler in strata.items())
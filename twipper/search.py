@@ -0,0 +1,486 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2019 Alvaro Bartolome
+# See LICENSE for details.
+
+import bisect
+import datetime
+import json
+import re
+import sqlite3
+
+from collections import defaultdict
+
+import twipper.batch as batch
+import twipper.premium as premium
+from twipper.query import Field, Not, Or, Phrase, Term, compile_query, parse
+from twipper.routing import tweet_text
+from twipper.utils import date_to_timestamp, timestamp_to_snowflake, tweet_timestamp
+
+
+_TOKEN = re.compile(r'[#@$]?\w+', re.UNICODE)
+
+_FLAGS = {
+    ('is', 'retweet'): 'retweet',
+    ('filter', 'retweets'): 'retweet',
+    ('is', 'verified'): 'verified',
+    ('filter', 'verified'): 'verified',
+    ('is', 'reply'): 'reply',
+    ('filter', 'replies'): 'reply',
+    ('is', 'quote'): 'quote',
+}
+
+
+def _tokens(text):
+    tokens = set()
+
+    for token in _TOKEN.findall(text.lower()):
+        tokens.add(token)
+
+        if token[0] in '#@$':
+            tokens.add(token[1:])
+
+    return tokens
+
+
+class LocalIndex(object):
+    """
+    LocalIndex is an in-memory inverted index over archived tweets, which evaluates the queries formatted as specified
+    by twipper (the same ones accepted by :func:`twipper.utils.standard_query`) without calling the Twitter API. Every
+    token of the text of the tweets is mapped to the ids of the tweets containing it, as well as their author,
+    language and flags (retweet, reply, verified), so queries are solved with set operations over those postings; date
+    ranges are solved with a binary search over the sorted ids, since tweet ids are snowflakes ordered by time. The
+    index also keeps track of the time intervals it covers, this is, the ones whose tweets have been completely
+    archived (either every tweet, or just the ones matching a given search), so that searches over the rest of
+    intervals can be sent to the Twitter API.
+    """
+
+    def __init__(self, tweets=None):
+        """
+        This function is the constructor of :obj:`twipper.search.LocalIndex` class.
+
+        Args:
+            tweets (:obj:`iterable`, optional): tweets to index as retrieved from the Twitter API, default is `None`.
+        """
+
+        self._tweets = dict()
+        self._postings = defaultdict(set)
+        self._fields = defaultdict(set)
+
+        self._ids = list()
+        self._sorted = True
+
+        self.intervals = list()
+        self.searches = dict()
+
+        if tweets is not None:
+            self.add_many(tweets)
+
+    def __len__(self):
+        return len(self._tweets)
+
+    def __contains__(self, tweet_id):
+        return int(tweet_id) in self._tweets
+
+    def add(self, tweet):
+        """
+        This function indexes the introduced tweet, unless it is already indexed.
+
+        Args:
+            tweet (:obj:`dict`): tweet as retrieved from the Twitter API.
+        """
+
+        if 'id' not in tweet:
+            return
+
+        tweet_id = int(tweet['id'])
+
+        if tweet_id in self._tweets:
+            return
+
+        self._tweets[tweet_id] = tweet
+
+        if self._ids and tweet_id < self._ids[-1]:
+            self._sorted = False
+
+        self._ids.append(tweet_id)
+
+        for token in _tokens(tweet_text(tweet)):
+            self._postings[token].add(tweet_id)
+
+        user = tweet.get('user') or {}
+
+        if user.get('screen_name'):
+            self._fields['from', user['screen_name'].lower()].add(tweet_id)
+
+        if tweet.get('in_reply_to_screen_name'):
+            self._fields['to', tweet['in_reply_to_screen_name'].lower()].add(tweet_id)
+
+        if tweet.get('lang'):
+            self._fields['lang', tweet['lang'].lower()].add(tweet_id)
+
+        if 'retweeted_status' in tweet:
+            self._fields['flag', 'retweet'].add(tweet_id)
+
+        if tweet.get('in_reply_to_status_id'):
+            self._fields['flag', 'reply'].add(tweet_id)
+
+        if tweet.get('is_quote_status') or 'quoted_status' in tweet:
+            self._fields['flag', 'quote'].add(tweet_id)
+
+        if user.get('verified'):
+            self._fields['flag', 'verified'].add(tweet_id)
+
+    def add_many(self, tweets):
+        """
+        This function indexes every tweet of the introduced iterable.
+        """
+
+        for tweet in tweets:
+            self.add(tweet)
+
+    def load_sqlite(self, path, cover=False):
+        """
+        This function indexes every tweet archived on a SQLite database created by :obj:`twipper.sinks.SQLiteSink`.
+
+        Args:
+            path (:obj:`str`): path to the SQLite database file.
+            cover (:obj:`boolean`, optional):
+                whether the interval between the oldest and the newest archived tweet should be marked as covered, which
+                should just be done if every tweet of that interval was archived, default is `False`.
+
+        Returns:
+            :obj:`int` - count:
+                Returns the number of tweets loaded from the database.
+        """
+
+        if not path or not isinstance(path, str):
+            raise ValueError('path must be a `str`!')
+
+        connection = sqlite3.connect(path)
+
+        try:
+            count = 0
+
+            for row in connection.execute('SELECT json FROM tweets ORDER BY id'):
+                self.add(json.loads(row[0]))
+                count += 1
+
+            if cover and count > 0:
+                start, end = connection.execute('SELECT MIN(timestamp_ms), MAX(timestamp_ms) FROM tweets').fetchone()
+                self.cover(start, end + 1)
+        finally:
+            connection.close()
+
+        return count
+
+    def cover(self, start, end, search=None):
+        """
+        This function marks the introduced time interval as covered by the index, this is, every tweet created on it
+        which should be retrieved by any search (or just by the introduced search, if any) has been indexed.
+
+        Args:
+            start (:obj:`int`): start of the interval as milliseconds since epoch (inclusive).
+            end (:obj:`int`): end of the interval as milliseconds since epoch (exclusive).
+            search (:obj:`tuple`, optional):
+                key of the search whose tweets have been indexed, such as the one built by
+                :func:`twipper.search.search_tweets`, default is `None` which means that every tweet has been indexed.
+        """
+
+        if end <= start:
+            raise ValueError('the end of the interval should be later than its start.')
+
+        if search is None:
+            self.intervals = _merge(self.intervals + [(start, end)])
+        else:
+            self.searches[search] = _merge(self.searches.get(search, list()) + [(start, end)])
+
+    def gaps(self, start, end, search=None):
+        """
+        This function retrieves the sub-intervals of the introduced time interval which are not covered by the index,
+        neither for every search nor for the introduced one, if any.
+
+        Returns:
+            :obj:`list` - gaps:
+                Returns a :obj:`list` of `(start, end)` tuples as milliseconds since epoch.
+        """
+
+        intervals = self.intervals
+
+        if search is not None and search in self.searches:
+            intervals = _merge(intervals + self.searches[search])
+
+        gaps = list()
+
+        for covered_start, covered_end in intervals:
+            if covered_end <= start:
+                continue
+
+            if covered_start >= end:
+                break
+
+            if covered_start > start:
+                gaps.append((start, covered_start))
+
+            start = max(start, covered_end)
+
+        if start < end:
+            gaps.append((start, end))
+
+        return gaps
+
+    def _range(self, start=None, end=None):
+        if not self._sorted:
+            self._ids.sort()
+            self._sorted = True
+
+        lower = 0 if start is None else bisect.bisect_left(self._ids, start)
+        upper = len(self._ids) if end is None else bisect.bisect_left(self._ids, end)
+
+        return set(self._ids[lower:upper])
+
+    def _phrase(self, value):
+        tokens = _TOKEN.findall(value.lower())
+
+        if not tokens:
+            return set()
+
+        candidates = set.intersection(*[self._postings.get(token, set()) for token in tokens])
+
+        if len(tokens) == 1:
+            return candidates
+
+        pattern = re.compile(r'(?<!\w)' + r'\W+'.join(re.escape(token) for token in tokens) + r'(?!\w)')
+
+        return set(tweet_id for tweet_id in candidates if pattern.search(tweet_text(self._tweets[tweet_id])))
+
+    def _field(self, node):
+        name, value = node.name.lower(), node.value.lower()
+
+        if (name, value) in _FLAGS:
+            return set(self._fields.get(('flag', _FLAGS[name, value]), set()))
+
+        if name in ('from', 'to'):
+            return set(self._fields.get((name, value.lstrip('@')), set()))
+
+        if name == 'lang':
+            return set(self._fields.get((name, value), set()))
+
+        if name in ('since', 'until'):
+            try:
+                timestamp = timestamp_to_snowflake(date_to_timestamp(value, '%Y-%m-%d'))
+            except ValueError:
+                raise ValueError('incorrect date format on `' + name + '`, it should be `yyyy-mm-dd`')
+
+            if name == 'since':
+                return self._range(start=timestamp)
+
+            return self._range(end=timestamp)
+
+        if name in ('since_id', 'max_id') and value.isdigit():
+            if name == 'since_id':
+                return self._range(start=int(value) + 1)
+
+            return self._range(end=int(value) + 1)
+
+        raise ValueError('operator `' + node.name + ':' + node.value + '` is not supported on local searches.')
+
+    def _evaluate(self, node):
+        if isinstance(node, Term):
+            if len(_TOKEN.findall(node.value)) > 1:
+                return self._phrase(node.value)
+
+            return set(self._postings.get(node.value.lower(), set()))
+
+        if isinstance(node, Phrase):
+            return self._phrase(node.value)
+
+        if isinstance(node, Field):
+            return self._field(node)
+
+        if isinstance(node, Not):
+            return set(self._tweets.keys()) - self._evaluate(node.child)
+
+        if isinstance(node, Or):
+            result = set()
+
+            for child in node.children:
+                result |= self._evaluate(child)
+
+            return result
+
+        positives = [child for child in node.children if not isinstance(child, Not)]
+        negatives = [child.child for child in node.children if isinstance(child, Not)]
+
+        if positives:
+            result = None
+
+            for child in sorted(positives, key=lambda child: not isinstance(child, (Term, Field))):
+                result = self._evaluate(child) if result is None else result & self._evaluate(child)
+
+                if not result:
+                    return result
+        else:
+            result = set(self._tweets.keys())
+
+        for child in negatives:
+            result -= self._evaluate(child)
+
+        return result
+
+    def search(self, query, start=None, end=None, language=None, filter_retweets=False, verified_account=False,
+               count=None):
+        """
+        This function searches the indexed tweets which match the introduced query, formatted as specified by twipper,
+        with the AND, OR and NOT operators, "exact phrases" and the `from:`, `to:`, `lang:`, `since:`, `until:`,
+        `since_id:`, `max_id:`, `is:` and `filter:` operators.
+
+        Args:
+            query (:obj:`str`): query formatted as specified by twipper.
+            start (:obj:`int`, optional): earliest creation time of the tweets as milliseconds since epoch.
+            end (:obj:`int`, optional): latest creation time of the tweets as milliseconds since epoch (exclusive).
+            language (:obj:`str`, optional): is the language on which the tweet has been written, default is `None`.
+            filter_retweets (:obj:`boolean`, optional): whether to filter out retweets or not, default is `False`.
+            verified_account (:obj:`boolean`, optional): whether to just retrieve tweets from verified accounts.
+            count (:obj:`int`, optional): maximum number of tweets to retrieve, default is `None` which means all.
+
+        Returns:
+            :obj:`list` - tweets:
+                Returns a :obj:`list` containing the matching tweets, sorted from the newest to the oldest one.
+
+        Raises:
+            ValueError: raised if the introduced arguments do not match or if the query is not valid.
+        """
+
+        result = self._evaluate(parse(query))
+
+        if start is not None or end is not None:
+            result &= self._range(start=None if start is None else timestamp_to_snowflake(start),
+                                  end=None if end is None else timestamp_to_snowflake(end))
+
+        if language:
+            result &= self._fields.get(('lang', language.lower()), set())
+
+        if filter_retweets:
+            result -= self._fields.get(('flag', 'retweet'), set())
+
+        if verified_account:
+            result &= self._fields.get(('flag', 'verified'), set())
+
+        ids = sorted(result, reverse=True)
+
+        if count is not None:
+            ids = ids[:count]
+
+        return [self._tweets[tweet_id] for tweet_id in ids]
+
+
+def search_tweets(index, access, query, page_count, from_date, to_date, language=None, filter_retweets=False,
+                  verified_account=False, fallback='premium'):
+    """
+    This function retrieves historical tweets matching the introduced query, just like
+    :func:`twipper.premium.search_tweets`, but answering from a :obj:`twipper.search.LocalIndex` first. Just the time
+    intervals not covered by the index are searched on the Twitter API, using either the premium or the standard
+    search, and the retrieved tweets are added to the index, so the API quota is not spent twice on the same content.
+
+    Args:
+        index (:obj:`twipper.search.LocalIndex`): local index of archived tweets.
+        access (:obj:`twipper.credentials.Twipper`):
+            object containing all the credentials needed to access api.twitter, or `None` to just search locally.
+        query (:obj:`str`): query formatted as specified by twipper.
+        page_count (:obj:`int`): specifies the amount of pages to retrieve per uncovered interval.
+        from_date (:obj:`str`): starting date of the time interval to retrieve tweets from (`yyyymmddhhmm` format)
+        to_date (:obj:`str`): end date of the time interval to retrieve tweets from (`yyyymmddhhmm` format)
+        language (:obj:`str`, optional): is the language on which the tweet has been written, default is `None`.
+        filter_retweets (:obj:`boolean`, optional): whether to filter out retweets or not, default is `False`.
+        verified_account (:obj:`boolean`, optional): whether to just retrieve tweets from verified accounts.
+        fallback (:obj:`str`, optional):
+            API used for the uncovered intervals, either `premium` or `batch` (standard search, which just covers the
+            last week), default is `premium`.
+
+    Returns:
+        :obj:`list` - tweets:
+            Returns a :obj:`list` containing the matching tweets, sorted from the newest to the oldest one.
+
+    Raises:
+        ValueError: raised if the introduced arguments do not match or errored.
+        IndexError: raised if no tweets could be retrieved.
+    """
+
+    if not isinstance(index, LocalIndex):
+        raise ValueError('index must be a `twipper.search.LocalIndex`!')
+
+    if fallback not in ['premium', 'batch']:
+        raise ValueError('fallback can just be `premium` or `batch`!')
+
+    if not from_date or not isinstance(from_date, str) or not to_date or not isinstance(to_date, str):
+        raise ValueError('from_date and to_date must be a `str`!')
+
+    try:
+        start = date_to_timestamp(from_date, '%Y%m%d%H%M')
+        end = date_to_timestamp(to_date, '%Y%m%d%H%M')
+    except ValueError:
+        raise ValueError('incorrect date format, it should be `yyyymmddhhmm`')
+
+    if start >= end:
+        raise ValueError('incorrect dates, as from_date should be earlier than to_date.')
+
+    parse(query)
+
+    if access is not None:
+        search = (compile_query(query, syntax='premium'), language, filter_retweets, verified_account)
+
+        for gap_start, gap_end in index.gaps(start, end, search=search):
+            gap_start, gap_end = gap_start // 60000 * 60000, -(-gap_end // 60000) * 60000
+
+            try:
+                if fallback == 'premium':
+                    tweets = premium.search_tweets(access, compile_query(query, syntax='premium'), page_count,
+                                                   _format_date(gap_start, '%Y%m%d%H%M'),
+                                                   _format_date(gap_end, '%Y%m%d%H%M'),
+                                                   language=language, filter_retweets=filter_retweets)
+                else:
+                    tweets = batch.search_tweets(access, compile_query(query, syntax='standard'),
+                                                 page_count=page_count, filter_retweets=filter_retweets,
+                                                 verified_account=verified_account, language=language,
+                                                 result_type='recent', from_date=_format_date(gap_start, '%Y%m%d%H%M'),
+                                                 to_date=_format_date(gap_end, '%Y%m%d%H%M'))
+            except IndexError:
+                index.cover(gap_start, gap_end, search=search)
+                continue
+
+            index.add_many(tweets)
+
+            # when there are pages left or some page could not be retrieved there may be older tweets left, so just the
+            # interval between the oldest retrieved tweet and the end of the gap is covered, as results are sorted from
+            # newest to oldest
+            if tweets.metadata['next'] is not None or tweets.metadata['truncated']:
+                gap_start = min(tweet_timestamp(tweet) for tweet in tweets)
+
+            if gap_start < gap_end:
+                index.cover(gap_start, gap_end, search=search)
+
+    tweets = index.search(query, start=start, end=end, language=language, filter_retweets=filter_retweets,
+                          verified_account=verified_account)
+
+    if len(tweets) > 0:
+        return tweets
+    else:
+        raise IndexError('no tweets could be retrieved.')
+
+
+def _merge(intervals):
+    merged = list()
+
+    for interval in sorted(intervals):
+        if merged and interval[0] <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], interval[1]))
+        else:
+            merged.append(interval)
+
+    return merged
+
+
+def _format_date(timestamp, date_format):
+    return datetime.datetime.fromtimestamp(timestamp / 1000., datetime.timezone.utc).strftime(date_format)
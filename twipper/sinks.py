@@ -0,0 +1,539 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2019 Alvaro Bartolome
+# See LICENSE for details.
+
+import datetime
+import json
+import os
+import sqlite3
+
+from collections import OrderedDict
+
+from twipper.archive import ArchiveReader, ArchiveWriter
+from twipper.utils import full_text, snowflake_to_timestamp, timestamp_to_snowflake
+
+
+_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY,
+        screen_name TEXT,
+        name TEXT,
+        location TEXT,
+        verified INTEGER,
+        followers_count INTEGER,
+        friends_count INTEGER,
+        statuses_count INTEGER,
+        created_at TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS tweets (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER REFERENCES users(id),
+        timestamp_ms INTEGER,
+        created_at TEXT,
+        lang TEXT,
+        text TEXT,
+        retweeted_id INTEGER,
+        quoted_id INTEGER,
+        in_reply_to_id INTEGER,
+        retweet_count INTEGER,
+        favorite_count INTEGER,
+        json TEXT
+    )''',
+    'CREATE INDEX IF NOT EXISTS tweets_user_id ON tweets (user_id)',
+    'CREATE INDEX IF NOT EXISTS tweets_timestamp_ms ON tweets (timestamp_ms)',
+    'CREATE INDEX IF NOT EXISTS users_screen_name ON users (screen_name COLLATE NOCASE)',
+]
+
+_FTS_SCHEMA = [
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS tweets_fts USING fts5 (
+        text, content='tweets', content_rowid='id'
+    )''',
+]
+
+# every column of a user is overwritten with its latest values, and nothing cascades from users, so replacing the row is
+# the same as an upsert, which would require SQLite 3.24
+_UPSERT_USER = 'INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'
+
+
+class SQLiteSink(object):
+    """
+    SQLiteSink archives tweets into a SQLite database with normalized `tweets` and `users` tables, where retweeted
+    and quoted tweets are stored as tweets on their own. Tweets are buffered and inserted in batches, each one on a
+    single transaction with `executemany`, over a database in WAL mode, so on, tens of thousands of tweets per second
+    can be archived. The text of every tweet is indexed with FTS5, so archived tweets can be searched right away.
+    """
+
+    def __init__(self, path, batch_size=1000, fts=True):
+        """
+        This function is the constructor of :obj:`twipper.sinks.SQLiteSink` class, which opens (or creates) the
+        database and its tables.
+
+        Args:
+            path (:obj:`str`): path to the SQLite database file.
+            batch_size (:obj:`int`, optional): number of tweets to buffer before inserting them, default is 1000.
+            fts (:obj:`boolean`, optional): whether to index the text of the tweets with FTS5, default is `True`.
+
+        Raises:
+            ValueError: raised if the introduced arguments do not match or errored, or if `fts` is `True` but SQLite was
+                not compiled with FTS5.
+        """
+
+        if not path or not isinstance(path, str):
+            raise ValueError('path must be a `str`!')
+
+        if not isinstance(batch_size, int) or batch_size < 1:
+            raise ValueError('batch_size must be an `int` equal or higher than 1!')
+
+        if not isinstance(fts, bool):
+            raise ValueError('fts must be a `boolean`!')
+
+        self.path = path
+        self.batch_size = batch_size
+        self.fts = fts
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('PRAGMA temp_store=MEMORY')
+
+        with self.connection:
+            for statement in _SCHEMA:
+                self.connection.execute(statement)
+
+        if fts:
+            try:
+                with self.connection:
+                    for statement in _FTS_SCHEMA:
+                        self.connection.execute(statement)
+            except sqlite3.OperationalError as e:
+                if 'no such module' not in str(e):
+                    raise
+
+                self.connection.close()
+
+                raise ValueError('SQLite ' + sqlite3.sqlite_version + ' was not compiled with FTS5, so full-text '
+                                 'indexing is not available, introduce `fts` as `False`!')
+
+        self._buffer = list()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, tweet):
+        """
+        This function buffers the introduced tweet, inserting every buffered tweet once the batch is complete.
+
+        Args:
+            tweet (:obj:`dict`): tweet as retrieved from the Twitter API.
+        """
+
+        self._buffer.append(tweet)
+
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def write_many(self, tweets):
+        """
+        This function buffers every tweet of the introduced iterable, inserting them in batches.
+
+        Args:
+            tweets (:obj:`iterable`): tweets as retrieved from the Twitter API.
+        """
+
+        for tweet in tweets:
+            self.write(tweet)
+
+    def tee(self, tweets):
+        """
+        This function archives every tweet of the introduced iterable (such as the generator returned by
+        :func:`twipper.streaming.stream_tweets`) while yielding them back, so it can be placed in front of any consumer.
+        Buffered tweets are inserted once the iterable is exhausted.
+        """
+
+        try:
+            for tweet in tweets:
+                self.write(tweet)
+                yield tweet
+        finally:
+            self.flush()
+
+    def flush(self):
+        """
+        This function inserts every buffered tweet (and their users) on a single transaction.
+        """
+
+        if not self._buffer:
+            return
+
+        users = dict()
+        tweets = dict()
+
+        for tweet in self._buffer:
+            for status in (tweet, tweet.get('retweeted_status'), tweet.get('quoted_status')):
+                if not status or 'id' not in status:
+                    continue
+
+                user = status.get('user') or {}
+
+                if 'id' in user:
+                    users[user['id']] = (user['id'], user.get('screen_name'), user.get('name'),
+                                         user.get('location'), int(bool(user.get('verified'))),
+                                         user.get('followers_count'), user.get('friends_count'),
+                                         user.get('statuses_count'), user.get('created_at'))
+
+                if status['id'] in tweets:
+                    continue
+
+                retweeted = status.get('retweeted_status') or {}
+                quoted = status.get('quoted_status') or {}
+
+                tweets[status['id']] = (status['id'], user.get('id'), snowflake_to_timestamp(status['id']),
+                                        status.get('created_at'), status.get('lang'), full_text(status),
+                                        retweeted.get('id'), quoted.get('id') or status.get('quoted_status_id'),
+                                        status.get('in_reply_to_status_id'), status.get('retweet_count'),
+                                        status.get('favorite_count'), json.dumps(status, separators=(',', ':')))
+
+        ids = list(tweets.keys())
+
+        for index in range(0, len(ids), 500):
+            chunk = ids[index:index + 500]
+            query = 'SELECT id FROM tweets WHERE id IN (' + ','.join('?' * len(chunk)) + ')'
+
+            for row in self.connection.execute(query, chunk):
+                del tweets[row[0]]
+
+        with self.connection:
+            self.connection.executemany(_UPSERT_USER, users.values())
+            self.connection.executemany('INSERT OR IGNORE INTO tweets VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                        tweets.values())
+
+            if self.fts:
+                self.connection.executemany('INSERT INTO tweets_fts (rowid, text) VALUES (?, ?)',
+                                            ((row[0], row[5]) for row in tweets.values()))
+
+        self._buffer = list()
+
+    def close(self):
+        """
+        This function inserts every buffered tweet and closes the database.
+        """
+
+        if self.connection is None:
+            return
+
+        self.flush()
+
+        self.connection.close()
+        self.connection = None
+
+    def count(self):
+        """
+        This function retrieves the number of tweets archived on the database (including retweeted and quoted ones).
+        """
+
+        self.flush()
+
+        return self.connection.execute('SELECT COUNT(*) FROM tweets').fetchone()[0]
+
+    def get(self, tweet_id):
+        """
+        This function retrieves an archived tweet by its id, or `None` if it is not archived.
+        """
+
+        self.flush()
+
+        row = self.connection.execute('SELECT json FROM tweets WHERE id = ?', (int(tweet_id),)).fetchone()
+
+        return json.loads(row[0]) if row else None
+
+    def search(self, text, limit=100):
+        """
+        This function searches the archived tweets whose text matches the introduced FTS5 query, such as `cats`,
+        `"big cats"`, `cat*` or `cats AND NOT dogs`, sorted by relevance.
+
+        Args:
+            text (:obj:`str`): FTS5 full-text query.
+            limit (:obj:`int`, optional): maximum number of tweets to retrieve, default is 100.
+
+        Returns:
+            :obj:`list` - tweets:
+                Returns a :obj:`list` containing the matching tweets as they were archived.
+
+        Raises:
+            ValueError: raised if the introduced arguments do not match or if full-text indexing is disabled.
+        """
+
+        if not self.fts:
+            raise ValueError('full-text search is just available when `fts` is `True`!')
+
+        if not text or not isinstance(text, str):
+            raise ValueError('text must be a `str`!')
+
+        if not isinstance(limit, int) or limit < 1:
+            raise ValueError('limit must be an `int` equal or higher than 1!')
+
+        self.flush()
+
+        rows = self.connection.execute('SELECT tweets.json FROM tweets_fts JOIN tweets ON tweets.id = tweets_fts.rowid '
+                                       'WHERE tweets_fts MATCH ? ORDER BY tweets_fts.rank LIMIT ?', (text, limit))
+
+        return [json.loads(row[0]) for row in rows]
+
+
+PARTITIONS = {
+    'hour': ('%Y%m%d%H', 3600000),
+    'day': ('%Y%m%d', 86400000),
+}
+
+
+def _partition_start(timestamp, partition):
+    span = PARTITIONS[partition][1]
+
+    return timestamp // span * span
+
+
+def _partition_key(start, partition):
+    return datetime.datetime.fromtimestamp(start / 1000., datetime.timezone.utc).strftime(PARTITIONS[partition][0])
+
+
+class PartitionedSink(object):
+    """
+    PartitionedSink routes tweets into hour or day partitions based on the time they were created at, which is derived
+    from their snowflake ids, so that later queries over a time range just read the partitions overlapping it. Every
+    partition is an archive written by :obj:`twipper.archive.ArchiveWriter` (`<key>.ndjson` plus its index) along with a
+    `<key>.manifest.json` file containing its time range, number of tweets and lowest and highest ids, which is all
+    :obj:`twipper.sinks.PartitionedReader` needs to prune partitions before opening any of them.
+    """
+
+    def __init__(self, path, partition='hour', max_open=4):
+        """
+        This function is the constructor of :obj:`twipper.sinks.PartitionedSink` class.
+
+        Args:
+            path (:obj:`str`): path to the directory where the partitions are stored, created if it does not exist.
+            partition (:obj:`str`, optional): either `hour` or `day`, default is `hour`.
+            max_open (:obj:`int`, optional):
+                maximum number of partitions open at the same time, as tweets from streams and searches usually just
+                belong to the latest ones, default is 4.
+
+        Raises:
+            ValueError: raised if the introduced arguments do not match or errored.
+        """
+
+        if not path or not isinstance(path, str):
+            raise ValueError('path must be a `str`!')
+
+        if partition not in PARTITIONS:
+            raise ValueError('partition can just be `hour` or `day`!')
+
+        if not isinstance(max_open, int) or max_open < 1:
+            raise ValueError('max_open must be an `int` equal or higher than 1!')
+
+        self.path = path
+        self.partition = partition
+        self.max_open = max_open
+
+        os.makedirs(path, exist_ok=True)
+
+        self._writers = OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _writer(self, start):
+        if start in self._writers:
+            self._writers.move_to_end(start)
+            return self._writers[start]
+
+        while len(self._writers) >= self.max_open:
+            self._close(*self._writers.popitem(last=False))
+
+        writer = ArchiveWriter(os.path.join(self.path, _partition_key(start, self.partition) + '.ndjson'), append=True)
+
+        self._writers[start] = writer
+
+        return writer
+
+    def _close(self, start, writer):
+        writer.close()
+
+        with ArchiveReader(writer.path) as reader:
+            count = len(reader)
+            id_range = reader.id_range
+
+        manifest = {
+            'partition': _partition_key(start, self.partition),
+            'start': start,
+            'end': start + PARTITIONS[self.partition][1],
+            'count': count,
+            'min_id': id_range[0] if id_range else None,
+            'max_id': id_range[1] if id_range else None,
+        }
+
+        with open(writer.path[:-len('.ndjson')] + '.manifest.json', 'w') as file:
+            json.dump(manifest, file)
+
+    def write(self, tweet):
+        """
+        This function appends the introduced tweet to the partition it belongs to.
+
+        Args:
+            tweet (:obj:`dict`): tweet as retrieved from the Twitter API.
+        """
+
+        if 'id' not in tweet:
+            return
+
+        self._writer(_partition_start(snowflake_to_timestamp(tweet['id']), self.partition)).write(tweet)
+
+    def write_many(self, tweets):
+        """
+        This function appends every tweet of the introduced iterable (such as the :obj:`list` returned by
+        :func:`twipper.premium.search_tweets`) to the partitions they belong to.
+        """
+
+        for tweet in tweets:
+            self.write(tweet)
+
+    def tee(self, tweets):
+        """
+        This function partitions every tweet of the introduced iterable (such as the generator returned by
+        :func:`twipper.streaming.stream_tweets`) while yielding them back, so it can be placed in front of any consumer.
+        Open partitions are closed once the iterable is exhausted.
+        """
+
+        try:
+            for tweet in tweets:
+                self.write(tweet)
+                yield tweet
+        finally:
+            self.flush()
+
+    def flush(self):
+        """
+        This function closes every open partition, writing its index and manifest.
+        """
+
+        while self._writers:
+            self._close(*self._writers.popitem(last=False))
+
+    def close(self):
+        """
+        This function closes every open partition.
+        """
+
+        self.flush()
+
+
+class PartitionedReader(object):
+    """
+    PartitionedReader retrieves the tweets stored by :obj:`twipper.sinks.PartitionedSink`, just reading the manifests
+    of the partitions to decide which of them should be opened for a given time or id range.
+    """
+
+    def __init__(self, path):
+        """
+        This function is the constructor of :obj:`twipper.sinks.PartitionedReader` class.
+
+        Args:
+            path (:obj:`str`): path to the directory where the partitions are stored.
+
+        Raises:
+            ValueError: raised if the introduced arguments do not match or errored.
+        """
+
+        if not path or not isinstance(path, str) or not os.path.isdir(path):
+            raise ValueError('path must be a `str` pointing to an existing directory!')
+
+        self.path = path
+
+        self.manifests = list()
+
+        for name in sorted(os.listdir(path)):
+            if name.endswith('.manifest.json'):
+                with open(os.path.join(path, name)) as file:
+                    self.manifests.append(json.load(file))
+
+        self.manifests.sort(key=lambda manifest: manifest['start'])
+
+    @property
+    def count(self):
+        return sum(manifest['count'] for manifest in self.manifests)
+
+    def partitions(self, start=None, end=None, start_id=None, end_id=None):
+        """
+        This function retrieves the manifests of the non-empty partitions which may contain tweets within the
+        introduced time range (in milliseconds since epoch) and id range, both with inclusive start and exclusive end.
+
+        Returns:
+            :obj:`list` - manifests:
+                Returns a :obj:`list` containing the manifest of every matching partition as a :obj:`dict`.
+        """
+
+        partitions = list()
+
+        for manifest in self.manifests:
+            if manifest['count'] < 1:
+                continue
+
+            if start is not None and manifest['end'] <= start:
+                continue
+
+            if end is not None and manifest['start'] >= end:
+                continue
+
+            if start_id is not None and manifest['max_id'] < start_id:
+                continue
+
+            if end_id is not None and manifest['min_id'] >= end_id:
+                continue
+
+            partitions.append(manifest)
+
+        return partitions
+
+    def scan(self, start=None, end=None, start_id=None, end_id=None):
+        """
+        This function retrieves every stored tweet within the introduced time range (in milliseconds since epoch) and
+        id range, both with inclusive start and exclusive end, in id order.
+
+        Returns:
+            :obj:`dict` - tweet:
+                Yields every tweet on the range.
+        """
+
+        lower, upper = start_id, end_id
+
+        if start is not None:
+            lower = max(lower or 0, timestamp_to_snowflake(start))
+
+        if end is not None:
+            upper = timestamp_to_snowflake(end) if upper is None else min(upper, timestamp_to_snowflake(end))
+
+        for manifest in self.partitions(start=start, end=end, start_id=start_id, end_id=end_id):
+            with ArchiveReader(os.path.join(self.path, manifest['partition'] + '.ndjson')) as reader:
+                for tweet in reader.scan(lower, upper):
+                    yield tweet
+
+    def get(self, tweet_id):
+        """
+        This function retrieves the stored tweet with the introduced id, or `None` if it is not stored, just opening
+        the partition it belongs to.
+        """
+
+        timestamp = snowflake_to_timestamp(tweet_id)
+
+        for manifest in self.partitions(start=timestamp, end=timestamp + 1):
+            with ArchiveReader(os.path.join(self.path, manifest['partition'] + '.ndjson')) as reader:
+                return reader.get(tweet_id)
+
+        return None
@@ -6,18 +6,60 @@
 
 import datetime
 import json
+import re
+import time
 
-import oauth2
-import requests
-import requests_oauthlib
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 
-from twipper.utils import country_to_bounding_box
+import requests_oauthlib
+import urllib3
+
+import twipper.batch as batch
+import twipper.premium as premium
+from twipper.framing import READ_SIZE, decompress, iter_messages
+from twipper.geo import BoundingBoxIndex, PolygonIndex, COUNTRY_POLYGONS
+from twipper.retry import _ERRORS
+from twipper.utils import country_to_bounding_box, snowflake_to_timestamp
 # from twipper.utils import available_languages
 from twipper.credentials import Twipper
 
 
+LANGUAGES = [
+    'fr', 'en', 'ar', 'ja', 'es', 'de', 'it', 'id', 'pt', 'ko',
+    'tr', 'ru', 'nl', 'fil', 'msa', 'zh-tw', 'zh-cn', 'hi', 'no',
+    'sv', 'fi', 'da', 'pl', 'hu', 'fa', 'he', 'ur', 'th', 'uk',
+    'ca', 'ga', 'el', 'eu', 'cs', 'gl', 'ro', 'hr', 'en-gb', 'vi',
+    'bn', 'bg', 'sr', 'sk', 'gu', 'mr', 'ta', 'kn'
+]
+
+LOCATIONS_LIMIT = 25
+
+RECENT_IDS = 10000
+
+# seconds after which the partial chunks of lines read are handed to the worker processes
+CHUNK_DELAY = .5
+
+# seconds waited before reconnecting, as (initial, maximum), following the reconnection guidelines of Twitter: network
+# errors back off linearly, HTTP errors exponentially, and rate limited connections (420 and 429) exponentially too
+# starting on a minute
+BACKOFF = {
+    'network': (.25, 16.),
+    'http': (5., 320.),
+    'rate_limit': (60., 960.),
+}
+
+_DISCONNECTS = _ERRORS + (urllib3.exceptions.HTTPError,)
+
+_TWEET_ID = re.compile(rb'\s*\{\s*"created_at"\s*:\s*"[^"]*"\s*,\s*"id"\s*:\s*(\d+)')
+
+_RETWEET = re.compile(rb'"retweeted_status"\s*:')
+
+
 def stream_tweets(access, query, language=None, filter_retweets=False,
-                  tweet_limit=None, date_limit=None, retry=5):
+                  tweet_limit=None, date_limit=None, retry=5,
+                  fields=None, workers=None, chunk_size=100, ordered=True, delimited=None, compression=True,
+                  backfill=None, backfill_pages=1, stop=None, sampler=None):
     """
     This function retrieves streaming tweets matching the given query, so on, this function will open a stream to
     the Twitter Streaming API to retrieve real-time tweets. By the time these tweets are retrieved, they are handled
@@ -38,6 +80,34 @@ def stream_tweets(access, query, language=None, filter_retweets=False,
             value to set the number of retries if connection to api.twitter fails, it can either be an :obj:`int` or
             a :obj:`str` which can just be the value `no_limit` in the case that no retry limits want to be set. Default
             value is 5 retries whenever connection fails, until function finishes.
+        fields (:obj:`list`, optional):
+            fields of the tweet to keep, where nested fields are specified with dots (e.g. `user.screen_name`), so that
+            every other field is dropped, default is `None` which means that the whole tweet is retrieved.
+        workers (:obj:`int`, optional):
+            number of processes to decode, filter and project tweets with, so that high-rate streams are not limited
+            by a single core, default is `None` which means that tweets are decoded on the current process.
+        chunk_size (:obj:`int`, optional): number of lines handed to a worker process at once, default is 100.
+        ordered (:obj:`boolean`, optional):
+            if `True` tweets are yielded in the order they were retrieved, otherwise they are yielded as soon as the
+            worker processes parse them, default is `True`.
+        delimited (:obj:`str`, optional):
+            if `length`, Twitter precedes every tweet with its length in bytes, so tweets are sliced from the
+            connection without scanning them for line delimiters, default is `None`.
+        compression (:obj:`boolean`, optional):
+            if `True` the stream is requested gzip-compressed and decompressed incrementally, which reduces the
+            bandwidth used about 5-10 times, default is `True`.
+        backfill (:obj:`str`, optional):
+            either `batch` or `premium`, to heal the gaps left by disconnections: every time the stream reconnects,
+            the tweets matching the query posted since the last tweet retrieved before the disconnection are searched
+            on the introduced API and merged into the stream, skipping the ones already retrieved, default is `None`.
+        backfill_pages (:obj:`int`, optional): maximum amount of pages searched per gap, default is 1.
+        stop (:obj:`threading.Event`, optional):
+            event which stops the stream once set, which is checked whenever data or a keep-alive (sent every 30
+            seconds by Twitter) is received, so that the stream can be stopped from another thread, default is `None`.
+        sampler (:obj:`twipper.sampling.ReservoirSampler`, optional):
+            sampler (see :mod:`twipper.sampling`) every raw message is offered to before being decoded, so that just
+            the tweets admitted into its sample are decoded and yielded (and counted towards `tweet_limit`), while the
+            sample itself can be read from another thread at any time, default is `None`.
 
     Returns:
         :obj:`list` - tweets:
@@ -48,18 +118,7 @@ def stream_tweets(access, query, language=None, filter_retweets=False,
         ValueError: raised if the introduced arguments do not match or errored.
     """
 
-    if not access or not isinstance(access, Twipper):
-        raise ValueError('access object to api.twitter is not valid!')
-
-    api = access.api
-
-    if not isinstance(api, oauth2.Client):
-        raise ValueError('api is not valid!')
-
-    oauth = access.oauth
-
-    if not isinstance(oauth, requests_oauthlib.OAuth1):
-        raise ValueError('auth is not valid!')
+    access = _check_access(access)
 
     if not isinstance(query, str):
         raise ValueError('query must be a string!')
@@ -67,190 +126,163 @@ def stream_tweets(access, query, language=None, filter_retweets=False,
     if query is None:
         raise ValueError('query is mandatory')
 
-    if not isinstance(language, str):
+    if language is not None and not isinstance(language, str):
         raise ValueError('language must be a string!')
 
-    if language is None:
-        raise ValueError('language is mandatory')
-
     if not isinstance(filter_retweets, bool):
         raise ValueError('filter_retweets must be a boolean!')
 
     if filter_retweets is None:
         raise ValueError('filter_retweets is mandatory')
 
-    if tweet_limit is not None and not isinstance(tweet_limit, int):
-        raise ValueError('tweet_limit value is not valid')
+    retries = _check_limits(tweet_limit, date_limit, retry)
 
-    if date_limit is not None and isinstance(date_limit, str):
-        try:
-            datetime.datetime.strptime(date_limit, '%Y%m%d%H%M')
-        except ValueError:
-            raise ValueError("incorrect date format, it should be 'yyyymmddhhmm'.")
+    if stop is not None and not callable(getattr(stop, 'is_set', None)):
+        raise ValueError('stop must be a `threading.Event`!')
 
-    if not isinstance(retry, int) and not isinstance(retry, str):
-        raise ValueError('retry value is not valid as it is not a str or int value!')
+    if fields is not None:
+        if not isinstance(fields, (list, tuple)) or not all(isinstance(field, str) for field in fields):
+            raise ValueError('fields must be a `list` of `str`!')
 
-    if isinstance(retry, str) and retry != 'no_limit':
-        raise ValueError('retry value is not valid as it is not `no_limit`!')
+    if workers is not None and (not isinstance(workers, int) or workers < 1):
+        raise ValueError('workers must be an `int` equal or higher than 1!')
 
-    if isinstance(retry, int) and retry < 0:
-        raise ValueError('retry value is not valid as it is below 0!')
+    if not isinstance(chunk_size, int) or chunk_size < 1:
+        raise ValueError('chunk_size must be an `int` equal or higher than 1!')
 
-    url = 'https://stream.twitter.com/1.1/statuses/filter.json'
+    if not isinstance(ordered, bool):
+        raise ValueError('ordered must be a boolean!')
 
-    if language:
-        # try:
-        #     languages = available_languages(api)
-        # except (ConnectionError, json.decoder.JSONDecodeError, IndexError):
-        #     raise RuntimeError('`twipper.utils.available_languages` function failed')
+    if delimited not in (None, 'length'):
+        raise ValueError('delimited can just be `None` or `length`!')
 
-        languages = [
-            'fr', 'en', 'ar', 'ja', 'es', 'de', 'it', 'id', 'pt', 'ko', 
-            'tr', 'ru', 'nl', 'fil', 'msa', 'zh-tw', 'zh-cn', 'hi', 'no', 
-            'sv', 'fi', 'da', 'pl', 'hu', 'fa', 'he', 'ur', 'th', 'uk', 
-            'ca', 'ga', 'el', 'eu', 'cs', 'gl', 'ro', 'hr', 'en-gb', 'vi', 
-            'bn', 'bg', 'sr', 'sk', 'gu', 'mr', 'ta', 'kn'
-        ]
-
-        if language in languages:
-            params = {
-                'track': query,
-                'language': language
-            }
-        else:
-            raise ValueError('the introduced language does not exist.')
-    else:
-        params = {
-            'track': query
-        }
+    if not isinstance(compression, bool):
+        raise ValueError('compression must be a boolean!')
 
-    headers = {
-        'Content-Type': 'application/json',
-    }
+    if backfill not in (None, 'batch', 'premium'):
+        raise ValueError('backfill can just be `None`, `batch` or `premium`!')
 
-    if isinstance(retry, str) and retry == 'no_limit':
-        retries = -1
-    else:
-        retries = retry
+    if not isinstance(backfill_pages, int) or backfill_pages < 1:
+        raise ValueError('backfill_pages must be an `int` equal or higher than 1!')
 
-    flag = False
+    if sampler is not None and not callable(getattr(sampler, 'offer', None)):
+        raise ValueError('sampler must be a sampler of `twipper.sampling`!')
 
-    if tweet_limit:
-        tweet_counter = 0
+    params = _params(language, track=query)
 
-        while flag is False:
-            response = requests.post(url, auth=oauth, headers=headers, params=params, stream=True)
+    if delimited:
+        params['delimited'] = delimited
 
-            if response.status_code != 200:
-                raise ConnectionError('connection errored with code ' + str(response.status_code) + '.')
+    if backfill is not None:
+        backfill = _backfill_search(access, backfill, _track_to_query(query), language, filter_retweets,
+                                    backfill_pages)
 
-            for line in response.iter_lines():
-                if not line:
-                    break
+    return _stream(access, params, filter_retweets, tweet_limit, date_limit, retries,
+                   fields=fields, workers=workers, chunk_size=chunk_size, ordered=ordered, compression=compression,
+                   backfill=backfill, stop=stop, sampler=sampler)
 
-                if tweet_limit == tweet_counter:
-                    flag = True
-                    break
 
-                if retries == 0:
-                    flag = True
-                    break
+def stream_country_tweets(access, country, language=None, filter_retweets=False,
+                          tweet_limit=None, date_limit=None, retry=5, exact=False, polygons=None, stop=None):
+    """
+    This function retrieves streaming tweets matching the given query, so on, this function will open a stream to
+    the Twitter Streaming API to retrieve real-time tweets. By the time these tweets are retrieved, they are handled
+    and returned as a :obj:`list`.
+    API Reference: https://developer.twitter.com/en/docs/tweets/filter-realtime/guides/basic-stream-parameters.html
 
-                try:
-                    tweet = json.loads(line.decode('utf-8'))
-                except json.decoder.JSONDecodeError:
-                    retries -= 1
-                    continue
+    Args:
+        access (:obj:`twipper.credentials.Twipper`): object containing all the credentials needed to access api.twitter
+        country (:obj:`str`): contains the country name from where generic tweets will be retrieved.
+        language (:obj:`str`, optional): is the language on which the tweet has been written, default is `None`.
+        filter_retweets (:obj:`boolean`, optional):
+            can be either `True` or `False`, to filter out retweets or not, respectively.
+        tweet_limit (:obj:`int`, optional):
+            specifies the amount of tweets to be retrieved on streaming, default is 10k tweets.
+        date_limit (:obj:`str`, optional):
+            specifies the date (format `yyyymmddhhmm`) where the stream will stop, default is `None`
+        retry (:obj:`int` or :obj:`str`, optional):
+            value to set the number of retries if connection to api.twitter fails, it can either be an :obj:`int` or
+            a :obj:`str` which can just be the value `no_limit` in the case that no retry limits want to be set. Default
+            value is 5 retries whenever connection fails, until function finishes.
+        exact (:obj:`boolean`, optional):
+            if `True`, tweets are checked against the borders of the country and the ones located outside of them are
+            dropped, since the country bounding box also covers parts of the neighbouring countries, default `False`.
+        polygons (:obj:`str`, optional):
+            path to a GeoJSON file containing the country borders to use when `exact` is `True`, default is `None`
+            which means that the Natural Earth 1:110m borders bundled with twipper will be used, so country names
+            must match the Natural Earth ones (see :meth:`twipper.geo.PolygonIndex.from_geojson`).
+        stop (:obj:`threading.Event`, optional):
+            event which stops the stream once set, which is checked whenever data or a keep-alive (sent every 30
+            seconds by Twitter) is received, so that the stream can be stopped from another thread, default is `None`.
 
-                if filter_retweets:
-                    if 'retweeted_status' not in tweet:
-                        yield tweet
-                        tweet_counter += 1
-                else:
-                    yield tweet
-                    tweet_counter += 1
+    Returns:
+        :obj:`list` - tweets:
+            Yields a :obj:`list` containing all the retrieved tweets from Twitter, which means all the available tweets
+            from the user specified on the arguments of the function.
 
-    elif date_limit is not None:
-        while flag is False:
-            response = requests.post(url, auth=oauth, headers=headers, params=params, stream=True)
+    Raises:
+        ValueError: raised if the introduced arguments do not match or errored.
+    """
 
-            if response.status_code != 200:
-                raise ConnectionError('connection errored with code ' + str(response.status_code) + '.')
+    access = _check_access(access)
 
-            for line in response.iter_lines():
-                if not line:
-                    break
+    if not isinstance(country, str):
+        raise ValueError('query must be a string!')
 
-                current_date = datetime.datetime.now().strftime('%Y%m%d%H%M')
-                if current_date >= date_limit:
-                    flag = True
-                    break
+    if country is None:
+        raise ValueError('query is mandatory')
 
-                if retries == 0:
-                    flag = True
-                    break
+    if language is not None and not isinstance(language, str):
+        raise ValueError('language must be a string!')
 
-                try:
-                    tweet = json.loads(line.decode('utf-8'))
-                except json.decoder.JSONDecodeError:
-                    retries -= 1
-                    continue
+    if not isinstance(filter_retweets, bool) or filter_retweets is None:
+        raise ValueError('filter_retweets must be a boolean!')
 
-                if filter_retweets:
-                    if 'retweeted_status' not in tweet:
-                        yield tweet
-                else:
-                    yield tweet
+    retries = _check_limits(tweet_limit, date_limit, retry)
 
-    else:
-        tweet_limit = 1000
-        tweet_counter = 0
+    if stop is not None and not callable(getattr(stop, 'is_set', None)):
+        raise ValueError('stop must be a `threading.Event`!')
 
-        while flag is False:
-            response = requests.post(url, auth=oauth, headers=headers, params=params, stream=True)
+    if not isinstance(exact, bool):
+        raise ValueError('exact must be a boolean!')
 
-            if response.status_code != 200:
-                raise ConnectionError('connection errored with code ' + str(response.status_code) + '.')
+    if exact:
+        index = PolygonIndex.from_geojson(polygons or COUNTRY_POLYGONS, names=[country])
 
-            for line in response.iter_lines():
-                if not line:
-                    break
+    try:
+        bounding_box = country_to_bounding_box(country)
+    except (ConnectionError, ValueError, IndexError):
+        raise RuntimeError('introduced country bounding_box was unavailable or unable to retrieve')
 
-                if tweet_limit == tweet_counter:
-                    flag = True
-                    break
+    params = _params(language, locations=str(bounding_box))
 
-                if retries == 0:
-                    flag = True
-                    break
+    if not exact:
+        return _stream(access, params, filter_retweets, tweet_limit, date_limit, retries, stop=stop)
 
-                try:
-                    tweet = json.loads(line.decode('utf-8'))
-                except json.decoder.JSONDecodeError:
-                    retries -= 1
-                    continue
+    def route(tweet):
+        if index.locate_tweet(tweet) is None:
+            return None
 
-                if filter_retweets:
-                    if 'retweeted_status' not in tweet:
-                        yield tweet
-                        tweet_counter += 1
-                else:
-                    yield tweet
-                    tweet_counter += 1
+        return tweet
 
+    return _stream(access, params, filter_retweets, tweet_limit, date_limit, retries, route=route, stop=stop)
 
-def stream_country_tweets(access, country, language=None, filter_retweets=False,
-                          tweet_limit=None, date_limit=None, retry=5):
+
+def stream_multi_country_tweets(access, countries, language=None, filter_retweets=False,
+                                tweet_limit=None, date_limit=None, retry=5, exact=False, polygons=None, stop=None):
     """
-    This function retrieves streaming tweets matching the given query, so on, this function will open a stream to
-    the Twitter Streaming API to retrieve real-time tweets. By the time these tweets are retrieved, they are handled
-    and returned as a :obj:`list`.
+    This function retrieves streaming tweets from several countries at once over a single connection to the Twitter
+    Streaming API, as the bounding boxes of every country are packed into the same `locations` parameter (which allows
+    up to 25 bounding boxes). Every retrieved tweet is then routed back to its country locally, based on its
+    coordinates or on the bounding box of its place, using a precomputed :obj:`twipper.geo.BoundingBoxIndex`, so on,
+    tweets that cannot be located on any of the countries are discarded.
     API Reference: https://developer.twitter.com/en/docs/tweets/filter-realtime/guides/basic-stream-parameters.html
 
     Args:
         access (:obj:`twipper.credentials.Twipper`): object containing all the credentials needed to access api.twitter
-        country (:obj:`str`): contains the country name from where generic tweets will be retrieved.
+        countries (:obj:`list` or :obj:`dict`):
+            contains the names of the countries from where tweets will be retrieved, or a :obj:`dict` containing the
+            country names as keys and their bounding boxes (formatted as `west,south,east,north`) as values.
         language (:obj:`str`, optional): is the language on which the tweet has been written, default is `None`.
         filter_retweets (:obj:`boolean`, optional):
             can be either `True` or `False`, to filter out retweets or not, respectively.
@@ -262,41 +294,96 @@ def stream_country_tweets(access, country, language=None, filter_retweets=False,
             value to set the number of retries if connection to api.twitter fails, it can either be an :obj:`int` or
             a :obj:`str` which can just be the value `no_limit` in the case that no retry limits want to be set. Default
             value is 5 retries whenever connection fails, until function finishes.
+        exact (:obj:`boolean`, optional):
+            if `True`, tweets are routed using the borders of the countries instead of their bounding boxes, so the
+            ones located outside of every country are dropped, default `False`.
+        polygons (:obj:`str`, optional):
+            path to a GeoJSON file containing the country borders to use when `exact` is `True`, default is `None`
+            which means that the Natural Earth 1:110m borders bundled with twipper will be used, so country names
+            must match the Natural Earth ones (see :meth:`twipper.geo.PolygonIndex.from_geojson`).
+        stop (:obj:`threading.Event`, optional):
+            event which stops the stream once set, which is checked whenever data or a keep-alive (sent every 30
+            seconds by Twitter) is received, so that the stream can be stopped from another thread, default is `None`.
 
     Returns:
-        :obj:`list` - tweets:
-            Yields a :obj:`list` containing all the retrieved tweets from Twitter, which means all the available tweets
-            from the user specified on the arguments of the function.
+        :obj:`tuple` - (country, tweet):
+            Yields a :obj:`tuple` containing the name of the country the tweet was routed to and the tweet itself.
 
     Raises:
         ValueError: raised if the introduced arguments do not match or errored.
+        RuntimeError: raised if the bounding box of any of the countries could not be retrieved.
     """
 
-    if not access or not isinstance(access, Twipper):
-        raise ValueError('access object to api.twitter is not valid!')
+    access = _check_access(access)
+
+    if not countries or not isinstance(countries, (list, tuple, dict)):
+        raise ValueError('countries must be a non empty `list` or `dict`!')
+
+    if language is not None and not isinstance(language, str):
+        raise ValueError('language must be a string!')
 
-    api = access.api
+    if not isinstance(filter_retweets, bool) or filter_retweets is None:
+        raise ValueError('filter_retweets must be a boolean!')
 
-    if not isinstance(api, oauth2.Client):
-        raise ValueError('api is not valid!')
+    retries = _check_limits(tweet_limit, date_limit, retry)
 
-    oauth = access.oauth
+    if stop is not None and not callable(getattr(stop, 'is_set', None)):
+        raise ValueError('stop must be a `threading.Event`!')
 
-    if not isinstance(oauth, requests_oauthlib.OAuth1):
-        raise ValueError('auth is not valid!')
+    if not isinstance(exact, bool):
+        raise ValueError('exact must be a boolean!')
 
-    if not isinstance(country, str):
-        raise ValueError('query must be a string!')
+    if not isinstance(countries, dict):
+        bounding_boxes = dict()
 
-    if country is None:
-        raise ValueError('query is mandatory')
+        for country in countries:
+            if not isinstance(country, str):
+                raise ValueError('every country must be a `str`!')
 
-    if not isinstance(language, str) or language is None:
-        raise ValueError('language must be a string!')
+            try:
+                bounding_boxes[country] = country_to_bounding_box(country)
+            except (ConnectionError, ValueError, IndexError):
+                raise RuntimeError('bounding_box of `' + country + '` was unavailable or unable to retrieve')
+    else:
+        bounding_boxes = countries
 
-    if not isinstance(filter_retweets, bool) or filter_retweets is None:
-        raise ValueError('filter_retweets must be a boolean!')
+    index = BoundingBoxIndex(bounding_boxes)
+
+    if len(index.boxes) > LOCATIONS_LIMIT:
+        raise ValueError('countries span ' + str(len(index.boxes)) + ' bounding boxes, but Twitter Streaming just '
+                         'allows up to ' + str(LOCATIONS_LIMIT) + ' on a single connection.')
+
+    params = _params(language, locations=index.locations)
+
+    if exact:
+        names = dict((country.lower().strip(), country) for country in bounding_boxes)
+        borders = PolygonIndex.from_geojson(polygons or COUNTRY_POLYGONS, names=list(names.keys()))
+
+    def route(tweet):
+        if exact:
+            country = names.get(borders.locate_tweet(tweet))
+        else:
+            country = index.locate_tweet(tweet)
+
+        if country is None:
+            return None
+
+        return country, tweet
+
+    return _stream(access, params, filter_retweets, tweet_limit, date_limit, retries, route=route, stop=stop)
 
+
+def _check_access(access):
+    if not access or not isinstance(access, Twipper):
+        raise ValueError('access object to api.twitter is not valid!')
+
+    if not isinstance(access.oauth, requests_oauthlib.OAuth1):
+        raise ValueError('auth is not valid!')
+
+    return access
+
+
+def _check_limits(tweet_limit, date_limit, retry):
     if tweet_limit is not None and not isinstance(tweet_limit, int):
         raise ValueError('tweet_limit value is not valid')
 
@@ -315,150 +402,501 @@ def stream_country_tweets(access, country, language=None, filter_retweets=False,
     if isinstance(retry, int) and retry < 0:
         raise ValueError('retry value is not valid as it is below 0!')
 
-    try:
-        bounding_box = country_to_bounding_box(country)
-    except (ConnectionError, ValueError, IndexError):
-        raise RuntimeError('introduced country bounding_box was unavailable or unable to retrieve')
+    if isinstance(retry, str) and retry == 'no_limit':
+        return -1
+
+    return retry
 
-    url = 'https://stream.twitter.com/1.1/statuses/filter.json'
 
+def _params(language, **params):
     if language:
         # try:
         #     languages = available_languages(api)
         # except (ConnectionError, json.decoder.JSONDecodeError, IndexError):
         #     raise RuntimeError('`twipper.utils.available_languages` function failed')
 
-        languages = [
-            'fr', 'en', 'ar', 'ja', 'es', 'de', 'it', 'id', 'pt', 'ko', 
-            'tr', 'ru', 'nl', 'fil', 'msa', 'zh-tw', 'zh-cn', 'hi', 'no', 
-            'sv', 'fi', 'da', 'pl', 'hu', 'fa', 'he', 'ur', 'th', 'uk', 
-            'ca', 'ga', 'el', 'eu', 'cs', 'gl', 'ro', 'hr', 'en-gb', 'vi', 
-            'bn', 'bg', 'sr', 'sk', 'gu', 'mr', 'ta', 'kn'
-        ]
-
-        if language in languages:
-            params = {
-                'language': language,
-                'locations': str(bounding_box)
-            }
+        if language in LANGUAGES:
+            params['language'] = language
         else:
             raise ValueError('the introduced language does not exist.')
-    else:
-        params = {
-            'locations': str(bounding_box)
-        }
+
+    return params
+
+
+def _project(tweet, fields):
+    projected = dict()
+
+    for field in fields:
+        source, target = tweet, projected
+        keys = field.split('.')
+
+        for key in keys[:-1]:
+            if not isinstance(source, dict) or not isinstance(source.get(key), dict):
+                source = None
+                break
+
+            source = source[key]
+            target = target.setdefault(key, dict())
+
+        if isinstance(source, dict) and keys[-1] in source:
+            target[keys[-1]] = source[keys[-1]]
+
+    return projected
+
+
+def _parse_line(line, filter_retweets, fields):
+    """
+    This function decodes a line retrieved from the Twitter Streaming API and returns the tweet it contains, projected
+    to the introduced fields if any, or `None` if it is a retweet and retweets are being filtered out.
+
+    Raises:
+        json.decoder.JSONDecodeError: raised if the line does not contain a valid JSON object.
+        UnicodeDecodeError: raised if the line is not valid UTF-8.
+    """
+
+    tweet = json.loads(line.decode('utf-8'))
+
+    if filter_retweets and 'retweeted_status' in tweet:
+        return None
+
+    if fields:
+        tweet = _project(tweet, fields)
+
+    return tweet
+
+
+def _parse_chunk(lines, filter_retweets, fields):
+    """
+    This function decodes a chunk of lines on a worker process of the pool, returning the resulting tweets (the
+    filtered out ones just being skipped) and, for every line that could not be decoded, the number of tweets decoded
+    before it, so that the retries can be spent at the same point as when decoding serially.
+    """
+
+    tweets = list()
+    errors = list()
+
+    for line in lines:
+        try:
+            tweet = _parse_line(line, filter_retweets, fields)
+        except (json.decoder.JSONDecodeError, UnicodeDecodeError):
+            errors.append(len(tweets))
+            continue
+
+        if tweet is not None:
+            tweets.append(tweet)
+
+    return tweets, errors
+
+
+def _lines(access, params, compression=True, backfill=None, stop=None, progress=None):
+    """
+    This function keeps a connection to the Twitter Streaming API open with the introduced parameters, reconnecting
+    whenever it gets closed, and yields the raw messages retrieved from it. The connection is read in large chunks,
+    gzip-compressed unless `compression` is `False`, which are incrementally decompressed and split into messages by
+    :mod:`twipper.framing`, so keep-alive lines are skipped. If a `backfill` search function is introduced, the tweets
+    posted while disconnected are searched after every reconnection and yielded as messages (see
+    :obj:`twipper.streaming._Healer`). If a `stop` event is introduced, the connection is closed and not reopened as
+    soon as any data or keep-alive is received once it is set. Keep-alives are yielded as empty messages, so that the
+    consumers can act while the stream is idle. Connections which fail, either because of a network
+    error or because of a server error or a rate limit (the rest of the HTTP errors are raised straight away), are
+    reopened after backing off (see `BACKOFF`) as long as there are retries left on `progress`, so that the state of
+    the backfill is kept across disconnections; once they are exhausted, the error is raised.
+    """
+
+    url = 'https://stream.twitter.com/1.1/statuses/filter.json'
 
     headers = {
         'Content-Type': 'application/json',
+        'Accept-Encoding': 'gzip' if compression else 'identity',
     }
 
-    if isinstance(retry, str) and retry == 'no_limit':
-        retries = -1
-    else:
-        retries = retry
+    healer = _Healer(backfill) if backfill is not None else None
+
+    progress = progress if progress is not None else {'retries': 0}
+    failures = dict()
+
+    def back_off(kind, error):
+        if progress['retries'] == 0:
+            raise error
+
+        _spend_retry(progress)
 
-    flag = False
+        initial, maximum = BACKOFF[kind]
+
+        attempt = failures.get(kind, 0)
+        failures.clear()
+        failures[kind] = attempt + 1
+
+        delay = min(maximum, initial * (attempt + 1) if kind == 'network' else initial * 2 ** attempt)
+
+        if stop is not None:
+            stop.wait(delay)
+        else:
+            time.sleep(delay)
+
+    while stop is None or not stop.is_set():
+        try:
+            response = access.transport.request('POST', url, auth=access.oauth, headers=headers, params=params,
+                                                stream=True)
+        except _DISCONNECTS as e:
+            back_off('network', ConnectionError('connection could not be established: ' + str(e)))
+            continue
+
+        if response.status_code != 200:
+            error = ConnectionError('connection errored with code ' + str(response.status_code) + '.')
+
+            response.close()
+
+            if response.status_code in (420, 429):
+                back_off('rate_limit', error)
+            elif response.status_code >= 500:
+                back_off('http', error)
+            else:
+                raise error
+
+            continue
+
+        failures.clear()
+
+        if healer is not None:
+            for message in healer.heal():
+                yield message
+
+        chunks = response.raw.stream(READ_SIZE, decode_content=False)
+
+        if stop is not None:
+            chunks = _until(chunks, stop)
+
+        chunks = decompress(chunks, encoding=response.headers.get('Content-Encoding'))
+
+        try:
+            for message in iter_messages(chunks, delimited=params.get('delimited'), keep_alives=True):
+                if healer is None or healer.observe(message):
+                    yield message
+        except _DISCONNECTS as e:
+            back_off('network', ConnectionError('connection was lost: ' + str(e)))
+        finally:
+            response.close()
+
+
+def _until(chunks, stop):
+    for chunk in chunks:
+        if stop.is_set():
+            return
+
+        yield chunk
+
+
+def _sampled(lines, sampler, done, filter_retweets):
+    """
+    This function offers the introduced raw messages to the sampler, yielding just the ones admitted into its sample.
+    Retweets are not offered if they are being filtered out, which is checked without decoding them, as the name of the
+    `retweeted_status` field followed by a colon can just appear unescaped as a field, and not within a string.
+    """
+
+    for line in lines:
+        if done():
+            return
+
+        if filter_retweets and _RETWEET.search(line):
+            continue
+
+        if sampler.offer(line):
+            yield line
+
+
+def _stream(access, params, filter_retweets, tweet_limit, date_limit, retries, route=None,
+            fields=None, workers=None, chunk_size=100, ordered=True, compression=True, backfill=None, stop=None,
+            sampler=None):
+    """
+    This function yields the tweets retrieved from the Twitter Streaming API with the introduced parameters until either
+    the tweet limit or the date limit is reached (being 1000 tweets the limit if none of them is specified), or until
+    the retries are exhausted. If a `route` function is introduced, every tweet is yielded as the value it returns, and
+    discarded if it returns `None`. If `workers` is introduced, lines are decoded, filtered and projected to `fields`
+    on a pool of processes in chunks of `chunk_size` lines, and `route` receives the projected tweets. If a `backfill`
+    search function is introduced, the tweets posted while disconnected are merged into the stream on reconnection.
+    If a `stop` event is introduced, the stream ends as soon as it is set and any data or keep-alive is received.
+    If a `sampler` is introduced, just the messages it admits into its sample are decoded.
+    """
 
     if tweet_limit:
-        tweet_counter = 0
+        date_limit = None
+    elif date_limit is None:
+        tweet_limit = 1000
 
-        while flag is False:
-            response = requests.post(url, auth=oauth, headers=headers, params=params, stream=True)
+    progress = {
+        'tweets': 0,
+        'retries': retries,
+    }
 
-            if response.status_code != 200:
-                raise ConnectionError('connection errored with code ' + str(response.status_code))
+    def done():
+        if tweet_limit and tweet_limit == progress['tweets']:
+            return True
 
-            for line in response.iter_lines():
-                if not line:
-                    break
+        if date_limit is not None and datetime.datetime.now().strftime('%Y%m%d%H%M') >= date_limit:
+            return True
 
-                if tweet_limit == tweet_counter:
-                    flag = True
-                    break
+        if stop is not None and stop.is_set():
+            return True
 
-                if retries == 0:
-                    flag = True
-                    break
+        return progress['retries'] == 0
+
+    lines = _lines(access, params, compression, backfill, stop, progress)
+
+    if sampler is not None:
+        lines = _sampled(lines, sampler, done, filter_retweets)
+
+    if workers:
+        tweets = _parse_parallel(lines, done, progress, filter_retweets, fields, workers, chunk_size, ordered)
+    else:
+        tweets = _parse_serial(lines, done, progress, filter_retweets, fields)
 
-                try:
-                    tweet = json.loads(line.decode('utf-8'))
-                except json.decoder.JSONDecodeError:
-                    retries -= 1
+    try:
+        for tweet in tweets:
+            if route is not None:
+                tweet = route(tweet)
+
+                if tweet is None:
                     continue
 
-                if filter_retweets:
-                    if 'retweeted_status' not in tweet:
-                        yield tweet
-                        tweet_counter += 1
-                else:
-                    yield tweet
-                    tweet_counter += 1
+            yield tweet
+            progress['tweets'] += 1
 
-    elif date_limit is not None:
+            if tweet_limit and tweet_limit == progress['tweets']:
+                break
+    finally:
+        tweets.close()
 
-        while flag is False:
-            response = requests.post(url, auth=oauth, headers=headers, params=params, stream=True)
 
-            if response.status_code != 200:
-                raise ConnectionError('connection errored with code ' + str(response.status_code))
+class _Healer(object):
+    """
+    _Healer heals the gaps left on a stream by its disconnections: it keeps track of the id of the last tweet retrieved
+    and, once reconnected, searches the tweets posted since then with the introduced search function, which receives
+    the time interval of the gap (as milliseconds since the Unix epoch). Both the streamed and the backfilled tweets are
+    de-duplicated against the ids of the last `size` tweets, which are peeked from the raw messages without decoding
+    them, as Twitter always sends `created_at` and `id` as the first fields of a tweet.
+    """
 
-            for line in response.iter_lines():
-                if not line:
-                    break
+    def __init__(self, search, size=RECENT_IDS):
+        self.search = search
+        self.last_id = None
+        self.connected = None
 
-                current_date = datetime.datetime.now().strftime('%Y%m%d%H%M')
-                if current_date >= date_limit:
-                    flag = True
-                    break
+        self._recent = deque()
+        self._ids = set()
+        self._size = size
 
-                if retries == 0:
-                    flag = True
-                    break
+    def _remember(self, tweet_id):
+        if tweet_id in self._ids:
+            return False
 
-                try:
-                    tweet = json.loads(line.decode('utf-8'))
-                except json.decoder.JSONDecodeError:
-                    retries -= 1
-                    continue
+        self._ids.add(tweet_id)
+        self._recent.append(tweet_id)
 
-                if filter_retweets:
-                    if 'retweeted_status' not in tweet:
-                        yield tweet
-                else:
-                    yield tweet
+        if len(self._recent) > self._size:
+            self._ids.discard(self._recent.popleft())
 
-    else:
-        tweet_limit = 1000
-        tweet_counter = 0
+        self.last_id = tweet_id if self.last_id is None else max(self.last_id, tweet_id)
 
-        while flag is False:
-            response = requests.post(url, auth=oauth, headers=headers, params=params, stream=True)
+        return True
 
-            if response.status_code != 200:
-                raise ConnectionError('connection errored with code ' + str(response.status_code))
+    def observe(self, message):
+        """
+        This function records the introduced streamed message, returning `False` if it is a tweet already retrieved.
+        """
 
-            for line in response.iter_lines():
-                if not line:
-                    break
+        match = _TWEET_ID.match(message)
 
-                if tweet_limit == tweet_counter:
-                    flag = True
-                    break
+        return match is None or self._remember(int(match.group(1)))
+
+    def heal(self):
+        """
+        This function searches the tweets posted since the last tweet retrieved (or since the previous connection, if
+        none was retrieved) and returns the ones not retrieved yet as messages, sorted by id, or none on the first
+        connection or if the search fails, so that the stream is never interrupted by it.
+        """
+
+        now = int(time.time() * 1000)
+
+        start = snowflake_to_timestamp(self.last_id) if self.last_id is not None else self.connected
+        last_id, self.connected = self.last_id, now
+
+        if start is None:
+            return list()
+
+        try:
+            tweets = self.search(start, now)
+        except (ConnectionError, IndexError, RuntimeError, ValueError):
+            return list()
+
+        messages = list()
+
+        for tweet in sorted(tweets, key=lambda tweet: int(tweet['id'])):
+            if last_id is not None and int(tweet['id']) <= last_id:
+                continue
+
+            if self._remember(int(tweet['id'])):
+                messages.append(json.dumps(tweet).encode('utf-8'))
+
+        return messages
+
+
+def _track_to_query(track):
+    """
+    This function translates a `track` parameter of the Twitter Streaming API, whose comma-separated phrases are OR'ed
+    and whose space-separated keywords are AND'ed, into a search query.
+    """
+
+    phrases = [phrase.strip() for phrase in track.split(',') if phrase.strip()]
+
+    return ' OR '.join('(' + phrase + ')' if ' ' in phrase and len(phrases) > 1 else phrase for phrase in phrases)
+
+
+def _backfill_search(access, source, query, language, filter_retweets, page_count):
+    """
+    This function creates the search function used to backfill the gaps of a stream, which searches the introduced
+    query on either the `batch` or the `premium` API over the minutes spanned by the introduced time interval.
+    """
+
+    def search(start, end):
+        start, end = start // 60000 * 60000, max(-(-end // 60000), start // 60000 + 1) * 60000
+
+        from_date, to_date = (datetime.datetime.fromtimestamp(value / 1000., datetime.timezone.utc)
+                              .strftime('%Y%m%d%H%M') for value in (start, end))
+
+        if source == 'premium':
+            return premium.search_tweets(access, query, page_count, from_date, to_date, language=language,
+                                         filter_retweets=filter_retweets)
+
+        return batch.search_tweets(access, query, page_count=page_count, filter_retweets=filter_retweets,
+                                   language=language, result_type='recent', from_date=from_date, to_date=to_date)
+
+    return search
+
+
+def _spend_retry(progress):
+    """
+    This function spends one of the retries left, unless there is no limit of retries (`-1`) or they are exhausted.
+    """
+
+    if progress['retries'] > 0:
+        progress['retries'] -= 1
+
+
+def _parse_serial(lines, done, progress, filter_retweets, fields):
+    for line in lines:
+        if done():
+            break
+
+        # keep-alives
+        if not line:
+            continue
+
+        try:
+            tweet = _parse_line(line, filter_retweets, fields)
+        except (json.decoder.JSONDecodeError, UnicodeDecodeError):
+            _spend_retry(progress)
+            continue
+
+        if tweet is not None:
+            yield tweet
+
+
+def _parse_parallel(lines, done, progress, filter_retweets, fields, workers, chunk_size, ordered):
+    """
+    This function hands the introduced lines to a pool of `workers` processes in chunks of `chunk_size` lines, so that
+    decoding scales across cores while the connection is still read from a single thread. Up to two chunks per worker
+    are in flight at the same time, and tweets are yielded in the order they were retrieved if `ordered` is `True`, or
+    as soon as their chunk is parsed otherwise. Partial chunks are handed over once `CHUNK_DELAY` seconds have passed
+    since their first line was read, or as soon as a keep-alive shows that the stream is idle, so that tweets are not
+    held back on low-rate streams.
+    """
+
+    executor = ProcessPoolExecutor(max_workers=workers)
+
+    pending = deque()
+
+    def results(block):
+        while pending:
+            if ordered:
+                if not block and not pending[0].done():
+                    return
+
+                future = pending.popleft()
+            else:
+                finished = [future for future in pending if future.done()]
+
+                if not finished:
+                    if not block:
+                        return
+
+                    finished = list(wait(pending, return_when=FIRST_COMPLETED).done)
+
+                future = finished[0]
+                pending.remove(future)
 
-                if retries == 0:
-                    flag = True
+            tweets, errors = future.result()
+
+            errors = deque(errors)
+
+            for position in range(len(tweets) + 1):
+                while errors and errors[0] == position:
+                    errors.popleft()
+                    _spend_retry(progress)
+
+                    if progress['retries'] == 0:
+                        return
+
+                if position < len(tweets):
+                    yield tweets[position]
+
+            block = block and len(pending) >= 2 * workers
+
+    try:
+        chunk = list()
+        error = None
+
+        try:
+            for line in lines:
+                if done():
                     break
 
-                try:
-                    tweet = json.loads(line.decode('utf-8'))
-                except json.decoder.JSONDecodeError:
-                    retries -= 1
-                    continue
+                if line:
+                    if not chunk:
+                        started = time.time()
 
-                if filter_retweets:
-                    if 'retweeted_status' not in tweet:
-                        yield tweet
-                        tweet_counter += 1
+                    chunk.append(line)
+
+                    if len(chunk) < chunk_size and time.time() - started < CHUNK_DELAY:
+                        continue
+
+                    idle = False
+                elif chunk:
+                    idle = True
                 else:
+                    continue
+
+                pending.append(executor.submit(_parse_chunk, chunk, filter_retweets, fields))
+                chunk = list()
+
+                # an idle stream has nothing else to read meanwhile, so its tweets are awaited
+                for tweet in results(block=idle or len(pending) >= 2 * workers):
                     yield tweet
-                    tweet_counter += 1
+        except ConnectionError as e:
+            # lines are read ahead of the tweets being yielded, so the ones already read are yielded before failing
+            error = e
+
+        if chunk and not done():
+            pending.append(executor.submit(_parse_chunk, chunk, filter_retweets, fields))
+
+        while pending and not done():
+            for tweet in results(block=True):
+                yield tweet
+
+        if error is not None and not done():
+            raise error
+    finally:
+        for future in pending:
+            future.cancel()
+
+        executor.shutdown(wait=False)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018-2019 Alvaro Bartolome
+# See LICENSE for details.
+
+import base64
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests_oauthlib import OAuth1
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+DEFAULT_TIMEOUT = (10, 90)
+
+USER_AGENT = 'twipper'
+
+
+class Transport(object):
+    """
+    Transport is the HTTP layer every request of twipper to the Twitter API goes through, keeping a pool of persistent
+    connections (so that the TLS handshake is just paid once per host instead of once per page) with configurable
+    sizes, timeouts and retries. Requests are sent with a :obj:`requests.Session`, unless HTTP/2 is enabled, in which
+    case they are sent with an :obj:`httpx.Client` (which multiplexes every request to the same host over a single
+    connection); streaming connections are always sent through the :obj:`requests.Session`, as they are long-lived.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, max_retries=0, timeout=DEFAULT_TIMEOUT, http2=False):
+        """
+        This function is the constructor of :obj:`twipper.transport.Transport` class.
+
+        Args:
+            pool_connections (:obj:`int`, optional): number of hosts whose connections are pooled, default is 10.
+            pool_maxsize (:obj:`int`, optional): maximum number of connections kept per host, default is 10.
+            max_retries (:obj:`int`, optional): number of retries of failed connections, default is 0.
+            timeout (:obj:`float` or :obj:`tuple`, optional):
+                default timeout of every request in seconds, either a number or a `(connect, read)` tuple, default is
+                `(10, 90)` since Twitter sends a keep-alive line every 30 seconds on streaming connections.
+            http2 (:obj:`boolean`, optional): whether to send non-streaming requests over HTTP/2, default is `False`.
+
+        Raises:
+            ValueError: raised if the introduced arguments do not match or errored.
+            ImportError: raised if HTTP/2 is enabled but `httpx` is not installed.
+        """
+
+        if not isinstance(pool_connections, int) or pool_connections < 1:
+            raise ValueError('pool_connections must be an `int` equal or higher than 1!')
+
+        if not isinstance(pool_maxsize, int) or pool_maxsize < 1:
+            raise ValueError('pool_maxsize must be an `int` equal or higher than 1!')
+
+        if not isinstance(http2, bool):
+            raise ValueError('http2 must be a `boolean`!')
+
+        self.timeout = timeout
+        self.http2 = http2
+
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=max_retries)
+
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.client = None
+
+        if http2:
+            if httpx is None:
+                raise ImportError('httpx is required to use HTTP/2, install it with `pip install httpx[http2]`.')
+
+            limits = httpx.Limits(max_connections=pool_connections * pool_maxsize,
+                                  max_keepalive_connections=pool_maxsize)
+
+            self.client = httpx.Client(timeout=_httpx_timeout(timeout), headers={'User-Agent': USER_AGENT},
+                                       transport=httpx.HTTPTransport(http2=True, retries=max_retries, limits=limits))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def request(self, method, url, auth=None, headers=None, params=None, data=None, stream=False, timeout=None):
+        """
+        This function sends a request through the pooled connections of the transport.
+
+        Args:
+            method (:obj:`str`): HTTP method of the request, such as `GET` or `POST`.
+            url (:obj:`str`): url of the request.
+            auth (:obj:`requests_oauthlib.OAuth1` or :obj:`tuple`, optional): OAuth1 or basic authentication.
+            headers (:obj:`dict`, optional): headers of the request.
+            params (:obj:`dict`, optional): parameters to be included on the query string of the url.
+            data (:obj:`str` or :obj:`dict`, optional): body of the request.
+            stream (:obj:`boolean`, optional): whether the body of the response should be streamed, default is `False`.
+            timeout (:obj:`float` or :obj:`tuple`, optional): timeout of the request, default is the transport one.
+
+        Returns:
+            :obj:`requests.Response` or :obj:`httpx.Response` - response:
+                Returns the response, which exposes `status_code`, `headers`, `content` and `json()` either way.
+        """
+
+        timeout = self.timeout if timeout is None else timeout
+
+        if self.client is None or stream:
+            return self.session.request(method, url, auth=auth, headers=headers, params=params, data=data,
+                                        stream=stream, timeout=timeout)
+
+        request = self.client.build_request(method, url, headers=headers, params=params,
+                                            data=data if isinstance(data, dict) else None,
+                                            content=data if data is not None and not isinstance(data, dict) else None)
+
+        if auth is not None:
+            body = request.content.decode('utf-8') if request.content else None
+
+            request.headers['Authorization'] = authorization(auth, method, str(request.url), body=body,
+                                                             headers=dict(request.headers))
+
+        return self.client.send(request)
+
+    def close(self):
+        """
+        This function closes every pooled connection of the transport.
+        """
+
+        self.session.close()
+
+        if self.client is not None:
+            self.client.close()
+
+
+def authorization(auth, method, url, body=None, headers=None):
+    """
+    This function generates the value of the `Authorization` header of a request sent without :mod:`requests` (which
+    signs them on its own), either signing it with OAuth1 or encoding the basic authentication credentials.
+
+    Args:
+        auth (:obj:`requests_oauthlib.OAuth1` or :obj:`tuple`): OAuth1 or basic authentication.
+        method (:obj:`str`): HTTP method of the request, such as `GET` or `POST`.
+        url (:obj:`str`): url of the request, including its query string.
+        body (:obj:`str`, optional): form-encoded body of the request, which is signed along with the url.
+        headers (:obj:`dict`, optional): headers of the request.
+
+    Returns:
+        :obj:`str` - authorization:
+            Returns the value of the `Authorization` header.
+    """
+
+    if isinstance(auth, OAuth1):
+        _, signed_headers, _ = auth.client.sign(url, http_method=method.upper(), body=body, headers=headers or dict())
+
+        value = signed_headers.get('Authorization', signed_headers.get(b'Authorization'))
+
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    credentials = (auth[0] + ':' + auth[1]).encode('utf-8')
+
+    return 'Basic ' + base64.b64encode(credentials).decode('ascii')
+
+
+def _httpx_timeout(timeout):
+    if isinstance(timeout, tuple):
+        return httpx.Timeout(timeout[1], connect=timeout[0])
+
+    return httpx.Timeout(timeout)
+
+
+_default = None
+_lock = threading.Lock()
+
+
+def get_transport():
+    """
+    This function retrieves the transport shared by every :obj:`twipper.credentials.Twipper` object created without
+    a transport of its own, as well as by the functions which do not require credentials, creating it on first use.
+    """
+
+    global _default
+
+    with _lock:
+        if _default is None:
+            _default = Transport()
+
+        return _default
+
+
+def set_transport(transport):
+    """
+    This function replaces the shared transport retrieved with :func:`twipper.transport.get_transport`.
+    """
+
+    global _default
+
+    if not isinstance(transport, Transport):
+        raise ValueError('transport must be a `twipper.transport.Transport`!')
+
+    with _lock:
+        _default = transport
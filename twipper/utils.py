@@ -4,9 +4,17 @@
 # Copyright 2018-2019 Alvaro Bartolome
 # See LICENSE for details.
 
+import calendar
+import datetime
 import json
-import requests
-import re
+
+from twipper.query import compile_query
+from twipper.transport import get_transport
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 def available_languages(api):
@@ -17,7 +25,7 @@ def available_languages(api):
     https://developer.twitter.com/en/docs/developer-utilities/supported-languages/api-reference/get-help-languages.html
 
     Args:
-        api (:obj:`oauth2.Client`): api object with access to api.twitter
+        api (:obj:`twipper.credentials.Twipper` or :obj:`oauth2.Client`): object with access to api.twitter
 
     Returns:
         :obj:`list` - languages:
@@ -32,11 +40,16 @@ def available_languages(api):
 
     url = 'https://api.twitter.com/1.1/help/languages.json'
 
-    response, content = api.request(url, method='GET')
+    if hasattr(api, 'transport'):
+        response = api.transport.request('GET', url, auth=api.oauth)
+        status, content = response.status_code, response.content
+    else:
+        response, content = api.request(url, method='GET')
+        status = response.status
 
-    if response.status != 200:
+    if status != 200:
         raise ConnectionError('connection to `api.twitter` could not be established (HTTP Error ' +
-                              str(response.status) + ').')
+                              str(status) + ').')
 
     try:
         data = json.loads(content.decode('utf-8'))
@@ -79,7 +92,7 @@ def country_to_bounding_box(country):
 
     url = 'http://nominatim.openstreetmap.org/search?q=' + country + '&format=json'
 
-    req = requests.get(url)
+    req = get_transport().request('GET', url)
 
     if req.status_code != 200:
         raise ConnectionError('connection errored with code ' + str(req.status_code))
@@ -92,7 +105,7 @@ def country_to_bounding_box(country):
     try:
         result = result[0]["boundingbox"]
     except IndexError:
-        return IndexError('error accessing json object')
+        raise IndexError('error accessing json object')
 
     coordinates = [2, 0, 3, 1]  # western, south, east, north
 
@@ -129,9 +142,7 @@ def standard_query(query):
     if query is not None and not isinstance(query, str):
         raise ValueError('`query` parameter is mandatory and should be a str!')
 
-    query = ''.join(re.findall('[a-zA-Zá-üÁ-Ü0-9]+', query))
-
-    query = query.replace('AND', ' ').replace('OR', ' OR ').replace('NOT', '-')
+    query = compile_query(query, syntax='standard')
 
     if len(query) > 0:
         return query
@@ -155,7 +166,8 @@ def streaming_query(query):
             initial query is now converted to the required format.
 
     Raises:
-        ValueError: raised if the introduced arguments do not match or errored.
+        ValueError: raised if the introduced arguments do not match or errored, or if the query contains operators
+            not supported by Twitter Streaming (such as NOT).
         RuntimeError: raised if the resulting query is not valid.
     """
 
@@ -165,11 +177,156 @@ def streaming_query(query):
     if query is not None and not isinstance(query, str):
         raise ValueError('`query` parameter is mandatory and should be a str!')
 
-    query = ''.join(re.findall('[a-zA-Zá-üÁ-Ü0-9]+', query))
-
-    query = query.replace('AND', ' ').replace('OR', ',').replace('NOT', '-')
+    query = compile_query(query, syntax='streaming')
 
     if len(query) > 0:
         return query
     else:
         raise RuntimeError('`query formatting failed due to introduced query error')
+
+
+TWITTER_EPOCH = 1288834974657
+
+
+def snowflake_to_timestamp(tweet_id):
+    """
+    This function retrieves the creation time of a tweet straight from its id, since every id generated by Twitter
+    since November 2010 (known as snowflake id) contains the time it was created at on its highest 41 bits, as the
+    milliseconds elapsed since the Twitter epoch. So on, there is no need to parse the `created_at` field of the tweet.
+
+    Args:
+        tweet_id (:obj:`int` or :obj:`str`): id of the tweet (either `id` or `id_str`).
+
+    Returns:
+        :obj:`int` - timestamp:
+            Returns the creation time of the tweet as the milliseconds elapsed since the Unix epoch.
+    """
+
+    return (int(tweet_id) >> 22) + TWITTER_EPOCH
+
+
+def timestamp_to_snowflake(timestamp):
+    """
+    This function generates the lowest snowflake id that Twitter could have generated on the introduced time, so that
+    it can be used as an id bound to retrieve the tweets created before or after it.
+
+    Args:
+        timestamp (:obj:`int`): time as the milliseconds elapsed since the Unix epoch.
+
+    Returns:
+        :obj:`int` - tweet_id:
+            Returns the lowest snowflake id generated on the introduced time.
+    """
+
+    return max(0, int(timestamp) - TWITTER_EPOCH) << 22
+
+
+def snowflakes_to_timestamps(tweet_ids):
+    """
+    This function retrieves the creation time of every tweet of the introduced batch straight from their ids, just like
+    :func:`twipper.utils.snowflake_to_timestamp` does for a single tweet. If NumPy is installed, the whole batch is
+    decoded at once with vectorized operations over an `int64` array, which is returned; otherwise a :obj:`list` is.
+
+    Args:
+        tweet_ids (:obj:`iterable`): ids of the tweets, either as :obj:`int` or :obj:`str`.
+
+    Returns:
+        :obj:`numpy.ndarray` or :obj:`list` - timestamps:
+            Returns the creation time of every tweet as the milliseconds elapsed since the Unix epoch.
+    """
+
+    if np is None:
+        return [(int(tweet_id) >> 22) + TWITTER_EPOCH for tweet_id in tweet_ids]
+
+    if not isinstance(tweet_ids, np.ndarray):
+        tweet_ids = np.fromiter((int(tweet_id) for tweet_id in tweet_ids), dtype=np.int64)
+
+    return (tweet_ids.astype(np.int64, copy=False) >> 22) + TWITTER_EPOCH
+
+
+def tweet_timestamp(tweet):
+    """
+    This function retrieves the creation time of a tweet as the milliseconds elapsed since the Unix epoch, from its
+    `timestamp_ms` field (just included on the tweets retrieved from the Twitter Streaming API) or from its id, so the
+    `created_at` field of the tweet never needs to be parsed.
+    """
+
+    if 'timestamp_ms' in tweet:
+        return int(tweet['timestamp_ms'])
+
+    return snowflake_to_timestamp(tweet['id'])
+
+
+def date_to_timestamp(date, date_format='%Y%m%d%H%M'):
+    """
+    This function converts the introduced UTC date into the milliseconds elapsed since the Unix epoch. Dates formatted
+    as `yyyymmddhhmm` (as required by the premium search) are converted without :func:`datetime.datetime.strptime`.
+
+    Args:
+        date (:obj:`str`): date formatted as specified by `date_format`.
+        date_format (:obj:`str`, optional): format of the date, default is `%Y%m%d%H%M` (`yyyymmddhhmm`).
+
+    Returns:
+        :obj:`int` - timestamp:
+            Returns the introduced date as the milliseconds elapsed since the Unix epoch.
+
+    Raises:
+        ValueError: raised if the introduced date does not match the format.
+    """
+
+    if date_format == '%Y%m%d%H%M':
+        if not isinstance(date, str) or len(date) != 12 or not date.isdigit():
+            raise ValueError('incorrect date format, it should be `yyyymmddhhmm`')
+
+        try:
+            date = datetime.datetime(int(date[0:4]), int(date[4:6]), int(date[6:8]), int(date[8:10]), int(date[10:12]))
+        except ValueError:
+            raise ValueError('incorrect date format, it should be `yyyymmddhhmm`')
+    else:
+        date = datetime.datetime.strptime(date, date_format)
+
+    return calendar.timegm(date.timetuple()) * 1000
+
+
+def time_window_to_ids(start=None, end=None):
+    """
+    This function translates the introduced time window into the `since_id` and `max_id` parameters of the Twitter
+    API, so that searches can be limited to a time window just with id bounds, since tweet ids are snowflakes.
+
+    Args:
+        start (:obj:`int`, optional): start of the window as milliseconds since epoch (inclusive), default is `None`.
+        end (:obj:`int`, optional): end of the window as milliseconds since epoch (exclusive), default is `None`.
+
+    Returns:
+        :obj:`tuple` - ids:
+            Returns a :obj:`tuple` containing `since_id` (exclusive) and `max_id` (inclusive), which are `None` if the
+            window is not bounded on that side.
+    """
+
+    since_id = None if start is None else max(0, timestamp_to_snowflake(start) - 1)
+    max_id = None if end is None else max(0, timestamp_to_snowflake(end) - 1)
+
+    return since_id, max_id
+
+
+def full_text(tweet):
+    """
+    This function retrieves the complete text of a tweet, which is the `full_text` of its `extended_tweet` when
+    retrieved from the Twitter Streaming API, the `full_text` when retrieved with `tweet_mode=extended` or the `text`
+    otherwise.
+
+    Args:
+        tweet (:obj:`dict`): tweet as retrieved from the Twitter API.
+
+    Returns:
+        :obj:`str` - text:
+            Returns the complete text of the tweet.
+    """
+
+    if 'extended_tweet' in tweet and 'full_text' in tweet['extended_tweet']:
+        return tweet['extended_tweet']['full_text']
+
+    if 'full_text' in tweet:
+        return tweet['full_text']
+
+    return tweet.get('text') or ''